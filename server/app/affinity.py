@@ -0,0 +1,325 @@
+'''
+Game affinity dispatcher in front of N uvicorn workers.
+
+With `uvicorn --workers 4` the kernel spreads connections over the workers,
+so consecutive moves of one game land on arbitrary processes and the
+per-process state (loaded bots in call_c.library_cache, the upload toolkit,
+the stats deltas) is cold most of the time. Instead this process starts the
+workers itself, each on its own unix socket, and proxies every request:
+
+- /api/move/* requests are hashed with rendezvous (highest random weight)
+  hashing: the key is the game id (X-Game-Id header or ?game_id=) when the
+  client sends one, else the bot path (archive/<group>/<id>, ai/<aiId>...),
+  and the request goes to the healthy worker with the highest
+  blake2b(key, worker) score. When a worker dies only its own keys move to
+  the others, and they come back to it once it is healthy again.
+- every other request goes to the healthy worker with the fewest requests
+  in flight.
+
+A monitor task restarts dead workers with an exponential backoff and only
+routes to a (re)started worker once it answers /ping.
+
+    python -m app.affinity --workers 4 --port 8000
+'''
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Optional
+from urllib.parse import parse_qs
+
+import httpx
+
+SOCKET_DIR = os.environ.get("RVC_WORKER_SOCKET_DIR", "/tmp/reverc-workers")
+MOVE_PREFIX = "/api/move/"
+GAME_ID_HEADER = b"x-game-id"
+
+MONITOR_INTERVAL = 1.0      # seconds between liveness checks
+STARTUP_TIMEOUT = 60.0      # seconds the dispatcher waits for the first healthy worker
+MAX_BACKOFF = 30.0          # seconds between restarts of a crash-looping worker
+STABLE_UPTIME = 30.0        # a worker up that long resets its backoff
+PROXY_TIMEOUT = 120.0       # uploads compile and run the test games
+# Request bodies are buffered for retries, never more than the workers accept
+# (app.routers.upload.MAX_UPLOAD_BODY, not imported to keep the app out of this process)
+MAX_BODY = int(os.environ.get("RVC_PROXY_MAX_BODY", str(500 * 1024 + 16 * 1024)))
+
+# Hop-by-hop headers, and the ones httpx sets itself
+DROP_REQUEST_HEADERS = {b"host", b"connection", b"keep-alive", b"transfer-encoding", b"content-length", b"upgrade"}
+# Responses are relayed raw, still encoded: content-length and content-encoding stay valid
+DROP_RESPONSE_HEADERS = {"connection", "keep-alive", "transfer-encoding"}
+
+
+def rendezvous_score(key: str, worker_name: str) -> int:
+    digest = hashlib.blake2b(f"{key}\0{worker_name}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def affinity_key(scope) -> Optional[str]:
+    """ Routing key of a move request: its game id, else the bot path; None for other routes """
+    path = scope["path"]
+    if not path.startswith(MOVE_PREFIX):
+        return None
+    for key, value in scope.get("headers", ()):
+        if key == GAME_ID_HEADER and value:
+            return "game:" + value.decode("latin-1")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if query.get("game_id"):
+        return "game:" + query["game_id"][0]
+    return "bot:" + path[len(MOVE_PREFIX):]
+
+
+class Worker:
+    def __init__(self, index: int, socket_dir: str):
+        self.name = f"worker-{index}"
+        self.socket_path = os.path.join(socket_dir, f"{self.name}.sock")
+        self.process: Optional[subprocess.Popen] = None
+        self.healthy = False
+        self.in_flight = 0
+        self.restarts = 0
+        self.failures = 0
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=self.socket_path),
+            base_url="http://worker",
+            timeout=PROXY_TIMEOUT,
+        )
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--uds", self.socket_path,
+        ])
+        self.healthy = False
+        self.started_at = time.monotonic()
+        print(f"Affinity: started {self.name} (pid {self.process.pid})", flush=True)
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    async def ping(self) -> bool:
+        try:
+            response = await self.client.get("/ping", timeout=2.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "pid": self.process.pid if self.process else None,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "restarts": self.restarts,
+        }
+
+
+class Dispatcher:
+    """ ASGI app proxying to the workers; its lifespan owns the worker processes """
+
+    def __init__(self, workers: int, socket_dir: str = SOCKET_DIR):
+        os.makedirs(socket_dir, exist_ok=True)
+        self.workers = [Worker(i, socket_dir) for i in range(workers)]
+        self._monitor: Optional[asyncio.Task] = None
+
+    # ---------- worker management ----------
+
+    async def _check(self, worker: Worker):
+        now = time.monotonic()
+        if worker.alive():
+            if not worker.healthy and await worker.ping():
+                worker.healthy = True
+                print(f"Affinity: {worker.name} is healthy", flush=True)
+            return
+
+        if worker.process is not None and worker.next_start == 0.0:
+            # Just found dead: schedule the restart
+            worker.healthy = False
+            uptime = now - worker.started_at
+            worker.failures = 0 if uptime >= STABLE_UPTIME else worker.failures + 1
+            delay = min(MAX_BACKOFF, 0.5 * 2 ** worker.failures) if worker.failures else 0.0
+            worker.next_start = now + delay
+            print(f"WARNING: {worker.name} exited with {worker.process.returncode}, "
+                  f"restarting in {delay:.1f}s", flush=True)
+        if now >= worker.next_start:
+            if worker.process is not None:
+                worker.restarts += 1
+            worker.next_start = 0.0
+            worker.start()
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.gather(*(self._check(w) for w in self.workers))
+            await asyncio.sleep(MONITOR_INTERVAL)
+
+    async def startup(self):
+        for worker in self.workers:
+            worker.start()
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.gather(*(self._check(w) for w in self.workers))
+            if all(w.healthy for w in self.workers):
+                break
+            await asyncio.sleep(0.2)
+        if not any(w.healthy for w in self.workers):
+            print("WARNING: no worker became healthy, requests get 503 until one does", flush=True)
+        self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def shutdown(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            if worker.process is not None:
+                try:
+                    await asyncio.to_thread(worker.process.wait, 30)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+            await worker.client.aclose()
+
+    # ---------- routing ----------
+
+    def pick(self, key: Optional[str], exclude: set) -> Optional[Worker]:
+        candidates = [w for w in self.workers if w.healthy and w.name not in exclude]
+        if not candidates:
+            return None
+        if key is None:
+            return min(candidates, key=lambda w: w.in_flight)
+        return max(candidates, key=lambda w: rendezvous_score(key, w.name))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._proxy(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _proxy(self, scope, receive, send):
+        if scope["path"] == "/affinity/workers":
+            body = json.dumps([w.status() for w in self.workers]).encode()
+            await _respond(send, 200, b"application/json", body)
+            return
+
+        length = dict(scope.get("headers", ())).get(b"content-length")
+        if length is not None and (not length.isdigit() or int(length) > MAX_BODY):
+            await _respond(send, 413, b"text/plain", b"Request body too large")
+            return
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.extend(message.get("body", b""))
+            if len(body) > MAX_BODY:
+                await _respond(send, 413, b"text/plain", b"Request body too large")
+                return
+            if not message.get("more_body"):
+                break
+
+        headers = [(k, v) for k, v in scope.get("headers", ()) if k not in DROP_REQUEST_HEADERS]
+        client = scope.get("client")
+        if client:
+            forwarded = client[0]
+            for i, (k, v) in enumerate(headers):
+                if k == b"x-forwarded-for":
+                    forwarded = f"{v.decode('latin-1')}, {client[0]}"
+                    del headers[i]
+                    break
+            headers.append((b"x-forwarded-for", forwarded.encode("latin-1")))
+
+        url = scope.get("raw_path") or scope["path"].encode()
+        if scope.get("query_string"):
+            url += b"?" + scope["query_string"]
+
+        key = affinity_key(scope)
+        tried = set()
+        while True:
+            worker = self.pick(key, tried)
+            if worker is None:
+                await _respond(send, 503, b"text/plain", b"No healthy worker")
+                return
+            worker.in_flight += 1
+            try:
+                request = worker.client.build_request(
+                    scope["method"], url.decode("latin-1"), headers=headers, content=bytes(body),
+                )
+                response = await worker.client.send(request, stream=True)
+                break
+            except (httpx.ConnectError, httpx.ReadError, httpx.RemoteProtocolError) as e:
+                # Died between two monitor passes: the monitor restarts it, retry elsewhere. A pooled
+                # connection to a dead worker fails on read, after the request may have gone out:
+                # only moves (a pure function of the board) are safe to send twice then.
+                worker.in_flight -= 1
+                if not isinstance(e, httpx.ConnectError) and worker.alive() and key is None:
+                    await _respond(send, 502, b"text/plain", b"Worker connection lost")
+                    return
+                worker.healthy = False
+                tried.add(worker.name)
+            except httpx.TimeoutException:
+                worker.in_flight -= 1
+                await _respond(send, 504, b"text/plain", b"Worker timed out")
+                return
+            except BaseException:
+                worker.in_flight -= 1
+                raise
+
+        # Relay the response as it arrives instead of holding all of it
+        try:
+            response_headers = [
+                (k.encode("latin-1"), v.encode("latin-1"))
+                for k, v in response.headers.multi_items() if k.lower() not in DROP_RESPONSE_HEADERS
+            ]
+            await send({"type": "http.response.start", "status": response.status_code, "headers": response_headers})
+            async for chunk in response.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await response.aclose()
+            worker.in_flight -= 1
+
+
+async def _respond(send, status: int, content_type: bytes, body: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", content_type), (b"content-length", str(len(body)).encode()),
+    ]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Route the moves of one game to the same uvicorn worker")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "4")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket-dir", default=SOCKET_DIR)
+    args = parser.parse_args()
+
+    dispatcher = Dispatcher(args.workers, args.socket_dir)
+    uvicorn.run(dispatcher, host=args.host, port=args.port, lifespan="on")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+'''
+Local move evaluator for the AI players.
+
+A one-ply static evaluation, fast enough for 26x26 boards: square weights
+(corners good, the squares next to an empty corner bad, edges fair) plus
+mobility after the move (own moves minus the opponent's) and a small term
+for the discs flipped. It ranks availableMoves, feeds the best ones to the
+LLM prompt as suggestions, and answers for the LLM when the provider fails,
+proposes an illegal move or runs out of the latency budget.
+'''
+
+from typing import List, Optional, Tuple
+
+from app.ai.prompt import to_algebraic
+from app.routers.schemas import Move
+from app.services import reversi
+
+CORNER = 100
+X_SQUARE = -50      # diagonal neighbour of an empty corner
+C_SQUARE = -20      # edge neighbour of an empty corner
+EDGE = 10
+INNER = 1
+MOBILITY = 5        # per move of difference between the two sides
+FLIP = 1            # per disc flipped
+
+
+def square_weight(board: reversi.Board, size: int, row: int, col: int) -> int:
+    last = size - 1
+    if row in (0, last) and col in (0, last):
+        return CORNER
+    for corner_row, corner_col in ((0, 0), (0, last), (last, 0), (last, last)):
+        if board[corner_row][corner_col] != 'U':
+            continue
+        distance = (abs(row - corner_row), abs(col - corner_col))
+        if distance == (1, 1):
+            return X_SQUARE
+        if distance in ((0, 1), (1, 0)):
+            return C_SQUARE
+    if row in (0, last) or col in (0, last):
+        return EDGE
+    return INNER
+
+
+def score_move(board: reversi.Board, size: int, turn: str, row: int, col: int) -> Tuple[int, dict]:
+    """ (score, the terms it is made of) of a legal move """
+    flipped = len(reversi.flips(board, size, turn, row, col))
+    after = reversi.apply_move(board, size, turn, row, col)
+    own = len(reversi.legal_moves(after, size, turn))
+    theirs = len(reversi.legal_moves(after, size, reversi.opponent(turn)))
+    terms = {
+        "square": square_weight(board, size, row, col),
+        "mobility": own - theirs,
+        "opponent_moves": theirs,
+        "flipped": flipped,
+    }
+    return terms["square"] + MOBILITY * terms["mobility"] + FLIP * flipped, terms
+
+
+def rank_moves(board: reversi.Board, size: int, turn: str, moves: List[Move]) -> List[dict]:
+    """ The given legal moves, best first: {"row", "col", "score", "terms"} """
+    ranked = []
+    for move in moves:
+        if not reversi.is_legal(board, size, turn, move.row, move.col):
+            continue
+        score, terms = score_move(board, size, turn, move.row, move.col)
+        ranked.append({"row": move.row, "col": move.col, "score": score, "terms": terms})
+    ranked.sort(key=lambda m: -m["score"])
+    return ranked
+
+
+def explain(best: dict, reason: str) -> str:
+    """ A short comment for an engine move, in the spirit of the LLM's "speak" """
+    terms = best["terms"]
+    square = to_algebraic(best["row"], best["col"])
+    if terms["square"] == CORNER:
+        why = "a corner is forever"
+    elif terms["square"] == EDGE and terms["opponent_moves"] <= 3:
+        why = f"a quiet edge move that leaves you {terms['opponent_moves']} replies"
+    elif terms["mobility"] > 0:
+        why = f"it keeps {terms['mobility']} more options for me than for you"
+    else:
+        why = f"it flips {terms['flipped']} and gives the least away"
+    return f"{reason} The engine plays {square}: {why}."
+
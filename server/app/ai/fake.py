@@ -0,0 +1,69 @@
+'''
+Local fake AI provider, aiId "fake", for load tests and circuit breaker
+drills without any API key. Enabled by RVC_AI_FAKE, a comma separated list
+of settings:
+
+    RVC_AI_FAKE="latency=0.3,jitter=0.1,error_rate=0.2,garbage_rate=0.05"
+
+latency/jitter are seconds slept per call, error_rate the share of calls
+answering like a failed API call, garbage_rate the share answering prose
+instead of JSON. The same settings can be changed at runtime with
+provider.configure(...), e.g. to start and end an incident.
+'''
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from app.routers.schemas import FetchAIMoveParams
+
+ENABLED = bool(os.environ.get("RVC_AI_FAKE"))
+
+
+class FakeProvider:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 garbage_rate: float = 0.0, seed: Optional[int] = None):
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.configure(latency=latency, jitter=jitter, error_rate=error_rate, garbage_rate=garbage_rate)
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        settings = {}
+        for item in filter(None, os.environ.get("RVC_AI_FAKE", "").split(",")):
+            key, _, value = item.partition("=")
+            if key.strip() in ("latency", "jitter", "error_rate", "garbage_rate"):
+                settings[key.strip()] = float(value)
+        return cls(**settings)
+
+    def configure(self, **settings):
+        with self._lock:
+            for key, value in settings.items():
+                setattr(self, key, float(value))
+
+    def answer(self, params: FetchAIMoveParams, prompt: str, repair: bool = False,
+               timeout: Optional[float] = None) -> str:
+        """ Same contract as PlayAgent.get_put_*: the raw answer text """
+        with self._lock:
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            roll = self._rng.random()
+            move = self._rng.choice(params.availableMoves) if params.availableMoves else None
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            return json.dumps({"error": "Error from fake API: request timed out", "outage": True})
+        time.sleep(delay)
+
+        if roll < self.error_rate:
+            return json.dumps({"error": "Error from fake API: 503 service unavailable", "outage": True})
+        if roll < self.error_rate + self.garbage_rate and not repair:
+            return "Let me think about this position carefully, the corners matter most."
+        if move is None:
+            return json.dumps({"error": "Error from fake API: no move"})
+        return json.dumps({"row": move.row, "col": move.col, "speak": "The fake provider plays at random."})
+
+
+# Process-wide fake, configured from RVC_AI_FAKE
+provider = FakeProvider.from_env()
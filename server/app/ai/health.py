@@ -0,0 +1,137 @@
+'''
+Provider health and circuit breakers for the AI players.
+
+Every provider call is recorded with its outcome and latency: a rolling
+window of the last WINDOW calls gives the error rate, an EWMA the latency.
+Only outages count as errors (transport failures, timeouts, 5xx); a 4xx or
+an answer that cannot be parsed says nothing about the provider's health.
+A provider whose error rate or latency crosses the limits trips its breaker:
+
+    closed      calls go through
+    open        calls are refused at once, fetch_ai_move routes the move to
+                an alternate provider or the local engine
+    half-open   after the cooldown one probe call goes through; success
+                closes the breaker, failure opens it again for twice as long
+
+State is per worker process: each one finds out about an incident from its
+own calls, a few failed calls at most.
+'''
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from app.ai.services import PlayAgent
+from app.utils import metrics
+
+WINDOW = 20
+MIN_CALLS = int(os.environ.get("RVC_AI_BREAKER_MIN_CALLS", "5"))
+ERROR_RATE = float(os.environ.get("RVC_AI_BREAKER_ERROR_RATE", "0.5"))
+SLOW_SECONDS = float(os.environ.get("RVC_AI_BREAKER_SLOW_S", "10"))
+COOLDOWN = float(os.environ.get("RVC_AI_BREAKER_COOLDOWN_S", "30"))
+MAX_COOLDOWN = 300.0
+EWMA_ALPHA = 0.3
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ProviderHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: Deque[Tuple[bool, float]] = deque(maxlen=WINDOW)
+        self.latency_ewma = None
+        self.state = CLOSED
+        self.cooldown = COOLDOWN
+        self.opened_at = 0.0
+        self.probe_at = None    # start of the running half-open probe
+
+    def error_rate(self) -> float:
+        if not self.calls:
+            return 0.0
+        return sum(not ok for ok, _ in self.calls) / len(self.calls)
+
+    def _transition(self, state: str):
+        self.state = state
+        metrics.AI_BREAKER.inc(ai=PlayAgent.metric_label(self.name), state=state)
+        print(f"WARNING: AI provider {self.name} circuit {state} "
+              f"(error rate {self.error_rate():.2f}, latency {self.latency_ewma or 0:.2f}s)", flush=True)
+
+    def allow(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self._transition(HALF_OPEN)
+        # Half-open: one probe at a time; a probe lost without a result expires after a cooldown
+        if self.probe_at is not None and now - self.probe_at < self.cooldown:
+            return False
+        self.probe_at = now
+        return True
+
+    def record(self, ok: bool, latency: float, now: float):
+        self.calls.append((ok, latency))
+        self.latency_ewma = latency if self.latency_ewma is None else \
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+
+        if self.state == HALF_OPEN:
+            self.probe_at = None
+            if ok and latency < SLOW_SECONDS:
+                self.calls.clear()
+                self.latency_ewma = latency
+                self.cooldown = COOLDOWN
+                self._transition(CLOSED)
+            else:
+                self.cooldown = min(MAX_COOLDOWN, self.cooldown * 2)
+                self.opened_at = now
+                self._transition(OPEN)
+            return
+
+        if self.state == CLOSED and len(self.calls) >= MIN_CALLS and (
+                self.error_rate() >= ERROR_RATE or self.latency_ewma >= SLOW_SECONDS):
+            self.opened_at = now
+            self._transition(OPEN)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": len(self.calls),
+            "error_rate": round(self.error_rate(), 3),
+            "latency_ewma_s": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "cooldown_s": self.cooldown,
+        }
+
+
+class HealthRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers: Dict[str, ProviderHealth] = {}
+
+    def _get(self, aiId: str) -> ProviderHealth:
+        health = self._providers.get(aiId)
+        if health is None:
+            health = self._providers[aiId] = ProviderHealth(aiId)
+        return health
+
+    def allow(self, aiId: str) -> bool:
+        """ May a call go to this provider now; in half-open state this takes the probe slot """
+        with self._lock:
+            return self._get(aiId).allow(time.monotonic())
+
+    def record(self, aiId: str, ok: bool, latency: float):
+        with self._lock:
+            self._get(aiId).record(ok, latency, time.monotonic())
+
+    def state(self, aiId: str) -> str:
+        with self._lock:
+            return self._get(aiId).state
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            return {aiId: health.snapshot() for aiId, health in self._providers.items()}
+
+
+# Process-wide provider health
+ai_health = HealthRegistry()
@@ -1,9 +1,55 @@
 from app.routers.schemas import Move, FetchAIMoveParams, AIMoveResult
+from typing import List, Optional, Tuple
 import json
+import os
+import re
+
+# Board encoding of the prompts: "json" (nested list) or "grid" (one text line per row)
+PROMPT_ENCODING = os.environ.get("RVC_PROMPT_ENCODING", "json")
+
+COLUMNS = "abcdefghijklmnopqrstuvwxyz"
+GRID_CELLS = {"B": "B", "W": "W", "U": "."}
+
+
+def to_algebraic(row: int, col: int) -> str:
+    """ (2, 3) -> "d3": column letter a.., row number 1.. from the top """
+    return f"{COLUMNS[col]}{row + 1}"
+
+
+def from_algebraic(text: str, size: int) -> Optional[Tuple[int, int]]:
+    """ "d3" -> (2, 3); None when it is not a square of the board """
+    match = re.fullmatch(r"\s*([a-zA-Z])\s*(\d{1,2})\s*", text or "")
+    if not match:
+        return None
+    row, col = int(match.group(2)) - 1, COLUMNS.index(match.group(1).lower())
+    if not (0 <= row < size and 0 <= col < size):
+        return None
+    return row, col
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough BPE token count, without a tokenizer dependency: words are about one
+    token per 4 characters, every digit group and punctuation mark one token.
+    Good enough to compare encodings, not to bill.
+    """
+    tokens = 0
+    for piece in re.findall(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]", text):
+        tokens += (len(piece) + 3) // 4 if piece[0].isalpha() else 1
+    return tokens
+
 
 class Prompt:
     @staticmethod
-    def get_put_prompt_normal(params: FetchAIMoveParams) -> str:
+    def get_put_prompt(params: FetchAIMoveParams, encoding: str = PROMPT_ENCODING,
+                       suggestions: Optional[List[Move]] = None) -> str:
+        """ Move prompt in the requested board encoding, with the engine's best moves when given """
+        if encoding == "grid":
+            return Prompt.get_put_prompt_grid(params, suggestions)
+        return Prompt.get_put_prompt_normal(params, suggestions)
+
+    @staticmethod
+    def get_put_prompt_normal(params: FetchAIMoveParams, suggestions: Optional[List[Move]] = None) -> str:
         '''
         Prompt for getting AI answer in playing Reversi.
         '''
@@ -29,6 +75,10 @@ class Prompt:
         if params.lastMove:
             previous_move_msg = f"Your opponent made the previous move as {opponentTurnName} on {params.lastMove.model_dump()}. "
 
+        suggestion_msg = ""
+        if suggestions:
+            suggestion_msg = f"A local engine rates these moves highest, best first: {json.dumps([move.model_dump() for move in suggestions])}\n"
+
         # Improved coordinate explanation
         coord_msg = f"The positions are represented by 'row' and 'col'. 'row' is the vertical index (0 to {board_size-1} from top to bottom), and 'col' is the horizontal index (0 to {board_size-1} from left to right)."
 
@@ -38,11 +88,94 @@ class Prompt:
             f"{json.dumps(params.board, ensure_ascii=False)}\n"
             f"{coord_msg}\n"
             f"{previous_move_msg}Now you are playing {turn_name} ({params.turn}), and you must select one move from your current available moves: {json.dumps([move.model_dump() for move in params.availableMoves])}\n"
+            f"{suggestion_msg}"
             'Also, use the "speak" field to add a short comment (up to 40 words) about the game, which can be either humorous or serious.\n'
             "Your final response must be in the following JSON format (do not output anything else):\n"
             '{"row": Your row number (example: 0), "col": Your col number (example: 0), "speak": "Your words here."}\n'
         )
 
         # Debug print for prompt
-        # print("** the prompt is: ", prompt) 
-        return prompt
\ No newline at end of file
+        # print("** the prompt is: ", prompt)
+        return prompt
+
+    @staticmethod
+    def board_grid(board: List[List[str]], size: int) -> str:
+        """ Column letters on top, then one line per row: "3 ...WB..." """
+        width = len(str(size))
+        lines = [" " * (width + 1) + COLUMNS[:size]]
+        for r in range(size):
+            cells = "".join(GRID_CELLS.get(cell, "?") for cell in board[r][:size])
+            lines.append(f"{r + 1:>{width}} {cells}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def board_diff(previous: List[List[str]], board: List[List[str]], size: int) -> str:
+        """ "placed W e6; flipped e5 e4" between two positions """
+        placed, flipped = [], []
+        for r in range(size):
+            for c in range(size):
+                before, after = previous[r][c], board[r][c]
+                if before == after:
+                    continue
+                if before == "U":
+                    placed.append(f"{after} {to_algebraic(r, c)}")
+                else:
+                    flipped.append(to_algebraic(r, c))
+        parts = []
+        if placed:
+            parts.append("placed " + ", ".join(placed))
+        if flipped:
+            parts.append("flipped " + " ".join(flipped))
+        return "; ".join(parts) or "no change"
+
+    @staticmethod
+    def get_put_prompt_grid(params: FetchAIMoveParams, suggestions: Optional[List[Move]] = None) -> str:
+        '''
+        Same request as get_put_prompt_normal with a compact board: a text
+        grid and algebraic coordinates, a fraction of the tokens on big boards.
+        '''
+        size = params.size
+        turn_name = {"B": "black", "W": "white"}.get(params.turn, params.turn)
+        last = size - 1
+
+        previous_move_msg = ""
+        if params.lastMove:
+            previous_move_msg = f"Opponent's last move: {to_algebraic(params.lastMove.row, params.lastMove.col)}"
+            if params.previousBoard:
+                previous_move_msg += f" ({Prompt.board_diff(params.previousBoard, params.board, size)})"
+            previous_move_msg += ".\n"
+
+        legal = " ".join(to_algebraic(m.row, m.col) for m in params.availableMoves)
+        suggestion_msg = ""
+        if suggestions:
+            suggestion_msg = "Engine's best moves, best first: " + " ".join(to_algebraic(m.row, m.col) for m in suggestions) + "\n"
+        prompt = (
+            f"Reversi (Othello), {size}x{size} board. B=black, W=white, .=empty. "
+            f"Squares are a column letter (a-{COLUMNS[last]}, left to right) and a row number (1-{size}, top to bottom).\n"
+            f"{Prompt.board_grid(params.board, size)}\n"
+            f"{previous_move_msg}"
+            f"You play {turn_name} ({params.turn}). Legal moves: {legal}\n"
+            f"{suggestion_msg}"
+            'Pick one legal move and add a short comment (up to 40 words) in "speak", humorous or serious.\n'
+            "Answer with this JSON only:\n"
+            '{"move": "Your square (example: c4)", "speak": "Your words here."}\n'
+        )
+        return prompt
+
+    @staticmethod
+    def get_put_prompt_repair(params: FetchAIMoveParams, encoding: str, answer: str, error: str) -> str:
+        '''
+        Short follow-up when the answer could not be parsed: the legal moves
+        again and the exact reply format, nothing else.
+        '''
+        if encoding == "grid":
+            legal = " ".join(to_algebraic(m.row, m.col) for m in params.availableMoves)
+            reply_format = '{"move": "c4", "speak": "..."}'
+        else:
+            legal = json.dumps([move.model_dump() for move in params.availableMoves])
+            reply_format = '{"row": 0, "col": 0, "speak": "..."}'
+        return (
+            f"Your previous answer could not be used ({error}):\n"
+            f"{answer[:300]}\n"
+            f"Reply with one JSON object only, like {reply_format}, choosing one of these moves: {legal}\n"
+        )
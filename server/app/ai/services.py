@@ -1,11 +1,14 @@
 from app.routers.schemas import Move, FetchAIMoveParams, AIMoveResult
 from app.ai.utils import AIResponseParser
-from .prompt import Prompt
-from openai import OpenAI
-import google.generativeai as genai
+from app.ai import fake
+from .prompt import Prompt, PROMPT_ENCODING, estimate_tokens, from_algebraic
+from app.utils import metrics, tracing
 import os
+import threading
 from dotenv import load_dotenv
 import json
+import time
+from typing import List, Optional, Tuple
 
 env_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
 load_dotenv(dotenv_path=env_path)
@@ -13,135 +16,294 @@ load_dotenv(dotenv_path=env_path)
 TEST_PROMPT = "You are a helpful assistant"   
 REVERSI_PROMPT = "You are a master of playing Reversi (Othello) game"
 
+# Ask the providers for a JSON object natively (response_format / response_mime_type)
+JSON_MODE = os.environ.get("RVC_AI_JSON_MODE", "1").lower() not in ("0", "false", "no", "off")
+# One repair request after an unparsable answer: short, and only with this many seconds left
+REPAIR_MAX_TOKENS = 120
+REPAIR_MIN_TIME = float(os.environ.get("RVC_AI_REPAIR_MIN_TIME", "3"))
+
+# Exception classes (and their subclasses) of the SDKs meaning the provider is down or unreachable;
+# matched by name so the SDKs are not imported for it
+OUTAGE_ERRORS = frozenset({
+    "APIConnectionError",       # openai, APITimeoutError included
+    "DeadlineExceeded", "ServiceUnavailable", "RetryError",     # google.api_core
+    "TimeoutError", "ConnectionError",
+})
+
 
 class PlayAgent:
-    # Pre-initialize clients for efficiency
-    try:
-        # Validate environment variables
-        required_env_vars = {
-            "DEEPSEEK_KEY": os.environ.get("DEEPSEEK_KEY"),
-            "DEEPSEEK_BASE_URL": os.environ.get("DEEPSEEK_BASE_URL"),
-            "QWEN_KEY": os.environ.get("QWEN_KEY"),
-            "QWEN_BASE_URL": os.environ.get("QWEN_BASE_URL"),
-            "GEMINI_KEY": os.environ.get("GEMINI_KEY"),
-            "GEMINI_2PT5_MODEL": os.environ.get("GEMINI_2PT5_MODEL"),
-        }
-        
-        missing_vars = [k for k, v in required_env_vars.items() if not v]
-        if missing_vars:
-            print(f"WARNING: Missing environment variables: {missing_vars}")
-        
-        deepseek_client = OpenAI(
-            api_key=os.environ.get("DEEPSEEK_KEY"),
-            base_url=os.environ.get("DEEPSEEK_BASE_URL")
-        ) if os.environ.get("DEEPSEEK_KEY") else None
-        
-        qwen_client = OpenAI(
-            api_key=os.environ.get("QWEN_KEY"),
-            base_url=os.environ.get("QWEN_BASE_URL")
-        ) if os.environ.get("QWEN_KEY") else None
-        
-        if os.environ.get("GEMINI_KEY"):
+    # Validate environment variables
+    required_env_vars = {
+        "DEEPSEEK_KEY": os.environ.get("DEEPSEEK_KEY"),
+        "DEEPSEEK_BASE_URL": os.environ.get("DEEPSEEK_BASE_URL"),
+        "QWEN_KEY": os.environ.get("QWEN_KEY"),
+        "QWEN_BASE_URL": os.environ.get("QWEN_BASE_URL"),
+        "GEMINI_KEY": os.environ.get("GEMINI_KEY"),
+        "GEMINI_2PT5_MODEL": os.environ.get("GEMINI_2PT5_MODEL"),
+    }
+
+    missing_vars = [k for k, v in required_env_vars.items() if not v]
+    if missing_vars:
+        print(f"WARNING: Missing environment variables: {missing_vars}")
+
+    # Clients are built on first use (or by warm_up), the SDK imports alone cost about a second
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    @staticmethod
+    def _build_client(aiId: str):
+        if aiId in ("deepseek-v3", "qwen-3"):
+            from openai import OpenAI
+            prefix = "DEEPSEEK" if aiId == "deepseek-v3" else "QWEN"
+            # No SDK retries: each call gets what is left of the move budget as its timeout
+            return OpenAI(
+                api_key=os.environ.get(f"{prefix}_KEY"),
+                base_url=os.environ.get(f"{prefix}_BASE_URL"),
+                max_retries=0,
+            )
+        if aiId == "gemini-2pt5":
+            import google.generativeai as genai
             genai.configure(api_key=os.environ.get("GEMINI_KEY"))
-            gemini_model = genai.GenerativeModel(os.environ.get("GEMINI_2PT5_MODEL"))
-        else:
-            gemini_model = None
-            
-    except Exception as e:
-        print(f"FATAL: Failed to initialize AI clients - {e}")
-        deepseek_client = qwen_client = gemini_model = None
+            return genai.GenerativeModel(os.environ.get("GEMINI_2PT5_MODEL"))
+        raise ValueError(f"Unknown aiId: {aiId}")
+
+    @staticmethod
+    def get_client(aiId: str):
+        """ The provider's client (OpenAI client or Gemini model), built once per process """
+        client = PlayAgent._clients.get(aiId)
+        if client is None:
+            with PlayAgent._clients_lock:
+                client = PlayAgent._clients.get(aiId)
+                if client is None:
+                    if not PlayAgent.available(aiId):
+                        raise RuntimeError(f"{aiId} is not configured")
+                    client = PlayAgent._clients[aiId] = PlayAgent._build_client(aiId)
+        return client
 
     @staticmethod
-    def get_put(aiId: str, params: FetchAIMoveParams):
+    def forget_clients():
+        """ After a fork: the parent's connection pools (and Gemini's grpc channel) are not ours """
+        PlayAgent._clients = {}
+        PlayAgent._clients_lock = threading.Lock()
+
+    @staticmethod
+    def warm_up():
+        """ Build the configured clients ahead of the first AI move, after startup """
+        for aiId in ("deepseek-v3", "gemini-2pt5", "qwen-3"):
+            if PlayAgent.available(aiId):
+                try:
+                    PlayAgent.get_client(aiId)
+                except Exception as e:
+                    print(f"WARNING: Failed to initialize AI client {aiId} - {e}")
+
+    AI_IDS = ("deepseek-v3", "gemini-2pt5", "qwen-3", "fake")
+
+    @staticmethod
+    def available(aiId: str) -> bool:
+        """ Is the provider configured in this process """
+        return {
+            "deepseek-v3": bool(os.environ.get("DEEPSEEK_KEY")),
+            "gemini-2pt5": bool(os.environ.get("GEMINI_KEY")),
+            "qwen-3": bool(os.environ.get("QWEN_KEY")),
+            "fake": fake.ENABLED,
+        }.get(aiId, False)
+
+    @staticmethod
+    def alternates(aiId: str) -> List[str]:
+        """ The other configured providers, to answer for aiId while its circuit is open """
+        return [other for other in PlayAgent.AI_IDS if other != aiId and PlayAgent.available(other)]
+
+    @staticmethod
+    def metric_label(aiId: str) -> str:
+        """ aiId comes from the URL, keep metric labels to the known providers """
+        return aiId if aiId in PlayAgent.AI_IDS else "unknown"
+
+    @staticmethod
+    def parse_move(parsed_json, size: int) -> Tuple[Optional[dict], Optional[str]]:
+        """ (move dict with int row/col, None) or (None, why the answer is unusable) """
+        if not parsed_json or not isinstance(parsed_json, dict):
+            return None, "AI response is not a JSON object"
+
+        # Grid prompts ask for an algebraic square: {"move": "d3"}
+        if "move" in parsed_json and ("row" not in parsed_json or "col" not in parsed_json):
+            square = from_algebraic(str(parsed_json["move"]), size)
+            if square is None:
+                return None, f"Invalid square in AI response: {parsed_json['move']}"
+            parsed_json["row"], parsed_json["col"] = square
+
+        # Check for required fields
+        if "row" not in parsed_json or "col" not in parsed_json:
+            return None, "Missing row or col in AI response"
+
+        # Validate row/col are integers
+        try:
+            parsed_json["row"] = int(parsed_json["row"])
+            parsed_json["col"] = int(parsed_json["col"])
+        except (ValueError, TypeError):
+            return None, "row and col must be integers"
+
+        return parsed_json, None
+
+    @staticmethod
+    def get_put(aiId: str, params: FetchAIMoveParams, suggestions: Optional[List[Move]] = None,
+                deadline: Optional[float] = None):
+        """
+        Ask the provider for a move. Every provider call gets the time left before
+        `deadline` (time.perf_counter()) as its SDK timeout, so no call outlives the
+        move budget. An answer that cannot be parsed gets one short repair request,
+        when at least REPAIR_MIN_TIME is left. Provider errors are returned as they are,
+        with "outage" set on the ones the circuit breaker counts.
+        """
         # Validate aiId first
         ai_methods = {
             "deepseek-v3": PlayAgent.get_put_deepseek_v3,
             "gemini-2pt5": PlayAgent.get_put_gemini_2pt5,
             "qwen-3": PlayAgent.get_put_qwen_3,
         }
+        if fake.ENABLED:
+            ai_methods["fake"] = fake.provider.answer
         method = ai_methods.get(aiId)
         if not method:
             return {"error": f"Unknown aiId: {aiId}"}
         
+        encoding = params.encoding or PROMPT_ENCODING
+        ai_response_str = None
         try:
-            prompt = Prompt.get_put_prompt_normal(params)
-            ai_response_str = method(params, prompt)
+            with metrics.AI_STEP.time(ai=aiId, step="prompt", encoding=encoding):
+                prompt = Prompt.get_put_prompt(params, encoding, suggestions)
+            prompt_tokens = estimate_tokens(REVERSI_PROMPT) + estimate_tokens(prompt)
+            metrics.AI_PROMPT_TOKENS.observe(prompt_tokens, ai=aiId, encoding=encoding)
+            time_left = None if deadline is None else deadline - time.perf_counter()
+            if time_left is not None and time_left <= 0:
+                metrics.AI_PARSE.inc(ai=aiId, result="provider_error")
+                return {"error": "No time left for the provider call"}
+            with metrics.AI_STEP.time(ai=aiId, step="provider", encoding=encoding), \
+                    tracing.span("llm", ai=aiId, encoding=encoding, prompt_tokens=prompt_tokens):
+                ai_response_str = method(params, prompt, timeout=time_left)
 
             # Enhanced error handling for AI response
             if not ai_response_str or not isinstance(ai_response_str, str):
+                metrics.AI_PARSE.inc(ai=aiId, result="provider_error")
                 return {"error": "Empty or invalid AI response"}
 
-            # Remove code block markers if present
-            if "```json" in ai_response_str:
-                ai_response_str = ai_response_str.split("```json")[1].split("```", 1)[0].strip()
-
+            parse_start = time.perf_counter()
             parsed_json = AIResponseParser.parse_json_from_response(ai_response_str)
+            move, error = PlayAgent.parse_move(parsed_json, params.size)
+            metrics.AI_STEP.observe(time.perf_counter() - parse_start, ai=aiId, step="parse", encoding=encoding)
+            if move is not None:
+                metrics.AI_PARSE.inc(ai=aiId, result="ok")
+                return move
+            if isinstance(parsed_json, dict) and "error" in parsed_json:
+                # The provider call itself failed (see get_put_*), a repair would fail the same way
+                metrics.AI_PARSE.inc(ai=aiId, result="provider_error")
+                return {"error": parsed_json["error"], "outage": bool(parsed_json.get("outage"))}
 
-            if not parsed_json or not isinstance(parsed_json, dict):
-                return {"error": "AI response is not a JSON object", "raw_content": ai_response_str}
+            time_left = None if deadline is None else deadline - time.perf_counter()
+            if time_left is not None and time_left < REPAIR_MIN_TIME:
+                metrics.AI_PARSE.inc(ai=aiId, result="failed")
+                return {"error": error, "raw_content": ai_response_str}
 
-            # Check for required fields
-            if "row" not in parsed_json or "col" not in parsed_json:
-                return {"error": "Missing row or col in AI response", "raw_content": ai_response_str}
+            repair_prompt = Prompt.get_put_prompt_repair(params, encoding, ai_response_str, error)
+            with metrics.AI_STEP.time(ai=aiId, step="repair", encoding=encoding), \
+                    tracing.span("llm_repair", ai=aiId, error=error):
+                ai_response_str = method(params, repair_prompt, repair=True, timeout=time_left)
+            move, error = PlayAgent.parse_move(AIResponseParser.parse_json_from_response(ai_response_str), params.size)
+            if move is not None:
+                metrics.AI_PARSE.inc(ai=aiId, result="repaired")
+                return move
+            metrics.AI_PARSE.inc(ai=aiId, result="failed")
+            return {"error": error, "raw_content": ai_response_str}
 
-            # Validate row/col are integers
-            try:
-                parsed_json["row"] = int(parsed_json["row"])
-                parsed_json["col"] = int(parsed_json["col"])
-            except (ValueError, TypeError):
-                return {"error": "row and col must be integers", "raw_content": ai_response_str}
-
-            return parsed_json
-
-        except (json.JSONDecodeError, IndexError) as e:
-            return {"error": "JSON Decode Error", "raw_content": ai_response_str, "details": str(e)}
         except Exception as e:
-            return {"error": "Unexpected error in AI processing", "raw_content": ai_response_str if 'ai_response_str' in locals() else "N/A", "details": str(e)}
+            return {"error": "Unexpected error in AI processing", "raw_content": ai_response_str or "N/A", "details": str(e)}
         
     @staticmethod
-    def get_put_deepseek_v3(params: FetchAIMoveParams, prompt: str):
-        # Use pre-initialized client for performance
+    def get_put_deepseek_v3(params: FetchAIMoveParams, prompt: str, repair: bool = False,
+                            timeout: Optional[float] = None):
+        # Client built on first use, then reused
         model_name = os.environ.get("DEEPSEEK_V3_MODEL")
         try:
-            response = PlayAgent.deepseek_client.chat.completions.create(
+            response = PlayAgent.get_client("deepseek-v3").chat.completions.create(
                 model=model_name,
                 messages=[
                     {"role": "system", "content": REVERSI_PROMPT}, # Use Reversi prompt for better context
                     {"role": "user", "content": prompt},
                 ],
-                stream=False
+                stream=False,
+                **PlayAgent.openai_options(repair, timeout),
             )
             return response.choices[0].message.content
         except Exception as e:
-            return f'{{"error": "Error from DeepSeek API: {str(e)}"}}'
+            return PlayAgent.provider_error("DeepSeek", e)
 
     @staticmethod
-    def get_put_gemini_2pt5(params: FetchAIMoveParams, prompt: str):
-        # Use pre-initialized model for performance
+    def get_put_gemini_2pt5(params: FetchAIMoveParams, prompt: str, repair: bool = False,
+                            timeout: Optional[float] = None):
+        # Model built on first use, then reused
         try:
             # Combine system prompt and user prompt for better context
             full_prompt = f"{REVERSI_PROMPT}\n\n{prompt}"
-            response = PlayAgent.gemini_model.generate_content(full_prompt)
+            generation_config = {}
+            if JSON_MODE:
+                generation_config["response_mime_type"] = "application/json"
+            if repair:
+                generation_config["max_output_tokens"] = REPAIR_MAX_TOKENS
+            request_options = {"timeout": timeout} if timeout is not None else None
+            response = PlayAgent.get_client("gemini-2pt5").generate_content(
+                full_prompt, generation_config=generation_config or None, request_options=request_options
+            )
             return response.text
         except Exception as e:
-            return f'{{"error": "Error from Gemini API: {str(e)}"}}'
+            return PlayAgent.provider_error("Gemini", e)
 
     @staticmethod
-    def get_put_qwen_3(params: FetchAIMoveParams, prompt: str):
-        # Use pre-initialized client for performance
+    def get_put_qwen_3(params: FetchAIMoveParams, prompt: str, repair: bool = False,
+                       timeout: Optional[float] = None):
+        # Client built on first use, then reused
         model_name = os.environ.get("QWEN_3_MODEL")
         try:
-            completion = PlayAgent.qwen_client.chat.completions.create(
+            completion = PlayAgent.get_client("qwen-3").chat.completions.create(
                 model=model_name,
                 messages=[
                     {"role": "system", "content": REVERSI_PROMPT}, # Use Reversi prompt for better context
                     {"role": "user", "content": prompt},
                 ],
                 extra_body={"enable_thinking": False}, # Disable thinking for non-stream output
+                **PlayAgent.openai_options(repair, timeout),
             )
             return completion.choices[0].message.content
         except Exception as e:
-            return f'{{"error": "Error from Qwen API: {str(e)}"}}'
+            return PlayAgent.provider_error("Qwen", e)
+
+    @staticmethod
+    def is_outage(e: Exception) -> bool:
+        """ Transport errors, timeouts and 5xx: the failures the circuit breaker counts (not 4xx) """
+        if any(cls.__name__ in OUTAGE_ERRORS for cls in type(e).__mro__):
+            return True
+        status = getattr(e, "status_code", None)
+        if status is None and isinstance(getattr(e, "code", None), int):
+            status = e.code  # google.api_core errors carry the HTTP status as .code
+        return isinstance(status, int) and status >= 500
+
+    @staticmethod
+    def provider_error(api: str, e: Exception) -> str:
+        """ Answer of a failed provider call, in the same JSON shape as a model answer """
+        return json.dumps({"error": f"Error from {api} API: {str(e)}", "outage": PlayAgent.is_outage(e)})
+
+    @staticmethod
+    def openai_options(repair: bool, timeout: Optional[float]) -> dict:
+        """ JSON mode, and a short answer for repairs, on the OpenAI-compatible APIs """
+        options = {}
+        if JSON_MODE:
+            options["response_format"] = {"type": "json_object"}
+        if repair:
+            options["max_tokens"] = REPAIR_MAX_TOKENS
+        if timeout is not None:
+            options["timeout"] = timeout
+        return options
+
+# Workers forked by app.prefork build their own clients
+os.register_at_fork(after_in_child=PlayAgent.forget_clients)
 
 # Test only
 if __name__ == "__main__":
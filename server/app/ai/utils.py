@@ -1,8 +1,71 @@
-
 import json
-import re
+from typing import List, Optional
+
+
+class IncrementalJSONParser:
+    """
+    Collect the top-level JSON objects of a text fed in chunks (a streamed or
+    chatty LLM answer). Braces are counted outside of strings only, so nested
+    objects and "}" inside the "speak" text are fine. Text between objects,
+    code fences and a truncated tail are ignored.
+    """
+
+    def __init__(self):
+        self.objects: List[dict] = []
+        self.open_at: Optional[int] = None   # offset of the '{' of the unfinished object
+        self._offset = 0
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        """ Consume a chunk; returns the objects completed by it """
+        completed = []
+        for i, ch in enumerate(chunk):
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = ["{"]
+                    self.open_at = self._offset + i
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.open_at = None
+                    try:
+                        obj = json.loads("".join(self._buffer))
+                    except ValueError:
+                        continue
+                    if isinstance(obj, dict):
+                        completed.append(obj)
+        self._offset += len(chunk)
+        self.objects.extend(completed)
+        return completed
+
 
 class AIResponseParser:
+    @staticmethod
+    def pick_move_object(objects: List[dict]) -> Optional[dict]:
+        """ The first object that looks like a move answer, else the first one """
+        for obj in objects:
+            if ("row" in obj and "col" in obj) or "move" in obj:
+                return obj
+        return objects[0] if objects else None
+
     @staticmethod
     def parse_json_from_response(response_str: str):
         """
@@ -13,14 +76,19 @@ class AIResponseParser:
             return None
         # Try direct JSON parse first
         try:
-            return json.loads(response_str)
+            parsed = json.loads(response_str)
+            if isinstance(parsed, dict):
+                return parsed
         except Exception:
             pass
-        # Try to extract first {...} block
-        match = re.search(r'\{.*?\}', response_str, re.DOTALL)
-        if match:
-            try:
-                return json.loads(match.group(0))
-            except Exception:
+        # Scan for complete objects; an unmatched '{' in the prose restarts the scan after it
+        start = 0
+        while start < len(response_str):
+            parser = IncrementalJSONParser()
+            parser.feed(response_str[start:])
+            if parser.objects:
+                return AIResponseParser.pick_move_object(parser.objects)
+            if parser.open_at is None:
                 return None
+            start += parser.open_at + 1
         return None
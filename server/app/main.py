@@ -1,16 +1,27 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 from contextlib import asynccontextmanager
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import os
 from datetime import datetime, timedelta
-from app.utils import call_c, cleanup
-from app.routers import upload, play, stats
+from app.utils import call_c, cleanup, metrics, tracing
+from app.routers import upload, play, stats, archive, records
+from app.services.archive_catalog import catalog
+from app.services import archive_builder
+from app.services.game_log import game_log
+from app.services.bot_stats import bot_stats
+from app.services.ponder import ponderer
+from app.services.quota import quota, FLUSH_INTERVAL as QUOTA_FLUSH_INTERVAL
+from app.ai.services import PlayAgent
+from app.services.compile_profile import UPLOAD_PROFILE
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # ——— Startup phase ———
     # TODO: add dump_archives_to_fs() here later
+    # — Build the archive catalog once, then poll for new or changed archives —
+    catalog.refresh()
     # — Start TTL cleanup scheduler —
     scheduler = AsyncIOScheduler()
     scheduler.add_job(
@@ -20,15 +31,75 @@ async def lifespan(app: FastAPI):
         id="cleanup_ttl_job",
         replace_existing=True
     )
+    # — Prebuild the upload toolkit (rvc_tools object, rvc.h.gch) in the background —
+    scheduler.add_job(
+        UPLOAD_PROFILE.prepare_toolkit,
+        next_run_time=datetime.now(),
+        id="prepare_toolkit_job",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        archive_builder.hot_add_archives,
+        trigger="interval",
+        minutes=1,
+        next_run_time=datetime.now(),
+        id="archive_catalog_job",
+        replace_existing=True
+    )
+    # — Append buffered game records in batches, seal the log segment when it is large —
+    scheduler.add_job(
+        game_log.flush,
+        trigger="interval",
+        seconds=5,
+        id="game_log_flush_job",
+        replace_existing=True
+    )
+    scheduler.add_job(
+        game_log.compact,
+        trigger="interval",
+        minutes=10,
+        id="game_log_compact_job",
+        replace_existing=True
+    )
+    # — Fold new games and live move/AI counters into the per-bot statistics —
+    scheduler.add_job(
+        bot_stats.update,
+        trigger="interval",
+        minutes=1,
+        id="bot_stats_job",
+        replace_existing=True
+    )
+    # — Write the CPU quota charges in batches, and read back the other workers' —
+    scheduler.add_job(
+        quota.flush,
+        trigger="interval",
+        seconds=QUOTA_FLUSH_INTERVAL,
+        id="quota_flush_job",
+        replace_existing=True
+    )
+    # — Build the AI provider clients once the server answers, not on the cold-start path —
+    scheduler.add_job(
+        PlayAgent.warm_up,
+        next_run_time=datetime.now() + timedelta(seconds=5),
+        id="ai_warm_up_job",
+        replace_existing=True
+    )
     scheduler.start()
 
     yield
 
     # ——— Shutdown phase ———
     scheduler.shutdown()
+    ponderer.shutdown()
+    quota.flush()
+    game_log.flush()
+    bot_stats.update()
 
 app = FastAPI(lifespan=lifespan)
 
+# ---- Upload body cap, before the multipart form is spooled (innermost, so CORS headers apply) ----
+app.add_middleware(upload.UploadSizeLimitMiddleware)
+
 # ---- Cross-domain configuration, convenient for local development ----
 app.add_middleware(
     CORSMiddleware,
@@ -36,12 +107,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[tracing.TRACE_HEADER],
 )
 
+# ---- Request metrics, exposed on /metrics (RVC_METRICS=0 disables) ----
+app.add_middleware(metrics.MetricsMiddleware)
+
+# ---- Request tracing, trace id in the X-Trace-Id header (RVC_TRACING=0 disables) ----
+app.add_middleware(tracing.TracingMiddleware)
+
 # ---- Include routers ----
 app.include_router(upload.upload_router)
 app.include_router(play.play_router, prefix="/api")
 app.include_router(stats.stats_router)
+app.include_router(archive.archive_router)
+app.include_router(records.records_router)
 
 # ---- API Endpoints ----
 @app.get("/ping")
@@ -49,6 +129,21 @@ async def ping():
     """ simple testing endpoint """
     return {"msg": "pong"}
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """ Prometheus text exposition of the in-process metrics """
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/trace/{trace_id}")
+async def get_trace(trace_id: str):
+    """ Spans of a recent trace, e.g. the X-Trace-Id of a laggy move """
+    spans = tracing.store.get(trace_id.lower())
+    if spans is None:
+        raise HTTPException(status_code=404, detail="Trace not found or expired")
+    return {"trace_id": trace_id.lower(), "spans": spans}
+
 @app.get("/test")
 async def test_c_endpoint():
     """
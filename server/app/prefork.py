@@ -0,0 +1,228 @@
+'''
+Pre-fork server: a master process imports the app, preloads the archive
+catalog and the archive bots, then forks the uvicorn workers.
+
+With `uvicorn --workers 4` every worker is a fresh interpreter: each one
+imports fastapi, pydantic and the SDKs on its own and dlopens every archive
+.so again on first use. Here the master does that work once and the forked
+workers share its pages copy-on-write; a restarted worker serves again as
+soon as it has run the app's lifespan, without importing anything.
+
+- gc.freeze() after the preload moves everything the master built into the
+  permanent generation, so the workers' collections never write to (and
+  copy) those pages.
+- the master stays single-threaded until it forks. State that must not
+  cross a fork (AI clients, the GCS client, the quota's SQLite connections,
+  the ponder pool) is dropped in the child by the os.register_at_fork hook
+  next to it, and rebuilt there on first use.
+- the listening socket is bound once by the master: the kernel hands each
+  connection to one of the workers waiting in accept().
+- the master restarts dead workers with an exponential backoff, and stops
+  them gracefully on SIGTERM/SIGINT.
+
+Each worker runs the app's lifespan itself (scheduler, catalog polling).
+
+    python -m app.prefork --workers 4 --port 8000
+'''
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional
+
+MONITOR_INTERVAL = 0.5      # seconds between reaping dead workers
+MAX_BACKOFF = 30.0          # seconds between restarts of a crash-looping worker
+STABLE_UPTIME = 30.0        # a worker up that long resets its backoff
+GRACEFUL_TIMEOUT = 30.0     # seconds the workers get to finish on shutdown
+
+# Imported (not instantiated) by the master so the workers share their pages
+PRELOAD_SDKS = ("openai", "google.generativeai", "google.cloud.storage")
+PRELOAD_SDKS_ENABLED = os.environ.get("RVC_PREFORK_PRELOAD_SDKS", "1").lower() not in ("0", "false", "no", "off")
+
+
+class WorkerSlot:
+    def __init__(self, index: int):
+        self.name = f"worker-{index}"
+        self.pid: Optional[int] = None
+        self.restarts = 0
+        self.failures = 0
+        self.started_at = 0.0
+        self.next_start = 0.0
+
+
+def preload(preload_sdks: bool = PRELOAD_SDKS_ENABLED) -> dict:
+    """ Import the app and load what the workers would each load; returns what was done """
+    start = time.perf_counter()
+    from app.main import app
+    from app.services.archive_catalog import catalog
+    from app.services.call_c import library_cache
+
+    sdks = []
+    if preload_sdks:
+        for module in PRELOAD_SDKS:
+            try:
+                __import__(module)
+                sdks.append(module)
+            except Exception as e:
+                print(f"WARNING: prefork could not preload {module}: {e}", flush=True)
+
+    catalog.refresh()
+    paths = catalog.library_paths()
+    bots = 0
+    for path in paths[:library_cache.maxsize]:
+        try:
+            library_cache.get(path)
+            bots += 1
+        except Exception as e:
+            print(f"WARNING: prefork could not preload {path}: {e}", flush=True)
+
+    gc.collect()
+    gc.freeze()
+    return {
+        "app": app,
+        "sdks": sdks,
+        "bots": bots,
+        "archives": len(paths),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str):
+    """ Body of a forked worker: uvicorn on the inherited socket, with the app's lifespan """
+    import uvicorn
+
+    # uvicorn installs its own SIGTERM/SIGINT handlers while serving
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, workers: int, log_level: str = "info"):
+        self.app = app
+        self.sock = sock
+        self.log_level = log_level
+        self.slots: List[WorkerSlot] = [WorkerSlot(i) for i in range(workers)]
+        self.stopping = False
+
+    def _spawn(self, slot: WorkerSlot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app, self.sock, self.log_level)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        slot.pid = pid
+        slot.started_at = time.monotonic()
+        print(f"Prefork: started {slot.name} (pid {pid})", flush=True)
+
+    def _reap(self):
+        """ Collect exited workers and schedule their restarts """
+        by_pid: Dict[int, WorkerSlot] = {slot.pid: slot for slot in self.slots if slot.pid}
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = by_pid.get(pid)
+            if slot is None:
+                continue
+            slot.pid = None
+            if self.stopping:
+                continue
+            now = time.monotonic()
+            uptime = now - slot.started_at
+            slot.failures = 0 if uptime >= STABLE_UPTIME else slot.failures + 1
+            delay = min(MAX_BACKOFF, 0.5 * 2 ** slot.failures) if slot.failures else 0.0
+            slot.next_start = now + delay
+            print(f"WARNING: {slot.name} exited with {os.waitstatus_to_exitcode(status)}, "
+                  f"restarting in {delay:.1f}s", flush=True)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if threading.active_count() > 1:
+            print(f"WARNING: prefork master has {threading.active_count()} threads, "
+                  f"their locks are copied into the workers as they are", flush=True)
+
+        for slot in self.slots:
+            self._spawn(slot)
+        while not self.stopping:
+            self._reap()
+            now = time.monotonic()
+            for slot in self.slots:
+                if slot.pid is None and not self.stopping and now >= slot.next_start:
+                    slot.restarts += 1
+                    self._spawn(slot)
+            time.sleep(MONITOR_INTERVAL)
+        self.shutdown()
+
+    def shutdown(self):
+        live = [slot for slot in self.slots if slot.pid]
+        for slot in live:
+            try:
+                os.kill(slot.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while any(slot.pid for slot in self.slots) and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for slot in self.slots:
+            if slot.pid:
+                print(f"WARNING: {slot.name} did not stop in {GRACEFUL_TIMEOUT:.0f}s, killing it", flush=True)
+                try:
+                    os.kill(slot.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        self._reap()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fork uvicorn workers from a preloaded master")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "4")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-preload-sdks", action="store_true", help="let each worker import the AI and GCS SDKs")
+    args = parser.parse_args()
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    loaded = preload(preload_sdks=PRELOAD_SDKS_ENABLED and not args.no_preload_sdks)
+    print(f"Prefork: preloaded the app, {loaded['bots']}/{loaded['archives']} archive bots "
+          f"and {len(loaded['sdks'])} SDKs in {loaded['seconds']:.2f}s", flush=True)
+    Master(loaded["app"], sock, args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
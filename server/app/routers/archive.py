@@ -0,0 +1,34 @@
+'''
+Routers for listing the archived bots.
+'''
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from app.routers.schemas import ArchiveEntry
+from app.services.archive_catalog import catalog
+
+archive_router = APIRouter()
+
+
+@archive_router.get("/api/archives")
+async def list_archives(request: Request):
+    """
+    List every archive group and bot from the in-memory catalog.
+    Clients should revalidate with If-None-Match, unchanged listings return 304.
+    """
+    body, etag = catalog.listing()
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=30"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@archive_router.get("/api/archives/{archive_group}/{archive_id}", response_model=ArchiveEntry)
+async def get_archive(archive_group: str, archive_id: str):
+    """
+    Get the catalog metadata of a single archive bot.
+    """
+    entry = catalog.get(archive_group, archive_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Archive not found")
+    return ArchiveEntry(**entry)
@@ -2,40 +2,118 @@
 Routers handling computer move sending.
 '''
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header, Query, Request
+from typing import Optional, Tuple
 from app.routers.schemas import Move, FetchCodeMoveParams, FetchAIMoveParams, AIMoveResult, CodeMoveResult
 from app.ai.services import PlayAgent
+from app.ai import engine
+from app.ai.health import ai_health
+import asyncio
 import json
+import os
 import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from app.services.call_c import CMoveCaller
+from app.services.archive_catalog import catalog
+from app.services.bot_stats import bot_stats
+from app.services.quota import quota, client_key, bot_key, QuotaExceeded
+from app.services.ponder import ponderer
+from app.utils import metrics, tracing
 
 play_router = APIRouter()
 
+# Worst case of an AI move: past it, the engine answers (the provider call finishes in the background)
+AI_MOVE_BUDGET = float(os.environ.get("RVC_AI_MOVE_BUDGET", "15"))
+# Engine moves suggested to the AI in the prompt, 0 to leave them out
+ENGINE_TOP_K = int(os.environ.get("RVC_ENGINE_TOP_K", "3"))
+
+# Provider calls, off the event loop; each one is bounded by the move budget (SDK timeout)
+ai_executor = ThreadPoolExecutor(max_workers=8)
+# Engine ranking, on its own threads so slow providers never delay it
+engine_executor = ThreadPoolExecutor(max_workers=2)
+
+# Same header the affinity dispatcher (app/affinity.py) hashes on
+GAME_ID_HEADER = "X-Game-Id"
+
+
+class ProviderUnavailable(Exception):
+    """ The AI's circuit is open and no alternate provider is available """
+
+
+def game_id_of(header: Optional[str], query: Optional[str]) -> Optional[str]:
+    """ Game/session id of a move request: X-Game-Id header, else ?game_id= """
+    return header or query or None
+
+
+async def bot_move(data_path: str, params: FetchCodeMoveParams, game_id: Optional[str], ponder: bool,
+                   quota_keys: Tuple[str, ...]) -> dict:
+    """
+    makeMove of a bot, answered from the game's pondered replies when the human
+    played one of them; with ponder=True the next replies are queued afterwards.
+    The CPU time is charged to `quota_keys`, a pondered reply was charged when it ran.
+    """
+    with tracing.span("move", game_id=game_id, pid=os.getpid()) as span:
+        move_result = await ponderer.take(game_id, data_path, params.board, params.size, params.turn)
+        span.set(pondered=move_result is not None)
+        if move_result is None:
+            move_result = CMoveCaller.call_make_move_105(
+                board=params.board,
+                size=params.size,
+                turn=params.turn,
+                data_path=data_path,
+            )
+            quota.charge(*quota_keys, seconds=move_result["cpu_us"] / 1_000_000)
+    if ponder:
+        ponderer.schedule(game_id, data_path, params.board, params.size, params.turn, move_result, quota_keys)
+    return move_result
+
+
+def admit_move(*keys: str):
+    """ Refuse the move with 429 while one of the CPU quota buckets is in debt """
+    try:
+        quota.admit(*keys)
+    except QuotaExceeded as e:
+        metrics.QUOTA_REJECTS.inc(route="move", bucket=e.kind)
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers())
+
+
+def code_move_result(source: str, bot: str, move_result: dict) -> CodeMoveResult:
+    """ Build the response of a native move call and record its metrics """
+    with metrics.MOVE_STEP.time(step="response"):
+        result = CodeMoveResult (
+            row=move_result["row"],
+            col=move_result["col"],
+            elapsed=move_result["elapsed"],
+            returnValue=move_result["returnValue"],
+            timeout=move_result.get("timeout", False)
+        )
+    metrics.MOVE_CALLS.inc(source=source, outcome="timeout" if result.timeout else "ok")
+    metrics.BOT_MOVES.observe(bot, result.elapsed / 1_000_000, result.timeout)
+    bot_stats.record_move(bot, result.elapsed, result.timeout)
+    return result
+
 
 @play_router.post("/move/custom/{custom_type}/{custom_code_id}", response_model=CodeMoveResult)
 async def fetch_custom_move(
     custom_type: str,
     custom_code_id: str,
-    params: FetchCodeMoveParams
+    params: FetchCodeMoveParams,
+    request: Request,
+    x_game_id: Optional[str] = Header(None, alias=GAME_ID_HEADER),
+    game_id: Optional[str] = Query(None, max_length=64),
+    ponder: bool = Query(False),
 ):
+    quota_keys = (client_key(request), bot_key(custom_code_id))
+    admit_move(*quota_keys)
     try:
         # data_path = custom_code_id
         data_path = f"{custom_type}s/{custom_type}_{custom_code_id}"
-        move_result = CMoveCaller.call_make_move_105(
-            board=params.board,
-            size=params.size,
-            turn=params.turn,
-            data_path=data_path,
-        )
-        return CodeMoveResult (
-            row=move_result["row"],
-            col=move_result["col"],
-            elapsed=move_result["elapsed"],
-            returnValue=move_result["returnValue"],
-            timeout=move_result.get("timeout", False)
-        )
+        move_result = await bot_move(data_path, params, game_id_of(x_game_id, game_id), ponder, quota_keys)
+        return code_move_result("custom", f"{custom_type}/{custom_code_id}", move_result)
     except Exception as e:
+        metrics.MOVE_CALLS.inc(source="custom", outcome="error")
         raise HTTPException(status_code=500, detail=str(e))
     
 
@@ -43,24 +121,22 @@ async def fetch_custom_move(
 async def fetch_archive_move(
     archive_group: str,
     archive_id: str,
-    params: FetchCodeMoveParams
+    params: FetchCodeMoveParams,
+    request: Request,
+    x_game_id: Optional[str] = Header(None, alias=GAME_ID_HEADER),
+    game_id: Optional[str] = Query(None, max_length=64),
+    ponder: bool = Query(False),
 ):
+    # Archive bots are ours, only the client pays for them
+    quota_key = client_key(request)
+    admit_move(quota_key)
     try:
         data_path = f"archives/{archive_group}/{archive_id}"
-        move_result = CMoveCaller.call_make_move_105(
-            board=params.board,
-            size=params.size,
-            turn=params.turn,
-            data_path=data_path,
-        )
-        return CodeMoveResult (
-            row=move_result["row"],
-            col=move_result["col"],
-            elapsed=move_result["elapsed"],
-            returnValue=move_result["returnValue"],
-            timeout=move_result.get("timeout", False)
-        )
+        move_result = await bot_move(data_path, params, game_id_of(x_game_id, game_id), ponder, (quota_key,))
+        catalog.record_move(archive_group, archive_id, move_result["elapsed"])
+        return code_move_result("archive", f"archive/{archive_group}/{archive_id}", move_result)
     except Exception as e:
+        metrics.MOVE_CALLS.inc(source="archive", outcome="error")
         raise HTTPException(status_code=500, detail=str(e))
     
 
@@ -68,17 +144,56 @@ async def fetch_archive_move(
 async def fetch_ai_move(
     aiId: str,
     params: FetchAIMoveParams,
+    x_game_id: Optional[str] = Header(None, alias=GAME_ID_HEADER),
+    game_id: Optional[str] = Query(None, max_length=64),
 ): 
     """
     Call corresponding APIs, input game info (board, turn, size ...), 
     return AI move and explanation.
+    The local engine ranks the moves first: its best ones go into the prompt,
+    and its best move answers when the AI fails or misses AI_MOVE_BUDGET.
+    While the provider's circuit is open (app.ai.health), another configured
+    provider answers instead, or the engine does without waiting.
     """
+    # Unknown ids would each get a breaker and metric labels of their own
+    if aiId not in PlayAgent.AI_IDS:
+        raise HTTPException(status_code=404, detail=f"Unknown aiId: {aiId}")
     # If no available moves, normally ReverC won't let it happen
     if not params.availableMoves:
         raise HTTPException(status_code=400, detail="There is no choice for a move")
-    
+
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    ranked = await loop.run_in_executor(
+        engine_executor, engine.rank_moves, params.board, params.size, params.turn, params.availableMoves
+    )
+    suggestions = [Move(row=m["row"], col=m["col"]) for m in ranked[:ENGINE_TOP_K]]
+
+    # Skip a provider whose circuit is open: an alternate one answers, else the engine right away
+    provider = aiId
+    if not ai_health.allow(aiId):
+        provider = next((alt for alt in PlayAgent.alternates(aiId) if ai_health.allow(alt)), None)
     try:
-        ai_response = PlayAgent.get_put(aiId, params)
+        if provider is None:
+            raise ProviderUnavailable(f"{aiId} is unavailable right now.")
+
+        with tracing.span("move", game_id=game_id_of(x_game_id, game_id), pid=os.getpid(), provider=provider):
+            # The provider call blocks, keep it off the event loop and bounded
+            call_start = time.perf_counter()
+            try:
+                ai_response = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        ai_executor, tracing.bind(PlayAgent.get_put), provider, params, suggestions,
+                        start + AI_MOVE_BUDGET
+                    ),
+                    timeout=max(0.0, AI_MOVE_BUDGET - (time.perf_counter() - start)),
+                )
+            except asyncio.TimeoutError:
+                ai_health.record(provider, ok=False, latency=time.perf_counter() - call_start)
+                raise
+            # Only outages count against the provider: an unparsable or illegal answer is the model's doing
+            outage = isinstance(ai_response, dict) and bool(ai_response.get("outage"))
+            ai_health.record(provider, ok=not outage, latency=time.perf_counter() - call_start)
         
         # Log the AI response for debugging
         print(f"AI {aiId} response: {ai_response}", flush=True)
@@ -103,17 +218,40 @@ async def fetch_ai_move(
             raise ValueError(f"AI move not in available moves: ({proposed_move.row}, {proposed_move.col})")
         
         explanation = ai_response.get("speak", "")
+        if provider != aiId:
+            explanation = f"({provider} answered for {aiId}) {explanation}"
+        metrics.AI_CALLS.inc(ai=PlayAgent.metric_label(aiId), outcome="ok" if provider == aiId else "rerouted")
+        bot_stats.record_ai(PlayAgent.metric_label(aiId), fallback=False)
         return AIMoveResult(row=proposed_move.row, col=proposed_move.col, explanation=explanation)
+    except ProviderUnavailable as e:
+        outcome = "circuit_open"
+        reason = str(e)
+    except asyncio.TimeoutError:
+        print(f"AI move timeout: {provider} exceeded {AI_MOVE_BUDGET:g}s", flush=True)
+        outcome = "timeout"
+        reason = f"{provider} did not answer within {AI_MOVE_BUDGET:g}s."
     except Exception as e:
         # Log error for debugging
         print(f"AI move error: {e}", flush=True)
-        
-        # Fallback: return a random valid move
-        try:
-            random_move = random.choice(params.availableMoves)
-            explanation = f"Failed to get decision from {aiId}, ReverC returned a random move. Error: {str(e)}"
-            return AIMoveResult(row=random_move.row, col=random_move.col, explanation=explanation)
-        except Exception as fallback_error:
-            print(f"Fallback also failed: {fallback_error}", flush=True)
-            raise HTTPException(status_code=500, detail=f"AI call failed and fallback failed: {str(e)}")
+        outcome = "fallback"
+        reason = f"Failed to get decision from {provider}. Error: {str(e)}."
+
+    # Fallback: the engine's best move, random only if it found no legal move
+    metrics.AI_CALLS.inc(ai=PlayAgent.metric_label(aiId), outcome=outcome)
+    bot_stats.record_ai(PlayAgent.metric_label(aiId), fallback=True)
+    if ranked:
+        best = ranked[0]
+        return AIMoveResult(row=best["row"], col=best["col"], explanation=engine.explain(best, reason))
+    try:
+        random_move = random.choice(params.availableMoves)
+        explanation = f"{reason} ReverC returned a random move."
+        return AIMoveResult(row=random_move.row, col=random_move.col, explanation=explanation)
+    except Exception as fallback_error:
+        print(f"Fallback also failed: {fallback_error}", flush=True)
+        raise HTTPException(status_code=500, detail=f"AI call failed and fallback failed: {reason}")
+
 
+@play_router.get("/ai/health")
+async def get_ai_health():
+    """ Circuit breaker state, error rate and latency EWMA per AI provider, in this worker """
+    return {aiId: dict(health, available=PlayAgent.available(aiId)) for aiId, health in ai_health.snapshot().items()}
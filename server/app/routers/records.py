@@ -0,0 +1,74 @@
+'''
+Routers for storing finished games and replaying them.
+'''
+
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+import asyncio
+from app.routers.schemas import RecordGameRequest, RecordGameResponse, GameReplay, GameMove
+from app.services import reversi
+from app.services.game_log import game_log, replay, format_game_id, parse_game_id, GameLogError
+
+records_router = APIRouter()
+
+
+@records_router.post("/api/games", response_model=RecordGameResponse)
+async def record_game(params: RecordGameRequest):
+    """
+    Store a finished game. The moves are replayed first, illegal games are rejected.
+    """
+    try:
+        game = game_log.record(
+            size=params.size,
+            black=params.black,
+            white=params.white,
+            moves=[(m.row, m.col) for m in params.moves],
+            timings=[(max(0, m.elapsed), m.timeout) for m in params.moves],
+            started_at=params.started_at,
+        )
+    except GameLogError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if game_log.should_flush():
+        # flush() fsyncs the batch, keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, game_log.flush)
+    return RecordGameResponse(
+        game_id=format_game_id(game["game_id"]),
+        outcome=game["outcome"],
+        moves=len(game["moves"]),
+        bytes=game["bytes"],
+    )
+
+
+@records_router.get("/api/games/{game_id}", response_model=GameReplay)
+async def get_game(game_id: str, ply: Optional[int] = None):
+    """
+    Replay a stored game up to `ply` moves (the final position by default).
+    """
+    gid = parse_game_id(game_id)
+    game = game_log.get(gid) if gid is not None else None
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found")
+
+    try:
+        position = replay(game["size"], game["moves"], ply)
+    except GameLogError as e:
+        raise HTTPException(status_code=500, detail=f"Stored game is corrupt: {str(e)}")
+    black_count, white_count = reversi.count(position["board"], game["size"])
+
+    return GameReplay(
+        game_id=format_game_id(game["game_id"]),
+        size=game["size"],
+        black=game["black"],
+        white=game["white"],
+        outcome=game["outcome"],
+        started_at=game["started_at"],
+        moves=[
+            GameMove(row=row, col=col, elapsed=elapsed, timeout=timeout)
+            for (row, col), (elapsed, timeout) in zip(game["moves"], game["timings"])
+        ],
+        ply=position["ply"],
+        board=position["board"],
+        turn=position["turn"],
+        black_count=black_count,
+        white_count=white_count,
+    )
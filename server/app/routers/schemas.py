@@ -21,6 +21,8 @@ class FetchAIMoveParams(BaseModel):
     size: int
     availableMoves: List[Move]
     lastMove: Optional[Move]
+    previousBoard: Optional[List[List[str]]] = None  # board before the opponent's last move, for the grid diff
+    encoding: Optional[Literal['json', 'grid']] = None  # prompt board encoding, server default when unset
 
 class AIMoveResult(BaseModel):
     row: int
@@ -42,9 +44,124 @@ class SetupDataRequest(BaseModel):
 # ===== upload.py models =====
 class ProcessResponse(BaseModel):
     code_id: str
+    content_hash: Optional[str] = None  # sha256 of the uploaded source
+
+class CompileReport(BaseModel):
+    opt_level: str
+    march: Optional[str] = None
+    lto: bool = False
+    precompiled_tools: bool = False
+    precompiled_header: bool = False
+    compile_ms: int
+    baseline_compile_ms: Optional[int] = None  # the same source at -O0
+    measured_speedup: Optional[float] = None   # test suite move time at -O0 over this build's
+
+class Diagnostic(BaseModel):
+    line: int
+    col: int
+    code: str
+    message: str
+
+class ValidationFailure(BaseModel):
+    position: int
+    description: str
+    move: List[int]
+    reason: str
+
+class ValidationReport(BaseModel):
+    positions: int
+    played: int
+    legal: int
+    legality_rate: float
+    avg_move_us: Optional[int] = None
+    max_move_us: Optional[int] = None
+    budget_exhausted: bool = False
+    first_failure: Optional[ValidationFailure] = None
+    min_legality_rate: Optional[float] = None
+
+class LatencyDistribution(BaseModel):
+    mean: int
+    p50: int
+    p90: int
+    p99: int
+    max: int
+
+class SizeProfile(BaseModel):
+    size: int
+    moves: int
+    wall_p50_us: int
+    wall_max_us: int
+    cpu_max_us: int
+
+class PerformanceProfile(BaseModel):
+    moves: int
+    wall_us: LatencyDistribution
+    cpu_us: LatencyDistribution
+    by_size: List[SizeProfile]
+    peak_rss_kb: int
+    bot_rss_kb: int
+    time_limit_us: int
+    limit_ratio: float  # slowest move / MAKE_MOVE_TIME_LIMIT
+
+class ProfileSummary(BaseModel):
+    wall_p50_us: int
+    wall_max_us: int
+    cpu_max_us: int
+    peak_rss_kb: int
+    limit_ratio: float
 
 class StatusResponse(BaseModel):
     status: Literal['uploading', 'compiling', 'testing', 'success', 'failed']
     error_message: Optional[str] = None
     failed_stage: Optional[Literal['compiling', 'testing']] = None
     test_return_value: Optional[int] = None
+    compile_report: Optional[CompileReport] = None
+    diagnostics: Optional[List[Diagnostic]] = None
+    validation: Optional[ValidationReport] = None
+    profile: Optional[ProfileSummary] = None
+
+# ===== archive.py models =====
+class ArchiveEntry(BaseModel):
+    group: str
+    name: str
+    so_size: Optional[int] = None
+    status: Literal['ready', 'stale', 'missing_library']
+    verified_at: str
+    rating: Optional[str] = None
+    compile_ms: Optional[int] = None
+    moves: int = 0
+    avg_move_us: Optional[int] = None
+
+# ===== records.py models =====
+class GameMove(BaseModel):
+    row: int
+    col: int
+    elapsed: int = 0  # us, 0 when not measured (human moves)
+    timeout: bool = False
+
+class RecordGameRequest(BaseModel):
+    size: int
+    black: str  # player ids, e.g. "archive/2025/greedy", "cache/<code_id>", "ai/qwen-3", "human"
+    white: str
+    moves: List[GameMove]  # passes are not listed
+    started_at: Optional[int] = None  # unix seconds
+
+class RecordGameResponse(BaseModel):
+    game_id: str
+    outcome: Literal['unfinished', 'black', 'white', 'draw']
+    moves: int
+    bytes: int
+
+class GameReplay(BaseModel):
+    game_id: str
+    size: int
+    black: str
+    white: str
+    outcome: Literal['unfinished', 'black', 'white', 'draw']
+    started_at: int
+    moves: List[GameMove]
+    ply: int
+    board: List[List[str]]  # position after `ply` moves
+    turn: Optional[str] = None  # side to move, None when the game is over
+    black_count: int
+    white_count: int
@@ -5,12 +5,16 @@ Uses Google Cloud Storage for persistent data storage.
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from typing import List, Optional
+from cachetools import TTLCache
 import json
 import os
 from datetime import datetime
-from google.cloud import storage
 import threading
 
+from app.utils import metrics
+from app.services.bot_stats import bot_stats, summarize
+
 stats_router = APIRouter()
 
 # GCS configuration
@@ -24,10 +28,57 @@ class StatsResponse(BaseModel):
     total_games: int
     last_updated: str
 
+class BotStatsEntry(BaseModel):
+    bot: str  # archive/<group>/<name>, ai/<aiId>, candidate, cache or human
+    games: int
+    wins: int
+    losses: int
+    draws: int
+    win_rate: Optional[float] = None
+    moves: int
+    elapsed_us: int
+    avg_move_us: Optional[int] = None
+    timeouts: int
+    timeout_rate: Optional[float] = None
+    ai_calls: int
+    ai_fallbacks: int
+    fallback_rate: Optional[float] = None
+
+class BotStatsResponse(BaseModel):
+    updated_at: Optional[str] = None
+    bots: List[BotStatsEntry]
+
+# Per-bot responses change once per scheduler update, no need to rebuild them per request
+BOT_STATS_CACHE_TTL = 30
+_bot_stats_cache = TTLCache(maxsize=512, ttl=BOT_STATS_CACHE_TTL)
+
+
+_gcs_client = None
+_gcs_client_lock = threading.Lock()
 
 def _get_gcs_client():
-    """Get GCS client (uses default credentials in Cloud Run)"""
-    return storage.Client()
+    """
+    Get GCS client (uses default credentials in Cloud Run).
+    The SDK is imported and the client built on first use, not at startup:
+    both take long enough to delay the first response of a cold instance.
+    """
+    global _gcs_client
+    if _gcs_client is None:
+        with _gcs_client_lock:
+            if _gcs_client is None:
+                from google.cloud import storage
+                _gcs_client = storage.Client()
+    return _gcs_client
+
+
+def _forget_gcs_client():
+    """ After a fork: the parent's client and its connections stay with the parent """
+    global _gcs_client, _gcs_client_lock
+    _gcs_client = None
+    _gcs_client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_gcs_client)
 
 
 def _read_stats_from_gcs() -> dict:
@@ -67,16 +118,18 @@ def _write_stats_to_gcs(data: dict):
 
 def _read_stats() -> dict:
     """Read stats from GCS"""
-    return _read_stats_from_gcs()
+    with metrics.STATS_IO.time(op="read"):
+        return _read_stats_from_gcs()
 
 
 def _increment_stats():
     """Increment game count with thread locking for concurrency safety"""
     with _stats_lock:
-        data = _read_stats_from_gcs()
+        data = _read_stats()
         data["total_games"] += 1
         data["last_updated"] = datetime.now().isoformat()
-        _write_stats_to_gcs(data)
+        with metrics.STATS_IO.time(op="write"):
+            _write_stats_to_gcs(data)
     return data
 
 
@@ -104,3 +157,37 @@ async def increment_stats():
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to increment stats: {str(e)}")
+
+
+@stats_router.get("/api/stats/bots", response_model=BotStatsResponse)
+async def get_bot_stats():
+    """Per-bot results, move latency, timeout and AI fallback rates, busiest bots first"""
+    cached = _bot_stats_cache.get("bots")
+    if cached is None:
+        snapshot = bot_stats.snapshot()
+        bots = [BotStatsEntry(**summarize(key, entry)) for key, entry in snapshot["bots"].items()]
+        bots.sort(key=lambda b: (b.games, b.moves, b.ai_calls), reverse=True)
+        cached = _bot_stats_cache["bots"] = BotStatsResponse(updated_at=snapshot["updated_at"], bots=bots)
+    return cached
+
+
+def _bot_entry(key: str) -> BotStatsEntry:
+    cached = _bot_stats_cache.get(key)
+    if cached is None:
+        entry = bot_stats.get(key)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"No statistics for {key}")
+        cached = _bot_stats_cache[key] = BotStatsEntry(**entry)
+    return cached
+
+
+@stats_router.get("/api/stats/archive/{archive_group}/{archive_id}", response_model=BotStatsEntry)
+async def get_archive_stats(archive_group: str, archive_id: str):
+    """Statistics of one archive bot"""
+    return _bot_entry(f"archive/{archive_group}/{archive_id}")
+
+
+@stats_router.get("/api/stats/ai/{aiId}", response_model=BotStatsEntry)
+async def get_ai_stats(aiId: str):
+    """Statistics of one AI player, including its fallback rate"""
+    return _bot_entry(f"ai/{aiId}")
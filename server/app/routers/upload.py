@@ -3,14 +3,24 @@ Routers for handling file uploads before the game starts.
 '''
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Request
-from app.routers.schemas import ProcessResponse, StatusResponse
+from app.routers.schemas import ProcessResponse, StatusResponse, PerformanceProfile
+from app.services.archive_catalog import catalog
+from app.services.compile_profile import UPLOAD_PROFILE, MEASURE_SPEEDUP, measured_speedup
+from app.services.c_validator import CValidator, validate_file, format_diagnostic
+from app.services.elf_inspect import inspect_library, cleanup_inspection
+from app.services.test_runner import TEST_TIME_BUDGET
+from app.services.call_c import MAKE_MOVE_TIME_LIMIT, library_cache
+from app.services.quota import quota, client_key, QuotaExceeded, UPLOAD_COST
+from app.utils import metrics, tracing
 import uuid
 import os
 import aiofiles
 from datetime import datetime
-from typing import Optional, Literal
+from typing import List, Optional, Literal, Tuple
+import hashlib
 import json
 import sys
+import time
 import subprocess
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
@@ -21,6 +31,18 @@ import signal
 
 upload_router = APIRouter()
 
+MAX_FILE_SIZE = 500 * 1024  # 500KB
+# Whole request body of an upload: the file plus multipart boundaries and part headers
+MAX_UPLOAD_BODY = MAX_FILE_SIZE + 16 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+RVC_INCLUDE = b'#include "rvc.h"\n'
+
+# The validation suite may overrun its budget by one move, plus interpreter startup
+TEST_TIMEOUT = TEST_TIME_BUDGET + MAKE_MOVE_TIME_LIMIT + 2
+
+# Refuse bots whose slowest test move used more than this share of the move limit
+PROFILE_REJECT_RATIO = float(os.environ.get("RVC_PROFILE_REJECT_RATIO", "0.9"))
+
 # Thread pool executor for running tasks in parallel
 executor = ThreadPoolExecutor(max_workers=4)
 
@@ -31,19 +53,29 @@ def get_status_file_path(code_id: str, file_type: str) -> str:
     return f"data/status/{file_type}s/{file_type}_{code_id}.json"
 
 def save_status(code_id: str, status: str, file_type: str, 
-                error_message: str = None, failed_stage: str = None, test_return_value: int = None):
+                error_message: str = None, failed_stage: str = None, test_return_value: int = None,
+                compile_report: dict = None, diagnostics: List[dict] = None, validation: dict = None,
+                profile: dict = None):
     """Save the status to a file"""
     status_data = {
         "status": status,
         "error_message": error_message,
         "failed_stage": failed_stage,
         "test_return_value": test_return_value,
+        "compile_report": compile_report,
+        "diagnostics": diagnostics,
+        "validation": validation,
+        "profile": profile,
         "timestamp": datetime.now().isoformat()
     }
     
     status_file = get_status_file_path(code_id, file_type)
-    with open(status_file, 'w') as f:
-        json.dump(status_data, f)
+    with tracing.span("save_status", status=status, file_type=file_type):
+        with open(status_file, 'w') as f:
+            json.dump(status_data, f)
+
+    if status in ("success", "failed"):
+        metrics.UPLOAD_RESULTS.inc(file_type=file_type, status=status, stage=failed_stage or "none")
 
 def load_status(code_id: str, file_type: str) -> dict:
     """Load status from file"""
@@ -58,6 +90,29 @@ def load_status(code_id: str, file_type: str) -> dict:
     except Exception:
         return {"status": "error"}
     
+def profile_summary(profile: Optional[dict]) -> Optional[dict]:
+    """ The headline numbers of a performance profile, for StatusResponse """
+    if not profile:
+        return None
+    return {
+        "wall_p50_us": profile["wall_us"]["p50"],
+        "wall_max_us": profile["wall_us"]["max"],
+        "cpu_max_us": profile["cpu_us"]["max"],
+        "peak_rss_kb": profile["peak_rss_kb"],
+        "limit_ratio": profile["limit_ratio"],
+    }
+
+def load_profile(code_id: str, file_type: str) -> PerformanceProfile:
+    """ Full performance profile from the status file, for the report endpoints """
+    status_data = load_status(code_id, file_type)
+    if status_data["status"] == "not_found":
+        raise HTTPException(status_code=404, detail="Code ID not found")
+    if status_data["status"] == "error":
+        raise HTTPException(status_code=500, detail="Status file corrupted")
+    if not status_data.get("profile"):
+        raise HTTPException(status_code=404, detail="No performance profile for this code yet")
+    return PerformanceProfile(**status_data["profile"])
+
 def cleanup_status(code_id: str, file_type: str = 'candidate'):
     """clean up status file"""
     status_file = get_status_file_path(code_id, file_type)
@@ -71,8 +126,8 @@ def set_memory_limits():
 def set_test_runtime_limits():
     """Set strict runtime limits for testing subprocesses (CPU/memory/stack)."""
     try:
-        # CPU time 3s, prevent busy loop
-        resource.setrlimit(resource.RLIMIT_CPU, (3, 3))
+        # CPU time of the whole validation suite, prevent busy loop
+        resource.setrlimit(resource.RLIMIT_CPU, (TEST_TIMEOUT, TEST_TIMEOUT))
     except Exception:
         pass
     try:
@@ -88,84 +143,59 @@ def set_test_runtime_limits():
 
 def validate_c_code(file_path: str) -> bool:
     """
-    Validate the C code by checking malicious code and line number restrictions
+    Validate the C code by checking malicious code and line number restrictions,
+    see app.services.c_validator for the rules
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            code = f.read()
+        return not validate_file(file_path, chunk_size=UPLOAD_CHUNK_SIZE)
     except Exception:
         return False
-    
-    # Check for forbidden keywords
-    forbidden_keywords = [
-        '#include <unistd.h>',    # system calls
-        '#include <sys/',         # system headers
-        'system(',                # execute system commands
-        'exec(',                  # execute external programs
-        'fork(',                  # process operations
-        # 'while(1)',               # infinite loop
-        # 'for(;;)',                # infinite loop as well
-        '__asm__',                # no way to do ece243 here
-        'asm(',                   # same
-        '#include <signal.h>',    # signal handling
-        'kill(',                  # kill processes
-        'exit(',                  # exit the program
-    ]
-
-    # Check if any forbidden keyword is in the code
-    for keyword in forbidden_keywords:
-        if keyword in code:
-            return False
-
-    # NO MORE THAN 5000 lines of code
-    if len(code.splitlines()) > 5000:
-        return False
-    
-    # Check if the function 'make_move' is defined
-    if 'makeMove' not in code:
-        return False
-    
-    return True
 
-def compile_code(code_id: str, file_type: str) -> dict:
+def compile_code(code_id: str, file_type: str, validated: bool = False, quota_key: Optional[str] = None) -> dict:
     """
-    Compile the .c file into .so shared library
+    Compile the .c file into .so shared library, with the upload compile profile.
+    Uploads are validated while streaming (validated=True), other callers are checked here.
+    The gcc wall time is charged to the quota bucket `quota_key` (the uploading client).
     """
     try:
         source_file = f"data/c_src/{file_type}s/{file_type}_{code_id}.c"
         output_file = f"data/shared_libs/{file_type}s/{file_type}_{code_id}.so"
+        tools_source = f"data/c_src/{file_type}s/rvc_tools.c"
 
         # Validate the C code before compilation
-        if not validate_c_code(source_file):
+        if not validated and not validate_c_code(source_file):
             return {
                 "success": False, 
                 "error": "Code validation failed: contains forbidden operations, exceeds line limit, or missing make_move function"
             }
         
         # Run the gcc command to compile
-        compile_command = [
-            "gcc", 
-            "-shared",           # generate a shared library
-            "-fPIC",            # position-independent code
-            "-o", output_file,   # output file
-            source_file,         # src file
-            "data/c_src/candidates/rvc_tools.c" if file_type == "candidate" else "data/c_src/caches/rvc_tools.c",   # link to reverc tools
-            "-Wall",            # show all warnings
-            "-Wextra",          # additional warnings
-            "-std=c99"          # use C99 standard
-        ]
-
-        result = subprocess.run(
-            compile_command,
-            capture_output=True, 
-            text=True, 
-            timeout=30,
-            preexec_fn=set_memory_limits
-        )
+        compile_command = UPLOAD_PROFILE.compile_command(source_file, output_file, tools_source)
+
+        start = time.perf_counter()
+        try:
+            with tracing.span("gcc", file_type=file_type, opt_level=UPLOAD_PROFILE.opt_level):
+                result = subprocess.run(
+                    compile_command,
+                    capture_output=True, 
+                    text=True, 
+                    timeout=30,
+                    preexec_fn=set_memory_limits
+                )
+        finally:
+            compile_s = time.perf_counter() - start
+            quota.charge(quota_key, seconds=compile_s)
+        compile_ms = int(compile_s * 1000)
+        metrics.UPLOAD_STAGE.observe(compile_s, stage="compile")
 
         # check compilation result
         if result.returncode == 0:
-            return {"success": True}
+            # Inspect the produced .so before spending a sandbox run on it
+            inspection = inspect_library(output_file)
+            if not inspection["ok"]:
+                os.remove(output_file)
+                return {"success": False, "error": inspection["error"]}
+            return {"success": True, "report": UPLOAD_PROFILE.report(compile_ms)}
         else:
             error_message = result.stderr if result.stderr else "Compilation failed with no error message"
             return {"success": False, "error": error_message}
@@ -176,62 +206,167 @@ def compile_code(code_id: str, file_type: str) -> dict:
         return {"success": False, "error": f"Compilation error: {str(e)}"}
 
 
-# ==================== CANDIDATE ROUTERS ====================
+def run_test_suite(code_id: str, file_type: str, baseline: bool = False) -> subprocess.CompletedProcess:
+    """
+    Run the validation suite in a sandboxed subprocess, with a wall-clock timeout.
+    Blocks for up to TEST_TIMEOUT seconds: callers on the event loop run it in the executor.
+    baseline=True times the -O0 build instead, see measure_speedup.
+    """
+    stage = "baseline" if baseline else "test"
+    with metrics.UPLOAD_STAGE.time(stage=stage), tracing.span("test_runner", file_type=file_type, stage=stage):
+        return subprocess.run(
+            [sys.executable, "-m", "app.services.test_runner", code_id, file_type, *(["--baseline"] if baseline else [])],
+            capture_output=True,
+            text=True,
+            timeout=TEST_TIMEOUT,
+            preexec_fn=set_test_runtime_limits
+        )
+
 
-async def process_candidate_async(code_id: str):
+def measure_speedup(code_id: str, file_type: str, wall_us: Optional[List[int]], compile_report: dict,
+                    quota_key: Optional[str] = None) -> dict:
     """
-    Asynchronous processing of candidate files: 
-    compilation & testing.
+    Build the upload again at -O0, time the test suite on it and add the measured speedup of the
+    upload profile to the compile report. Best effort: any failure leaves the speedup unset.
+    The gcc wall time is charged to `quota_key`, like the real build.
+    """
+    if not MEASURE_SPEEDUP or not wall_us:
+        return compile_report
+    if UPLOAD_PROFILE.is_baseline():
+        return dict(compile_report, baseline_compile_ms=compile_report["compile_ms"], measured_speedup=1.0)
+
+    source_file = f"data/c_src/{file_type}s/{file_type}_{code_id}.c"
+    output_file = f"data/shared_libs/{file_type}s/{file_type}_{code_id}.O0.so"
+    tools_source = f"data/c_src/{file_type}s/rvc_tools.c"
+    try:
+        start = time.perf_counter()
+        try:
+            with tracing.span("gcc", file_type=file_type, opt_level="-O0"):
+                result = subprocess.run(
+                    UPLOAD_PROFILE.baseline().compile_command(source_file, output_file, tools_source),
+                    capture_output=True,
+                    text=True,
+                    timeout=30,
+                    preexec_fn=set_memory_limits
+                )
+        finally:
+            compile_s = time.perf_counter() - start
+            quota.charge(quota_key, seconds=compile_s)
+        if result.returncode != 0:
+            return compile_report
+
+        result = run_test_suite(code_id, file_type, baseline=True)
+        baseline_wall_us = json.loads(result.stdout or "{}").get("move_wall_us") if result.returncode == 0 else None
+        return dict(
+            compile_report,
+            baseline_compile_ms=int(compile_s * 1000),
+            measured_speedup=measured_speedup(baseline_wall_us or [], wall_us),
+        )
+    except Exception as e:
+        print(f"WARNING: could not measure the speedup of {file_type} {code_id}: {e}")
+        return compile_report
+    finally:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+
+async def process_code_async(code_id: str, file_type: str, diagnostics: Optional[List[dict]] = None,
+                             quota_key: Optional[str] = None):
+    """
+    Asynchronous processing of uploaded files (candidate or cache): 
+    compilation & testing. The source was already validated during upload,
+    its diagnostics are passed in.
     """
     try:
         # Update status to "compiling"
-        save_status(code_id, "compiling", "candidate")
-        
-        # Run the compile_code function in a thread pool
+        save_status(code_id, "compiling", file_type)
+
         loop = asyncio.get_event_loop()
-        compile_result = await loop.run_in_executor(
-            executor, 
-            compile_code, 
-            code_id, 
-            "candidate"
-        )
+        if diagnostics:
+            compile_result = {"success": False, "error": format_diagnostic(diagnostics[0])}
+        else:
+            # Run the compile_code function in a thread pool
+            compile_result = await loop.run_in_executor(
+                executor, 
+                tracing.bind(compile_code), 
+                code_id, 
+                file_type,
+                True,
+                quota_key
+            )
         
         if compile_result["success"]:
-            save_status(code_id, "testing", "candidate")
+            compile_report = compile_result.get("report")
+            save_status(code_id, "testing", file_type, compile_report=compile_report)
 
+            # Run the validation suite in the thread pool too, it may take TEST_TIMEOUT seconds
             try:
-                result = subprocess.run(
-                    [sys.executable, "-m", "app.services.test_runner", code_id, "candidate"],
-                    capture_output=True,
-                    text=True,
-                    timeout=3,
-                    preexec_fn=set_test_runtime_limits
+                result = await loop.run_in_executor(
+                    executor,
+                    tracing.bind(run_test_suite),
+                    code_id,
+                    file_type
                 )
 
-                if result.returncode == 0:
-                    try:
-                        payload = json.loads(result.stdout or "{}")
-                        test_return_value = payload.get("return_value")
-                    except Exception:
-                        test_return_value = None
+                try:
+                    payload = json.loads(result.stdout or "{}")
+                except Exception:
+                    payload = {}
+                validation = payload.get("validation")
+
+                profile = payload.get("profile")
+
+                if result.returncode == 0 and validation is None:
+                    # A bot calling exit(0) ends the runner before it prints its report
+                    save_status(
+                        code_id,
+                        "failed",
+                        file_type,
+                        "Test process exited without a report. "
+                        "makeMove must return normally, it must not end the program.",
+                        "testing",
+                        compile_report=compile_report
+                    )
+                elif result.returncode == 0 and profile and profile["limit_ratio"] > PROFILE_REJECT_RATIO:
+                    # Legal, but close enough to the time limit to clog the move workers
+                    save_status(
+                        code_id,
+                        "failed",
+                        file_type,
+                        f"Slowest test move took {profile['wall_us']['max'] / 1_000_000:.2f}s, "
+                        f"{profile['limit_ratio']:.0%} of the {MAKE_MOVE_TIME_LIMIT}s move limit. "
+                        "The bot would likely time out in games, please make it faster.",
+                        "testing",
+                        compile_report=compile_report,
+                        validation=validation,
+                        profile=profile
+                    )
+                elif result.returncode == 0:
+                    compile_report = await loop.run_in_executor(
+                        executor,
+                        tracing.bind(measure_speedup),
+                        code_id,
+                        file_type,
+                        payload.get("move_wall_us"),
+                        compile_report,
+                        quota_key
+                    )
                     save_status(
                         code_id,
                         "success",
-                        "candidate",
-                        test_return_value=test_return_value
+                        file_type,
+                        test_return_value=payload.get("return_value"),
+                        compile_report=compile_report,
+                        validation=validation,
+                        profile=profile
                     )
                 else:
-                    err_msg = None
-                    try:
-                        payload = json.loads(result.stdout or "{}")
-                        err_msg = payload.get("error")
-                    except Exception:
-                        pass
+                    err_msg = payload.get("error")
                     # If process was killed by a signal (e.g., SIGXCPU), normalize to timeout message
                     if not err_msg and result.returncode < 0:
                         sig = -result.returncode
                         if sig in (getattr(signal, 'SIGXCPU', None), signal.SIGKILL, signal.SIGTERM):
-                            err_msg = "Testing timeout (exceeded 3 seconds)"
+                            err_msg = f"Testing timeout (exceeded {TEST_TIMEOUT} seconds)"
                     if not err_msg and result.returncode < 0:
                         # Non-timeout signal: provide a clearer crash reason
                         sig = -result.returncode
@@ -252,39 +387,172 @@ async def process_candidate_async(code_id: str):
                     save_status(
                         code_id,
                         "failed",
-                        "candidate",
+                        file_type,
                         err_msg,
-                        "testing"
+                        "testing",
+                        compile_report=compile_report,
+                        validation=validation,
+                        profile=profile
                     )
             except subprocess.TimeoutExpired:
                 save_status(
                     code_id,
                     "failed",
-                    "candidate",
-                    "Testing timeout (exceeded 3 seconds)",
-                    "testing"
+                    file_type,
+                    f"Testing timeout (exceeded {TEST_TIMEOUT} seconds)",
+                    "testing",
+                    compile_report=compile_report
                 )
         else:
             # Compilation failed, save the error
             save_status(
                 code_id, 
                 "failed", 
-                "candidate", 
+                file_type, 
                 compile_result["error"], 
-                "compiling"
+                "compiling",
+                diagnostics=diagnostics
             )
             
     except Exception as e:
         # Error during processing
-        save_status(code_id, "failed", "candidate", 
+        save_status(code_id, "failed", file_type, 
                    f"Processing error: {str(e)}")
 
 
-# Routers
-MAX_FILE_SIZE = 500 * 1024  # 500KB
+# ==================== UPLOAD STREAMING ====================
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Cap the request body of the upload routes before anything is buffered.
+    Starlette spools the whole multipart form before the handler runs, so the
+    handlers' own checks come too late to save memory or disk: a declared
+    Content-Length over the cap is answered 413 at once, a chunked body is
+    counted as it arrives and cut off at the cap.
+    """
+
+    def __init__(self, app, max_body: int = MAX_UPLOAD_BODY, prefix: str = "/api/upload/"):
+        self.app = app
+        self.max_body = max_body
+        self.prefix = prefix
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "File size exceeds 500KB limit."}).encode()
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and (not length.isdigit() or int(length) > self.max_body):
+            await self._reject(send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    if not rejected:
+                        rejected = True
+                        await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The form parser gives up on the cut-off body; the 413 is already sent
+            if not rejected:
+                raise
+
+async def stream_upload(file: UploadFile, file_path: str) -> Tuple[str, List[dict]]:
+    """
+    Stream the upload to disk in one pass: the rvc.h include first, then the body.
+    The file is read from Starlette's spooled copy, whose size the middleware
+    already bounded; reading stops once MAX_FILE_SIZE is exceeded. The same pass computes
+    the content hash and runs the C validator over the body, so diagnostic
+    line numbers match the user's file.
+    Returns (sha256 of the uploaded body, validation diagnostics).
+    """
+    digest = hashlib.sha256()
+    validator = CValidator()
+    total = 0
+    read_s = validate_s = write_s = 0.0
+
+    try:
+        async with aiofiles.open(file_path, 'wb') as f:
+            # IMPORTANT: insert #include "rvc.h", otherwise will fail compiling
+            await f.write(RVC_INCLUDE)
+
+            while True:
+                mark = time.perf_counter()
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                read_s += time.perf_counter() - mark
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > MAX_FILE_SIZE:
+                    raise UploadTooLarge()
+
+                mark = time.perf_counter()
+                digest.update(chunk)
+                validator.feed(chunk)
+                validate_s += time.perf_counter() - mark
+
+                mark = time.perf_counter()
+                await f.write(chunk)
+                write_s += time.perf_counter() - mark
+    except BaseException:
+        # Never leave a partial source behind for the TTL cleanup
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+    diagnostics = validator.finish()
+    metrics.UPLOAD_STAGE.observe(read_s, stage="read")
+    metrics.UPLOAD_STAGE.observe(validate_s, stage="validate")
+    metrics.UPLOAD_STAGE.observe(write_s, stage="write")
+    return digest.hexdigest(), diagnostics
+
+def admit_upload(request: Request) -> str:
+    """ Charge the fixed upload cost to the client, 429 while its CPU quota is in debt """
+    key = client_key(request)
+    try:
+        quota.admit(key, cost=UPLOAD_COST)
+    except QuotaExceeded as e:
+        metrics.QUOTA_REJECTS.inc(route="upload", bucket=e.kind)
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers())
+    return key
+
+def size_limit_detail(file: UploadFile) -> str:
+    """ 413 detail of an oversize file, the same text UploadSizeLimitMiddleware answers with """
+    detail = "File size exceeds 500KB limit."
+    if file.size:
+        detail += f" Your file is {file.size / 1024:.1f}KB."
+    return detail
+
+
+# ==================== CANDIDATE ROUTERS ====================
 
 @upload_router.post("/api/upload/candidate")
-async def process_candidate(file: UploadFile = File(...)) -> ProcessResponse:
+async def process_candidate(request: Request, file: UploadFile = File(...)) -> ProcessResponse:
     """
     Upload and process candidate file (temporary code)
     """
@@ -292,12 +560,13 @@ async def process_candidate(file: UploadFile = File(...)) -> ProcessResponse:
         if not file.filename or not file.filename.endswith('.c'):
             raise HTTPException(status_code=400, detail="Only .c files are allowed")
         
-        # Check file size limit
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail=f"File size exceeds 500KB limit. Your file is {len(content) / 1024:.1f}KB.")
-        await file.seek(0)  # Reset file position for later read
+        # The form is spooled by now, UploadSizeLimitMiddleware capped the body before that;
+        # this checks the file part itself, whose size Starlette recorded while spooling
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=size_limit_detail(file))
         
+        quota_key = admit_upload(request)
+
         # Generate a unique ID, new name, and store path for the code
         code_id = str(uuid.uuid4())
         new_filename = f"candidate_{code_id}.c"
@@ -306,23 +575,18 @@ async def process_candidate(file: UploadFile = File(...)) -> ProcessResponse:
         # Set the initial status to "uploading"
         save_status(code_id, "uploading", "candidate")
 
-        # Save file, with renaming, write in binary to prevent encoding issues
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-
-        # IMPORTANT: insert #include "rvc.h", otherwise will fail compiling
-        async with aiofiles.open(file_path, 'rb+') as f:
-            content = await f.read()
-            await f.seek(0)
-            await f.write(b'#include "rvc.h"\n' + content)
-            await f.truncate()
+        # Save file with renaming in one streamed pass, size-capped and validated on the way
+        try:
+            content_hash, diagnostics = await stream_upload(file, file_path)
+        except UploadTooLarge:
+            cleanup_status(code_id, "candidate")
+            raise HTTPException(status_code=413, detail=size_limit_detail(file))
 
         # Start background compilation process
-        asyncio.create_task(process_candidate_async(code_id))
+        asyncio.create_task(process_code_async(code_id, "candidate", diagnostics, quota_key))
 
         # Return the response in the expected format: ProcessResponse
-        return ProcessResponse(code_id=code_id)
+        return ProcessResponse(code_id=code_id, content_hash=content_hash)
     
     except HTTPException:
         raise
@@ -332,6 +596,14 @@ async def process_candidate(file: UploadFile = File(...)) -> ProcessResponse:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
     
 
+@upload_router.get("/api/profile/candidate/{code_id}", response_model=PerformanceProfile)
+async def get_candidate_profile(code_id: str):
+    """
+    Get the performance profile of a tested candidate file
+    """
+    return load_profile(code_id, "candidate")
+
+
 @upload_router.post("/api/cleanup/candidate/{code_id}")
 async def cleanup_candidate(code_id: str):
     """
@@ -346,7 +618,9 @@ async def cleanup_candidate(code_id: str):
         # Delete shared library file after compiled (.so)
         compiled_file = f"data/shared_libs/candidates/candidate_{code_id}.so"
         if os.path.exists(compiled_file):
+            library_cache.discard(compiled_file)
             os.remove(compiled_file)
+        cleanup_inspection(compiled_file)
 
         # Delete the status file
         cleanup_status(code_id, "candidate")
@@ -376,7 +650,11 @@ async def get_candidate_status(code_id: str) -> StatusResponse:
             status=status_data["status"],
             error_message=status_data.get("error_message"),
             failed_stage=status_data.get("failed_stage"),
-            test_return_value=status_data.get("test_return_value")
+            test_return_value=status_data.get("test_return_value"),
+            compile_report=status_data.get("compile_report"),
+            diagnostics=status_data.get("diagnostics"),
+            validation=status_data.get("validation"),
+            profile=profile_summary(status_data.get("profile"))
         )
 
     except HTTPException:
@@ -387,115 +665,8 @@ async def get_candidate_status(code_id: str) -> StatusResponse:
 
 # ==================== CACHE ROUTERS ====================
 
-async def process_cache_async(code_id: str):
-    """
-    Asyncly process cache files: compilation and testing
-    """
-    try: 
-        # Update status: begin compiling
-        save_status(code_id, "compiling", "cache")
-
-        # Compile the code in a thread pool
-        loop = asyncio.get_event_loop()
-        compile_result = await loop.run_in_executor(
-            executor, 
-            compile_code, 
-            code_id, 
-            "cache"
-        )
-
-        if compile_result["success"]:
-            # Compilation succeeded, begin testing
-            save_status(code_id, "testing", "cache")
-            
-            # 在沙箱子进程里跑测试，带 3s 墙钟超时
-            try:
-                result = subprocess.run(
-                    [sys.executable, "-m", "app.services.test_runner", code_id, "cache"],
-                    capture_output=True,
-                    text=True,
-                    timeout=3,
-                    preexec_fn=set_test_runtime_limits
-                )
-
-                if result.returncode == 0:
-                    try:
-                        payload = json.loads(result.stdout or "{}")
-                        test_return_value = payload.get("return_value")
-                    except Exception:
-                        test_return_value = None
-                    save_status(
-                        code_id,
-                        "success",
-                        "cache",
-                        test_return_value=test_return_value
-                    )
-                else:
-                    err_msg = None
-                    try:
-                        payload = json.loads(result.stdout or "{}")
-                        err_msg = payload.get("error")
-                    except Exception:
-                        pass
-                    # If process was killed by a signal (e.g., SIGXCPU), normalize to timeout message
-                    if not err_msg and result.returncode < 0:
-                        sig = -result.returncode
-                        if sig in (getattr(signal, 'SIGXCPU', None), signal.SIGKILL, signal.SIGTERM):
-                            err_msg = "Testing timeout (exceeded 3 seconds)"
-                    if not err_msg and result.returncode < 0:
-                        # Non-timeout signal: provide a clearer crash reason
-                        sig = -result.returncode
-                        try:
-                            sig_name = signal.Signals(sig).name
-                        except Exception:
-                            sig_name = f"SIG{sig}"
-                        err_msg = (
-                            f"Test process crashed (signal {sig_name} {sig}). "
-                            "This usually indicates invalid memory access, abort, illegal instruction, or divide-by-zero. "
-                            "Please check pointer usage, array bounds, and makeMove signature."
-                        )
-                    if not err_msg:
-                        err_msg = (
-                            (result.stderr.strip() if result.stderr else "")
-                            or "Testing failed; reason unclear. This might be empty/invalid output, runtime crash, or environment limitation. Please check memory safety, out-of-bounds access, and function signature, then try again."
-                        )
-                    save_status(
-                        code_id,
-                        "failed",
-                        "cache",
-                        err_msg,
-                        "testing"
-                    )
-            except subprocess.TimeoutExpired:
-                save_status(
-                    code_id,
-                    "failed",
-                    "cache",
-                    "Testing timeout (exceeded 3 seconds)",
-                    "testing"
-                )
-        else:
-            # Compilation failed, save the error
-            save_status(
-                code_id, 
-                "failed", 
-                "cache", 
-                compile_result["error"], 
-                "compiling"
-            )
-
-    except Exception as e:
-        # Error during processing
-        save_status(
-            code_id, 
-            "failed", 
-            "cache", 
-            f"Processing error: {str(e)}"
-        )
-    
-
 @upload_router.post("/api/upload/cache")
-async def process_cache(file: UploadFile = File(...)) -> ProcessResponse:
+async def process_cache(request: Request, file: UploadFile = File(...)) -> ProcessResponse:
     """
     upload and process cache file (reuse within 36 hs)
     """
@@ -503,12 +674,13 @@ async def process_cache(file: UploadFile = File(...)) -> ProcessResponse:
         if not file.filename or not file.filename.endswith('.c'):
             raise HTTPException(status_code=400, detail="Only .c files are allowed")
         
-        # Check file size limit
-        content = await file.read()
-        if len(content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail=f"File size exceeds 500KB limit. Your file is {len(content) / 1024:.1f}KB.")
-        await file.seek(0)  # Reset file position for later read
+        # The form is spooled by now, UploadSizeLimitMiddleware capped the body before that;
+        # this checks the file part itself, whose size Starlette recorded while spooling
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail=size_limit_detail(file))
         
+        quota_key = admit_upload(request)
+
         # Generate a unique ID, new name, and store path for the code
         code_id = str(uuid.uuid4())
         new_filename = f"cache_{code_id}.c"
@@ -517,23 +689,18 @@ async def process_cache(file: UploadFile = File(...)) -> ProcessResponse:
         # Set the initial status to "uploading"
         save_status(code_id, "uploading", "cache")
 
-        # Save file, with renaming, write in binary to prevent encoding issues
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-
-        # IMPORTANT: insert #include "rvc.h", otherwise will fail compiling
-        async with aiofiles.open(file_path, 'rb+') as f:
-            content = await f.read()
-            await f.seek(0)
-            await f.write(b'#include "rvc.h"\n' + content)
-            await f.truncate()
+        # Save file with renaming in one streamed pass, size-capped and validated on the way
+        try:
+            content_hash, diagnostics = await stream_upload(file, file_path)
+        except UploadTooLarge:
+            cleanup_status(code_id, "cache")
+            raise HTTPException(status_code=413, detail=size_limit_detail(file))
 
         # Start background processing task
-        asyncio.create_task(process_cache_async(code_id))
+        asyncio.create_task(process_code_async(code_id, "cache", diagnostics, quota_key))
 
         # Return the response in ProcessResponse
-        return ProcessResponse(code_id=code_id)
+        return ProcessResponse(code_id=code_id, content_hash=content_hash)
 
     except HTTPException:
         raise
@@ -561,7 +728,11 @@ async def get_cache_status(code_id: str) -> StatusResponse:
             status=status_data["status"],
             error_message=status_data.get("error_message"),
             failed_stage=status_data.get("failed_stage"),
-            test_return_value=status_data.get("test_return_value")
+            test_return_value=status_data.get("test_return_value"),
+            compile_report=status_data.get("compile_report"),
+            diagnostics=status_data.get("diagnostics"),
+            validation=status_data.get("validation"),
+            profile=profile_summary(status_data.get("profile"))
         )
 
     except HTTPException:
@@ -570,6 +741,14 @@ async def get_cache_status(code_id: str) -> StatusResponse:
         raise HTTPException(status_code=500, detail=f"Failed to get cache status: {str(e)}")
     
 
+@upload_router.get("/api/profile/cache/{code_id}", response_model=PerformanceProfile)
+async def get_cache_profile(code_id: str):
+    """
+    Get the performance profile of a tested cache file
+    """
+    return load_profile(code_id, "cache")
+    
+
 @upload_router.post("/api/cleanup/cache/{code_id}")
 async def cleanup_cache(code_id: str):
     """
@@ -584,7 +763,9 @@ async def cleanup_cache(code_id: str):
         # delete .so
         compiled_file = f"data/shared_libs/caches/cache_{code_id}.so"
         if os.path.exists(compiled_file):
+            library_cache.discard(compiled_file)
             os.remove(compiled_file)
+        cleanup_inspection(compiled_file)
 
         # delete status file
         cleanup_status(code_id, "cache")
@@ -599,11 +780,9 @@ async def cleanup_cache(code_id: str):
 async def check_archive_exists(archive_group: str, archive_id: str):
     """
     Check if the archive code exists in the specified group and ID.
+    Answered from the in-memory catalog, no filesystem probe per request.
     """
-    c_path = f"data/c_src/archives/{archive_group}/{archive_id}.c"
-    so_path = f"data/shared_libs/archives/{archive_group}/{archive_id}.so"
-    
-    if os.path.exists(c_path) and os.path.exists(so_path):
+    if catalog.exists(archive_group, archive_id):
         return {"status": "exists"}
     else:
         raise HTTPException(status_code=404, detail="Archive not found")
\ No newline at end of file
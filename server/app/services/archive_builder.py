@@ -0,0 +1,171 @@
+'''
+Parallel, incremental build of the archived bots:
+data/c_src/archives/<group>/<name>.c → data/shared_libs/archives/<group>/<name>.so
+
+Sources are skipped when their content hash matches the build manifest, so the
+same entry point serves the image build (`python -m app.services.archive_builder`)
+and the runtime job that hot-adds new archives without restarting uvicorn.
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from app.services.archive_catalog import SRC_ARCHIVES, LIB_ARCHIVES, BUILD_MANIFEST, catalog
+
+ARCHIVE_CFLAGS = ["-O2", "-std=c99", "-fPIC", "-shared"]
+LOCK_FILE = os.path.join(LIB_ARCHIVES, ".build.lock")
+
+# Per-file compile limit, same as the upload path
+COMPILE_TIMEOUT = 30
+
+
+def load_manifest() -> dict:
+    """ Load the build manifest: "<group>/<name>" -> hash, compile_ms, so_size, built_at, error """
+    try:
+        with open(BUILD_MANIFEST, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_manifest(manifest: dict):
+    tmp_file = f"{BUILD_MANIFEST}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, BUILD_MANIFEST)
+
+
+def _source_hash(source_file: str) -> str:
+    """ Hash the source together with the flags, so a flag change forces a rebuild """
+    digest = hashlib.sha256(" ".join(ARCHIVE_CFLAGS).encode())
+    with open(source_file, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _find_sources() -> dict:
+    """ Map "<group>/<name>" to its .c path """
+    sources = {}
+    if not os.path.isdir(SRC_ARCHIVES):
+        return sources
+    for group in sorted(os.listdir(SRC_ARCHIVES)):
+        group_dir = os.path.join(SRC_ARCHIVES, group)
+        if not os.path.isdir(group_dir):
+            continue
+        for fname in sorted(os.listdir(group_dir)):
+            if fname.endswith(".c"):
+                sources[f"{group}/{fname[:-2]}"] = os.path.join(group_dir, fname)
+    return sources
+
+
+def compile_archive(key: str, source_file: str) -> dict:
+    """
+    Compile one archive into its .so. The output is written to a temporary
+    file first, so a running game never dlopens a half-written library.
+    """
+    output_file = os.path.join(LIB_ARCHIVES, f"{key}.so")
+    tmp_file = f"{output_file}.tmp"
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            ["gcc", *ARCHIVE_CFLAGS, "-o", tmp_file, source_file],
+            capture_output=True,
+            text=True,
+            timeout=COMPILE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        result = None
+    compile_ms = int((time.perf_counter() - start) * 1000)
+
+    if result is None or result.returncode != 0:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        error = "Compilation timeout" if result is None else (result.stderr or "Compilation failed")
+        return {"success": False, "compile_ms": compile_ms, "error": error}
+
+    os.replace(tmp_file, output_file)
+    return {"success": True, "compile_ms": compile_ms, "so_size": os.path.getsize(output_file)}
+
+
+def build_archives(max_workers: Optional[int] = None, blocking: bool = True) -> dict:
+    """
+    Compile every new or changed archive in parallel across cores.
+
+    Uvicorn workers share one lock file; with blocking=False a worker that finds
+    another build in progress simply skips this round.
+    """
+    summary = {"built": [], "failed": [], "skipped": 0}
+    os.makedirs(LIB_ARCHIVES, exist_ok=True)
+
+    with open(LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return summary
+
+        manifest = load_manifest()
+        sources = _find_sources()
+        # Forget archives whose source has been removed
+        removed = [key for key in manifest if key not in sources]
+        for key in removed:
+            del manifest[key]
+
+        pending = {}
+        for key, source_file in sources.items():
+            source_hash = _source_hash(source_file)
+            record = manifest.get(key, {})
+            so_exists = os.path.exists(os.path.join(LIB_ARCHIVES, f"{key}.so"))
+            # Failed sources are not retried until they change
+            if record.get("hash") == source_hash and (so_exists or record.get("error")):
+                summary["skipped"] += 1
+                continue
+            pending[key] = (source_file, source_hash)
+
+        if not pending:
+            if removed:
+                _save_manifest(manifest)
+            return summary
+
+        # gcc does the work in subprocesses, threads are enough to fan it out
+        with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as pool:
+            futures = {
+                key: pool.submit(compile_archive, key, source_file)
+                for key, (source_file, _) in pending.items()
+            }
+            for key, future in futures.items():
+                result = future.result()
+                manifest[key] = {
+                    "hash": pending[key][1],
+                    "compile_ms": result["compile_ms"],
+                    "so_size": result.get("so_size"),
+                    "built_at": datetime.now().isoformat(),
+                    "error": result.get("error"),
+                }
+                (summary["built"] if result["success"] else summary["failed"]).append(key)
+
+        _save_manifest(manifest)
+    return summary
+
+
+def hot_add_archives():
+    """ Runtime job: build whatever is new, then let the catalog pick it up """
+    summary = build_archives(blocking=False)
+    if summary["built"] or summary["failed"]:
+        print(f">>> archive build: {len(summary['built'])} built, {len(summary['failed'])} failed", flush=True)
+    catalog.refresh_if_changed()
+
+
+if __name__ == "__main__":
+    summary = build_archives()
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary["failed"] else 0)
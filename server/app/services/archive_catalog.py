@@ -0,0 +1,189 @@
+'''
+In-memory catalog of the archived bots, so archive lookups never touch the disk.
+
+The catalog mirrors data/c_src/archives/<group>/<name>.c and
+data/shared_libs/archives/<group>/<name>.so. It is built once at startup and
+refreshed by mtime polling (see `refresh_if_changed`, scheduled in app.main).
+'''
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SRC_ARCHIVES = "data/c_src/archives"
+LIB_ARCHIVES = "data/shared_libs/archives"
+
+# Optional hand-written metadata: {"<group>/<name>": {"rating": "(1175)"}}
+META_FILE = os.path.join(SRC_ARCHIVES, "catalog.json")
+
+# Written by app.services.archive_builder: compile time and size per bot
+BUILD_MANIFEST = os.path.join(LIB_ARCHIVES, "build_manifest.json")
+
+
+# Entry fields that differ between workers, kept out of the ETag'd listing
+WORKER_LOCAL_FIELDS = ("verified_at",)
+
+
+class ArchiveCatalog:
+    def __init__(self, src_root: str = SRC_ARCHIVES, lib_root: str = LIB_ARCHIVES):
+        self.src_root = src_root
+        self.lib_root = lib_root
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], dict] = {}
+        self._signature: Optional[str] = None
+        # Running latency mean per bot: (group, name) -> (moves, total_us)
+        self._latency: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        # Serialized listing and its ETag, rebuilt lazily after any change
+        self._listing: Optional[bytes] = None
+        self._etag: Optional[str] = None
+
+    # ---------- building ----------
+
+    def _scan_signature(self) -> str:
+        """ Cheap fingerprint of both archive trees (names, sizes and mtimes only) """
+        digest = hashlib.sha1()
+        for root in (self.src_root, self.lib_root):
+            if not os.path.isdir(root):
+                continue
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for fname in sorted(filenames):
+                    # Lock and temporary files churn without changing the catalog
+                    if not fname.endswith((".c", ".so", ".json")):
+                        continue
+                    st = os.stat(os.path.join(dirpath, fname))
+                    digest.update(f"{dirpath}/{fname}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def _load_json(self, path: str) -> dict:
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _scan(self) -> Dict[Tuple[str, str], dict]:
+        meta = self._load_json(META_FILE)
+        manifest = self._load_json(BUILD_MANIFEST)
+        entries = {}
+        if not os.path.isdir(self.src_root):
+            return entries
+
+        verified_at = datetime.now().isoformat()
+        for group in sorted(os.listdir(self.src_root)):
+            group_dir = os.path.join(self.src_root, group)
+            if not os.path.isdir(group_dir):
+                continue
+            for fname in sorted(os.listdir(group_dir)):
+                if not fname.endswith(".c"):
+                    continue
+                name = fname[:-2]
+                c_path = os.path.join(group_dir, fname)
+                so_path = os.path.join(self.lib_root, group, f"{name}.so")
+
+                if os.path.exists(so_path):
+                    so_size = os.path.getsize(so_path)
+                    # An .so older than its source still loads, but needs a rebuild
+                    stale = os.path.getmtime(so_path) < os.path.getmtime(c_path)
+                    status = "stale" if stale else "ready"
+                else:
+                    so_size = None
+                    status = "missing_library"
+
+                entries[(group, name)] = {
+                    "group": group,
+                    "name": name,
+                    "so_size": so_size,
+                    "status": status,
+                    "verified_at": verified_at,
+                    "rating": meta.get(f"{group}/{name}", {}).get("rating"),
+                    "compile_ms": manifest.get(f"{group}/{name}", {}).get("compile_ms"),
+                }
+        return entries
+
+    def refresh(self, signature: Optional[str] = None) -> bool:
+        """ Rebuild the catalog from disk. Returns True if anything changed. """
+        if signature is None:
+            signature = self._scan_signature()
+        entries = self._scan()
+        with self._lock:
+            changed = signature != self._signature
+            self._entries = entries
+            self._signature = signature
+            self._listing = None
+            self._etag = None
+        return changed
+
+    def refresh_if_changed(self) -> bool:
+        """ Polling hook: only rescan when the directory fingerprint moved """
+        signature = self._scan_signature()
+        if signature == self._signature:
+            return False
+        return self.refresh(signature)
+
+    # ---------- lookups ----------
+
+    def get(self, group: str, name: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get((group, name))
+            return dict(entry, **self._latency_fields(group, name)) if entry else None
+
+    def exists(self, group: str, name: str) -> bool:
+        """ Same contract as the old filesystem probe: both .c and .so are present """
+        entry = self._entries.get((group, name))
+        return entry is not None and entry["status"] != "missing_library"
+
+    def library_paths(self) -> List[str]:
+        """ .so paths of the loadable bots, in catalog order (same form as CMoveCaller's) """
+        with self._lock:
+            return [
+                os.path.join(self.lib_root, group, f"{name}.so")
+                for (group, name), entry in self._entries.items()
+                if entry["status"] != "missing_library"
+            ]
+
+    def record_move(self, group: str, name: str, elapsed_us: int):
+        """ Fold one makeMove() timing into the bot's average latency """
+        key = (group, name)
+        with self._lock:
+            if key not in self._entries:
+                return
+            moves, total = self._latency.get(key, (0, 0))
+            self._latency[key] = (moves + 1, total + elapsed_us)
+
+    def _latency_fields(self, group: str, name: str) -> dict:
+        moves, total = self._latency.get((group, name), (0, 0))
+        return {
+            "moves": moves,
+            "avg_move_us": total // moves if moves else None,
+        }
+
+    def listing(self) -> Tuple[bytes, str]:
+        """
+        Serialized catalog grouped by archive group, plus its ETag. Only what is on
+        disk goes in, so every worker serves the same bytes and ETag until the
+        archives change: the per-worker move latency and scan time are left to get().
+        """
+        with self._lock:
+            if self._listing is None:
+                groups: Dict[str, List[dict]] = {}
+                for (group, name), entry in self._entries.items():
+                    groups.setdefault(group, []).append(
+                        {k: v for k, v in entry.items() if k not in WORKER_LOCAL_FIELDS}
+                    )
+                payload = {
+                    "groups": [
+                        {"group": group, "archives": archives}
+                        for group, archives in groups.items()
+                    ]
+                }
+                self._listing = json.dumps(payload, separators=(",", ":")).encode()
+                self._etag = '"' + hashlib.sha1(self._listing).hexdigest() + '"'
+            return self._listing, self._etag
+
+
+# Process-wide catalog, each uvicorn worker keeps its own copy
+catalog = ArchiveCatalog()
@@ -0,0 +1,176 @@
+'''
+Per-bot statistics, folded incrementally into running totals.
+
+Two sources feed the totals:
+- the game log: games, wins, losses and draws, read from the last
+  checkpoint (segment, offset) on, so history is never rescanned;
+- live calls: makeMove elapsed time and timeouts from the move routers,
+  and AI fallbacks from fetch_ai_move, kept as in-memory deltas.
+
+update() runs from the scheduler in every worker. Under an flock it loads
+the shared snapshot (data/games/bot_stats.json), folds in the new games and
+this worker's deltas, and writes it back with the new checkpoint. Readers
+use the last snapshot loaded, reloading when another worker replaced it.
+
+Player ids of recorded games come from the client, so only known ones get
+their own totals: archive bots in the catalog, the AI providers and
+"human". Uploaded bots are short-lived, their uuids are pooled per type
+("candidate", "cache") when the code is stored. Everything else is pooled
+under "unknown", so the snapshot stays small.
+'''
+
+import fcntl
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.ai.services import PlayAgent
+from app.services.archive_catalog import catalog
+from app.services.game_log import GAMES_DIR, game_log
+
+SNAPSHOT_FILE = os.path.join(GAMES_DIR, "bot_stats.json")
+LOCK_FILE = os.path.join(GAMES_DIR, ".stats.lock")
+
+FIELDS = ("games", "wins", "losses", "draws", "moves", "elapsed_us", "timeouts", "ai_calls", "ai_fallbacks")
+
+
+UPLOAD_TYPES = ("candidate", "cache")
+UNKNOWN_KEY = "unknown"
+
+
+def _code_stored(code_type: str, code_id: str) -> bool:
+    if not code_id or "/" in code_id or code_id.startswith("."):
+        return False
+    return os.path.exists(f"data/shared_libs/{code_type}s/{code_type}_{code_id}.so")
+
+
+def stats_key(player: str) -> str:
+    """
+    Known archive bots, ai/<aiId> and human are kept, stored uploads are pooled by type,
+    every other id (client supplied, or an upload already cleaned up) under UNKNOWN_KEY
+    """
+    kind, _, rest = player.partition("/")
+    if player == "human":
+        return player
+    if kind == "ai" and rest in PlayAgent.AI_IDS:
+        return player
+    if kind == "archive":
+        group, _, name = rest.partition("/")
+        if catalog.exists(group, name):
+            return player
+    if kind in UPLOAD_TYPES and _code_stored(kind, rest):
+        return kind
+    return UNKNOWN_KEY
+
+
+def _empty_snapshot() -> dict:
+    return {"checkpoint": {"gen": 0, "offset": 0}, "updated_at": None, "bots": {}}
+
+
+def _fold(bots: Dict[str, dict], key: str, **counts):
+    entry = bots.setdefault(key, dict.fromkeys(FIELDS, 0))
+    for field, value in counts.items():
+        entry[field] += value
+
+
+def summarize(key: str, entry: dict) -> dict:
+    """ Totals plus the derived rates served by the stats endpoints """
+    games = entry["games"]
+    return dict(
+        entry,
+        bot=key,
+        win_rate=round(entry["wins"] / games, 4) if games else None,
+        avg_move_us=entry["elapsed_us"] // entry["moves"] if entry["moves"] else None,
+        timeout_rate=round(entry["timeouts"] / entry["moves"], 4) if entry["moves"] else None,
+        fallback_rate=round(entry["ai_fallbacks"] / entry["ai_calls"], 4) if entry["ai_calls"] else None,
+    )
+
+
+class BotStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas: Dict[str, dict] = {}
+        self._snapshot = _empty_snapshot()
+        self._snapshot_mtime = None
+
+    # ---------- live events, cheap: a dict update under a lock ----------
+
+    def record_move(self, player: str, elapsed_us: int, timeout: bool):
+        with self._lock:
+            _fold(self._deltas, stats_key(player), moves=1, elapsed_us=elapsed_us, timeouts=int(timeout))
+
+    def record_ai(self, aiId: str, fallback: bool):
+        with self._lock:
+            _fold(self._deltas, f"ai/{aiId}", ai_calls=1, ai_fallbacks=int(fallback))
+
+    # ---------- snapshot ----------
+
+    def _load(self) -> dict:
+        try:
+            with open(SNAPSHOT_FILE, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _empty_snapshot()
+        except Exception as e:
+            print(f"WARNING: unreadable {SNAPSHOT_FILE}, stats restart from scratch: {e}")
+            return _empty_snapshot()
+
+    def update(self) -> int:
+        """ Fold new games and this worker's deltas into the shared snapshot; returns games folded """
+        os.makedirs(GAMES_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = self._load()
+            bots = snapshot["bots"]
+            checkpoint = snapshot["checkpoint"]
+
+            folded = 0
+            for game, gen, offset in game_log.scan(checkpoint["gen"], checkpoint["offset"]):
+                checkpoint = {"gen": gen, "offset": offset}
+                if game is None:
+                    continue
+                folded += 1
+                if game["outcome"] == "unfinished":
+                    continue
+                for color, player in (("black", game["black"]), ("white", game["white"])):
+                    won = game["outcome"] == color
+                    lost = game["outcome"] not in (color, "draw")
+                    _fold(bots, stats_key(player), games=1, wins=int(won), losses=int(lost),
+                          draws=int(game["outcome"] == "draw"))
+
+            with self._lock:
+                deltas, self._deltas = self._deltas, {}
+            for key, counts in deltas.items():
+                _fold(bots, key, **counts)
+
+            snapshot["checkpoint"] = checkpoint
+            snapshot["updated_at"] = datetime.now().isoformat()
+            tmp_file = f"{SNAPSHOT_FILE}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_file, SNAPSHOT_FILE)
+
+            self._snapshot = snapshot
+            self._snapshot_mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+        return folded
+
+    def snapshot(self) -> dict:
+        """ Latest snapshot written by any worker """
+        try:
+            mtime = os.stat(SNAPSHOT_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return self._snapshot
+        if mtime != self._snapshot_mtime:
+            self._snapshot = self._load()
+            self._snapshot_mtime = mtime
+        return self._snapshot
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self.snapshot()["bots"].get(key)
+        return summarize(key, entry) if entry else None
+
+
+# Process-wide aggregator, updated by the scheduler
+bot_stats = BotStats()
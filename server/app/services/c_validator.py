@@ -0,0 +1,310 @@
+'''
+Single-pass, lexer-based validator for uploaded and archived C bots.
+
+Unlike plain substring matching, the lexer knows about comments, string and
+character literals, line continuations, trigraphs/digraphs and preprocessor
+directives, so `exit(` inside a comment is fine while `fo\<newline>rk()` or
+a `##`-pasted macro is caught. Input is fed in byte chunks and processed line
+by line, so the whole check is linear in the size of the source.
+
+Batch use: python -m app.services.c_validator path/to/*.c
+Regression cases: python -m app.services.c_validator --self-test
+'''
+
+import codecs
+import json
+import re
+import sys
+from typing import Iterable, List, Optional
+
+MAX_CODE_LINES = 5000
+
+# Headers a bot has no reason to include
+DENIED_HEADERS = frozenset({
+    "unistd.h",     # system calls
+    "signal.h",     # signal handling
+    "dlfcn.h",      # loading other libraries
+    "spawn.h",      # process creation
+})
+DENIED_HEADER_PREFIXES = ("sys/",)   # system headers
+
+# Identifiers a bot must not reference, declared or not (C99 allows implicit calls)
+DENIED_SYMBOLS = frozenset({
+    "system", "popen",                                  # execute system commands
+    "exec", "execl", "execle", "execlp",                # execute external programs
+    "execv", "execve", "execvp", "execvpe",
+    "fork", "vfork",                                    # process operations
+    "kill",                                             # kill processes
+    "exit", "_exit", "_Exit", "quick_exit",             # exit the program
+    "syscall", "dlopen", "dlsym",                       # escape hatches
+    "asm", "__asm", "__asm__",                          # no way to do ece243 here
+})
+
+# C99 trigraphs, translated before tokenizing (gcc honours them with -std=c99)
+TRIGRAPHS = {
+    "??=": "#", "??/": "\\", "??'": "^", "??(": "[", "??)": "]",
+    "??!": "|", "??<": "{", "??>": "}", "??-": "~",
+}
+TRIGRAPH_RE = re.compile(r"\?\?[=/'()!<>\-]")
+
+# Every token is matched, punctuation included, so the previous token of an
+# identifier is the one right before it: in `(int, ...); exit(0)` it is ';',
+# not the '.' of the ellipsis. Only lines with something to check get here.
+TOKEN_RE = re.compile(r'''
+    (?P<line_comment>//)
+  | (?P<block_comment>/\*)
+  | (?P<string>(?:u8|[LuU])?"(?:\\.|[^"\\])*"?)
+  | (?P<char>[LuU]?'(?:\\.|[^'\\])*'?)
+  | (?P<ident>[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<number>\.?[0-9](?:[eEpP][+-]|[A-Za-z0-9_.])*)
+  | (?P<paste>\#\#|%:%:)
+  | (?P<hash>\#|%:)
+  | (?P<ellipsis>\.\.\.)
+  | (?P<member>->|\.)
+  | (?P<punct>\S)
+''', re.VERBOSE)
+
+INCLUDE_RE = re.compile(r'\s*(?:<([^>]*)>|"([^"]*)")')
+
+
+class CValidator:
+    """
+    Incremental validator. Call feed() with the raw bytes as they arrive and
+    finish() once; finish() returns the diagnostics, an empty list means the
+    source passed. Each diagnostic is a dict: line, col, code, message.
+    """
+
+    def __init__(self,
+                 denied_symbols: Iterable[str] = DENIED_SYMBOLS,
+                 denied_headers: Iterable[str] = DENIED_HEADERS,
+                 denied_header_prefixes: Iterable[str] = DENIED_HEADER_PREFIXES,
+                 max_lines: int = MAX_CODE_LINES,
+                 require_make_move: bool = True):
+        self.denied_symbols = frozenset(denied_symbols)
+        self.denied_headers = frozenset(denied_headers)
+        self.denied_header_prefixes = tuple(denied_header_prefixes)
+        self.max_lines = max_lines
+        self.require_make_move = require_make_move
+        # Lines with no comment, literal, directive or watched word need no lexing
+        watched = sorted(self.denied_symbols | {"makeMove"}, key=len, reverse=True)
+        self._interesting = re.compile(
+            r"[#%/\"']|\b(?:" + "|".join(map(re.escape, watched)) + r")\b"
+        )
+
+        self.diagnostics: List[dict] = []
+        self.lines = 0
+        self.has_make_move = False
+
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="strict")
+        self._invalid_encoding = False
+        self._pending = ""          # text after the last newline
+        self._logical = []          # physical lines joined by backslash continuations
+        self._logical_start = 0
+        self._in_comment = False
+        self._comment_start = 0
+        self._finished = False
+
+    # ---------- input ----------
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        try:
+            text = self._decoder.decode(chunk)
+        except UnicodeDecodeError:
+            if not self._invalid_encoding:
+                self._invalid_encoding = True
+                self._report(self.lines + 1, 1, "invalid-encoding", "source is not valid UTF-8")
+            # Keep lexing what can be read, the verdict is already failed
+            self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            text = self._decoder.decode(chunk)
+        self._feed_text(text)
+
+    def _feed_text(self, text: str):
+        text = self._pending + text
+        lines = text.split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._physical_line(line)
+
+    def finish(self) -> List[dict]:
+        if self._finished:
+            return self.diagnostics
+        self._finished = True
+
+        try:
+            tail = self._decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            tail = ""
+            if not self._invalid_encoding:
+                self._invalid_encoding = True
+                self._report(self.lines + 1, 1, "invalid-encoding", "source is not valid UTF-8")
+        self._feed_text(tail)
+        if self._pending:
+            self._physical_line(self._pending)
+            self._pending = ""
+        if self._logical:
+            self._logical_line("".join(self._logical), self._logical_start)
+            self._logical = []
+
+        if self._in_comment:
+            self._report(self._comment_start, 1, "unterminated-comment", "unterminated /* comment")
+        if self.lines > self.max_lines:
+            self._report(self.lines, 1, "line-limit", f"exceeds {self.max_lines} line limit")
+        if self.require_make_move and not self.has_make_move:
+            self._report(1, 1, "missing-makeMove", "missing makeMove function")
+        return self.diagnostics
+
+    # ---------- lexing ----------
+
+    def _report(self, line: int, col: int, code: str, message: str):
+        self.diagnostics.append({"line": line, "col": col, "code": code, "message": message})
+
+    def _physical_line(self, line: str):
+        self.lines += 1
+        if "??" in line:
+            line = TRIGRAPH_RE.sub(lambda m: TRIGRAPHS[m.group(0)], line)
+        if not self._logical:
+            self._logical_start = self.lines
+
+        # Backslash-newline splices lines before tokenizing, even inside identifiers
+        stripped = line.rstrip(" \t\r")
+        if stripped.endswith("\\"):
+            self._logical.append(stripped[:-1])
+            return
+        self._logical.append(line)
+        self._logical_line("".join(self._logical), self._logical_start)
+        self._logical = []
+
+    def _logical_line(self, line: str, lineno: int):
+        pos = 0
+        if self._in_comment:
+            close = line.find("*/")
+            if close < 0:
+                return
+            pos = close + 2
+            self._in_comment = False
+
+        if not self._interesting.search(line, pos):
+            return
+
+        line_start = pos
+        directive = None
+        prev = None
+
+        while True:
+            m = TOKEN_RE.search(line, pos)
+            if m is None:
+                break
+            kind = m.lastgroup
+            col = m.start() + 1
+            pos = m.end()
+
+            if kind == "line_comment":
+                break
+            if kind == "block_comment":
+                close = line.find("*/", pos)
+                if close < 0:
+                    self._in_comment = True
+                    self._comment_start = lineno
+                    break
+                pos = close + 2
+                continue
+
+            # '#' as the first token of the line starts a directive
+            if kind == "hash" and prev is None and not line[line_start:m.start()].strip():
+                directive = ""
+                prev = "#"
+                continue
+
+            if directive == "":
+                # Name of the directive right after '#'
+                directive = m.group(0) if kind == "ident" else "#"
+                if directive == "include":
+                    self._include(line, pos, lineno)
+                    return
+            elif kind == "paste" and directive is not None:
+                self._report(lineno, col, "token-pasting",
+                             "token pasting (##) is not allowed in macros")
+            elif kind == "ident":
+                name = m.group(0)
+                if name == "makeMove":
+                    self.has_make_move = True
+                # Member access such as `s.exit` is not the libc symbol: only a
+                # '.' or '->' token right before the name exempts it
+                elif name in self.denied_symbols and prev not in (".", "->"):
+                    self._report(lineno, col, "forbidden-symbol",
+                                 f"use of forbidden symbol '{name}'")
+            prev = m.group(0)
+
+    def _include(self, line: str, pos: int, lineno: int):
+        m = INCLUDE_RE.match(line, pos)
+        if not m:
+            self._report(lineno, pos + 1, "computed-include",
+                         "#include must name a header directly")
+            return
+        header = m.group(1) if m.group(1) is not None else m.group(2)
+        header = header.strip()
+        if header in self.denied_headers or header.startswith(self.denied_header_prefixes):
+            self._report(lineno, m.start(1 if m.group(1) is not None else 2) + 1,
+                         "forbidden-header", f"#include <{header}> is not allowed")
+
+
+def validate_source(code: bytes, **options) -> List[dict]:
+    """ Validate a whole source at once, returns its diagnostics """
+    validator = CValidator(**options)
+    validator.feed(code)
+    return validator.finish()
+
+
+def validate_file(file_path: str, chunk_size: int = 64 * 1024, **options) -> List[dict]:
+    """ Validate a source file, streaming it in chunks """
+    validator = CValidator(**options)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            validator.feed(chunk)
+    return validator.finish()
+
+
+def format_diagnostic(diagnostic: Optional[dict]) -> str:
+    """ One-line message for status files and logs """
+    if diagnostic is None:
+        return "Code validation failed"
+    return f"Code validation failed: {diagnostic['message']} (line {diagnostic['line']})"
+
+
+# Sources that once slipped through or were wrongly rejected: (source, expected diagnostic codes)
+REGRESSION_CASES = [
+    (b"int (*g)(int, ...); exit(0);", ["forbidden-symbol"]),       # '.' of the ellipsis is not member access
+    (b"int f(int a, ...); system(\"ls\");", ["forbidden-symbol"]),
+    (b"void h(struct s *p, struct s q) { p->exit = 1; q.exit = 2; }", []),
+    (b"/* exit(0); */ char *s = \"system\";", []),
+    (b"#define CALL(a, b) a##b", ["token-pasting"]),
+]
+_MAKE_MOVE = b"\nint makeMove(const char board[][26], int n, char turn, int *row, int *col) { return 0; }\n"
+
+
+def self_test() -> int:
+    """ Run REGRESSION_CASES, returns the number of failures """
+    failures = 0
+    for source, expected in REGRESSION_CASES:
+        codes = [d["code"] for d in validate_source(source + _MAKE_MOVE)]
+        if codes != expected:
+            failures += 1
+            print(f"FAIL: {source!r}: expected {expected}, got {codes}")
+    print(f"{len(REGRESSION_CASES) - failures}/{len(REGRESSION_CASES)} regression cases passed")
+    return failures
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--self-test"]:
+        sys.exit(1 if self_test() else 0)
+    failed = 0
+    for path in sys.argv[1:]:
+        try:
+            diagnostics = validate_file(path)
+        except OSError as e:
+            diagnostics = [{"line": 0, "col": 0, "code": "io-error", "message": str(e)}]
+        failed += bool(diagnostics)
+        print(json.dumps({"path": path, "ok": not diagnostics, "diagnostics": diagnostics}))
+    sys.exit(1 if failed else 0)
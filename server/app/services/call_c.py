@@ -3,13 +3,21 @@ Call the .c function to make move decision, during the game.
 '''
 
 import ctypes
+import _ctypes
 import os
 import time
 import signal
+import threading
+from collections import OrderedDict
+
+from app.utils import metrics, tracing
 
 # Time limit for makeMove() in seconds
 MAKE_MOVE_TIME_LIMIT = 3
 
+# Loaded bots kept per worker process, see LibraryCache
+SO_CACHE_SIZE = int(os.environ.get("RVC_SO_CACHE_SIZE", "64"))
+
 class TimeoutException(Exception):
     """Exception raised when makeMove() exceeds time limit"""
     pass
@@ -17,27 +25,69 @@ class TimeoutException(Exception):
 def _timeout_handler(signum, frame):
     raise TimeoutException("makeMove() exceeded time limit")
 
-class CMoveCaller:
-    @staticmethod
-    def call_make_move_105(board, size, turn, data_path, time_limit=MAKE_MOVE_TIME_LIMIT):
-        """
-        Call makeMove() function in .c file, 
-        which extracted from lab 8, APS105, 2022 version, University of Toronto.
+Board26x26 = (ctypes.c_char * 26) * 26
 
-        It returns row, col, elapsed, returnValue
+class LibraryCache:
+    """
+    LRU of loaded bots: .so path -> (mtime_ns, size, CDLL, makeMove). A hit
+    skips dlopen and the argtypes setup. glibc hands back the old mapping
+    when the same path is dlopen'ed again, so a library replaced on disk
+    (archive rebuild) and an evicted one are dlclose'd before reloading.
+    Only the move routes call into the cached functions, on the event loop.
+    """
 
-        board: list[list[str]]
-        size: int
-        turn: str ('B' or 'W')
-        code_type: 'candidate' | 'cache' | 'archive'
-        data_path: .so file path, relative
-        """
-        # Create .so path
-        so_file_path = f"data/shared_libs/{data_path}.so"
-        if not os.path.exists(so_file_path):
+    def __init__(self, maxsize: int = SO_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _close(entry):
+        try:
+            _ctypes.dlclose(entry[2]._handle)
+        except OSError:
+            pass
+
+    def get(self, so_file_path):
+        """ Return (makeMove, cache hit); raises FileNotFoundError if the library is gone """
+        try:
+            st = os.stat(so_file_path)
+        except FileNotFoundError:
+            self.discard(so_file_path)
             raise FileNotFoundError(f"Shared library not found: {so_file_path}")
-        
-        # Upload .so
+
+        with self._lock:
+            entry = self._entries.get(so_file_path)
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self._entries.move_to_end(so_file_path)
+                metrics.SO_CACHE.inc(result="hit")
+                return entry[3], True
+            if entry is not None:
+                del self._entries[so_file_path]
+                self._close(entry)
+                metrics.SO_CACHE.inc(result="reload")
+            else:
+                metrics.SO_CACHE.inc(result="miss")
+
+            lib, make_move = CMoveCaller.load_make_move(so_file_path)
+            self._entries[so_file_path] = (st.st_mtime_ns, st.st_size, lib, make_move)
+            if len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self._close(evicted)
+            return make_move, False
+
+    def discard(self, so_file_path):
+        """ Forget (and dlclose) a library, e.g. before its file is removed """
+        with self._lock:
+            entry = self._entries.pop(so_file_path, None)
+            if entry is not None:
+                self._close(entry)
+
+
+class CMoveCaller:
+    @staticmethod
+    def load_make_move(so_file_path):
+        """ dlopen the library, returns (library, its makeMove() with the argument types set) """
         lib = ctypes.CDLL(so_file_path)
 
         # Get makeMoke function
@@ -47,7 +97,6 @@ class CMoveCaller:
             raise RuntimeError("Function 'makeMove' not found in shared library")
         
         # Set parameter type
-        Board26x26 = (ctypes.c_char * 26) * 26
         make_move.argtypes = [
             Board26x26,            # board[][26]
             ctypes.c_int,          # n
@@ -56,8 +105,11 @@ class CMoveCaller:
             ctypes.POINTER(ctypes.c_int)   # col*
         ]
         make_move.restype = ctypes.c_int
+        return lib, make_move
 
-        # Convert board into ctypes
+    @staticmethod
+    def marshal_board(board):
+        """ Convert board into ctypes, padding with 'U' up to 26x26 """
         board_array = Board26x26()
         for i in range(26):
             for j in range(26):
@@ -65,6 +117,32 @@ class CMoveCaller:
                     board_array[i][j] = board[i][j].encode('utf-8')
                 else:
                     board_array[i][j] = b'U'
+        return board_array
+
+    @staticmethod
+    def call_make_move_105(board, size, turn, data_path, time_limit=MAKE_MOVE_TIME_LIMIT):
+        """
+        Call makeMove() function in .c file, 
+        which extracted from lab 8, APS105, 2022 version, University of Toronto.
+
+        It returns row, col, elapsed, returnValue
+
+        board: list[list[str]]
+        size: int
+        turn: str ('B' or 'W')
+        code_type: 'candidate' | 'cache' | 'archive'
+        data_path: .so file path, relative
+        """
+        # Create .so path
+        so_file_path = f"data/shared_libs/{data_path}.so"
+
+        # Upload .so, or reuse it when this worker already loaded it
+        with metrics.MOVE_STEP.time(step="dlopen"), tracing.span("dlopen", library=data_path) as span:
+            make_move, cached = library_cache.get(so_file_path)
+            span.set(cached=cached)
+
+        with metrics.MOVE_STEP.time(step="marshal"), tracing.span("marshal", size=size):
+            board_array = CMoveCaller.marshal_board(board)
 
         # row, col output parameter
         row = ctypes.c_int()
@@ -76,10 +154,14 @@ class CMoveCaller:
 
         try:
             # Timing and calling
-            start = time.time()
-            return_value = make_move(board_array, size, turn.encode('utf-8'), ctypes.byref(row), ctypes.byref(col))
-            elapsed = int((time.time() - start) * 1000 * 1000) # us
-            signal.alarm(0)  # Cancel the alarm
+            with tracing.span("makeMove", size=size):
+                start = time.time()
+                start_cpu = time.thread_time()
+                return_value = make_move(board_array, size, turn.encode('utf-8'), ctypes.byref(row), ctypes.byref(col))
+                elapsed = int((time.time() - start) * 1000 * 1000) # us
+                cpu_us = int((time.thread_time() - start_cpu) * 1000 * 1000)
+                signal.alarm(0)  # Cancel the alarm
+            metrics.MOVE_STEP.observe(elapsed / 1_000_000, step="native")
 
             # Return normal result
             return {
@@ -87,19 +169,24 @@ class CMoveCaller:
                 "col": col.value,
                 "elapsed": elapsed,
                 "returnValue": return_value,
-                "timeout": False
+                "timeout": False,
+                "cpu_us": cpu_us,   # CPU time charged to the quota, not sent to the client
             }
         except TimeoutException:
+            metrics.MOVE_STEP.observe(time_limit, step="native")
             # Return timeout result
             return {
                 "row": -1,
                 "col": -1,
                 "elapsed": time_limit * 1000 * 1000,  # Convert to microseconds
                 "returnValue": -1,
-                "timeout": True
+                "timeout": True,
+                "cpu_us": int((time.thread_time() - start_cpu) * 1000 * 1000),
             }
         finally:
             signal.alarm(0)  # Ensure alarm is cancelled
             signal.signal(signal.SIGALRM, old_handler)  # Restore old handler
 
-    
\ No newline at end of file
+
+# Process-wide cache of loaded bots
+library_cache = LibraryCache()
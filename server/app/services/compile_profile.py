@@ -0,0 +1,260 @@
+'''
+Compile profile for uploaded bots (candidates and caches).
+
+Archives are built with -O2 (see app.services.archive_builder); uploads used to
+be built at gcc's default -O0. The profile makes the flags configurable:
+
+    RVC_OPT_LEVEL           optimization level, default "-O2"
+    RVC_MARCH               -march baseline, e.g. "x86-64-v2", default unset
+    RVC_LTO                 "1" to link-time optimize across rvc_tools.c
+    RVC_PRECOMPILED_TOOLS   link a prebuilt rvc_tools object instead of its source, default "1"
+    RVC_PRECOMPILED_HEADER  precompile rvc.h for the upload flags, default "1"
+    RVC_MEASURE_SPEEDUP     also build each upload at -O0 and time the test suite on it, default "1"
+
+The toolkit (rvc_tools object and rvc.h.gch) is built once at startup by
+`prepare_toolkit`, so per-upload gcc work covers only the student's file.
+
+The compile report puts the build time next to what the flags bought: the
+upload pipeline times the validation suite on the real build and on a -O0
+build of the same source, and `measured_speedup` is the ratio of the two.
+'''
+
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import List, Optional
+
+# Levels RVC_OPT_LEVEL accepts
+OPT_LEVELS = ("-O0", "-O1", "-Og", "-Os", "-O2", "-O3")
+
+WARNING_FLAGS = ["-Wall", "-Wextra"]
+
+# Seconds gcc gets to build a toolkit artifact
+BUILD_TIMEOUT = 30
+
+
+# Upload directories that each hold their own rvc.h and rvc_tools.c
+TOOLKIT_TYPES = ("candidate", "cache")
+
+# Artifact digests by (flags, path, mtime, size): compile_command asks on every upload
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class CompileProfile:
+    opt_level: str = "-O2"
+    march: Optional[str] = None
+    lto: bool = False
+    precompiled_tools: bool = True
+    precompiled_header: bool = True
+
+    @classmethod
+    def from_env(cls) -> "CompileProfile":
+        opt_level = os.environ.get("RVC_OPT_LEVEL", "-O2").strip()
+        if not opt_level.startswith("-"):
+            opt_level = f"-{opt_level}"
+        if opt_level not in OPT_LEVELS:
+            print(f"WARNING: Unknown RVC_OPT_LEVEL {opt_level}, falling back to -O2")
+            opt_level = "-O2"
+        return cls(
+            opt_level=opt_level,
+            march=os.environ.get("RVC_MARCH") or None,
+            lto=_env_flag("RVC_LTO"),
+            precompiled_tools=_env_flag("RVC_PRECOMPILED_TOOLS", default=True),
+            precompiled_header=_env_flag("RVC_PRECOMPILED_HEADER", default=True),
+        )
+
+    def baseline(self) -> "CompileProfile":
+        """ gcc's defaults, against which the speedup is measured; links rvc_tools.c from source """
+        return CompileProfile(opt_level="-O0", precompiled_tools=False, precompiled_header=False)
+
+    def is_baseline(self) -> bool:
+        return self.cflags() == self.baseline().cflags()
+
+    def cflags(self) -> List[str]:
+        """ Code generation flags shared by the tools object and the final link """
+        flags = [self.opt_level, "-std=c99", "-fPIC"]
+        if self.march:
+            flags.append(f"-march={self.march}")
+        if self.lto:
+            flags.append("-flto")
+        return flags
+
+    def _digest(self, source: str) -> str:
+        """ Key an artifact by the flags and its source, so stale builds are never reused """
+        flags = " ".join(self.cflags())
+        st = os.stat(source)
+        key = (flags, os.path.abspath(source), st.st_mtime_ns, st.st_size)
+        with _digests_lock:
+            cached = _digests.get(key)
+        if cached is not None:
+            return cached
+
+        digest = hashlib.sha1(flags.encode())
+        with open(source, "rb") as f:
+            digest.update(f.read())
+        value = digest.hexdigest()[:12]
+        with _digests_lock:
+            _digests[key] = value
+        return value
+
+    def tools_object_path(self, tools_source: str, output_dir: str) -> str:
+        return os.path.join(output_dir, f"rvc_tools-{self._digest(tools_source)}.o")
+
+    def _build_artifact(self, command: List[str], target: str, source: str) -> Optional[str]:
+        """
+        Run gcc into a private temp file and rename into place. The startup job, the upload
+        threads and other workers may all build the same target at once.
+        """
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(target),
+                                            prefix=f"{os.path.basename(target)}.", suffix=".tmp")
+            os.close(fd)
+        except OSError as e:
+            print(f"WARNING: Failed to prebuild {source}: {e}")
+            return None
+        try:
+            result = subprocess.run(
+                [*command, "-o", tmp_file, source],
+                capture_output=True,
+                text=True,
+                timeout=BUILD_TIMEOUT,
+            )
+            if result.returncode != 0:
+                print(f"WARNING: Failed to prebuild {source}: {result.stderr}")
+                return None
+            os.replace(tmp_file, target)
+            return target
+        except Exception as e:
+            print(f"WARNING: Failed to prebuild {source}: {e}")
+            return None
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def build_tools_object(self, tools_source: str, output_dir: str) -> Optional[str]:
+        """
+        Compile rvc_tools.c once into a position-independent object and reuse it.
+        Returns None if it cannot be built, callers then link the source instead.
+        """
+        try:
+            object_file = self.tools_object_path(tools_source, output_dir)
+        except OSError as e:
+            print(f"WARNING: Failed to prebuild {tools_source}: {e}")
+            return None
+        if os.path.exists(object_file):
+            return object_file
+        return self._build_artifact(["gcc", "-c", *self.cflags()], object_file, tools_source)
+
+    def build_header(self, header: str) -> Optional[str]:
+        """
+        Precompile rvc.h with the upload flags. gcc looks for `rvc.h.gch` next to the
+        header; as a directory it may hold one .gch per flag set and gcc picks the valid one.
+        """
+        try:
+            gch_dir = f"{header}.gch"
+            target = os.path.join(gch_dir, f"{self._digest(header)}.gch")
+            if os.path.exists(target):
+                return target
+            os.makedirs(gch_dir, exist_ok=True)
+        except OSError as e:
+            print(f"WARNING: Failed to precompile {header}: {e}")
+            return None
+        return self._build_artifact(["gcc", "-x", "c-header", *self.cflags()], target, header)
+
+    def prepare_toolkit(self):
+        """ Startup hook: build the rvc_tools object and rvc.h.gch for every upload type """
+        for file_type in TOOLKIT_TYPES:
+            src_dir = f"data/c_src/{file_type}s"
+            if self.precompiled_tools:
+                self.build_tools_object(
+                    os.path.join(src_dir, "rvc_tools.c"), f"data/shared_libs/{file_type}s"
+                )
+            if self.precompiled_header:
+                self.build_header(os.path.join(src_dir, "rvc.h"))
+
+    def prune_toolkit(self) -> List[str]:
+        """
+        Delete toolkit artifacts built under another digest (an older rvc_tools.c or rvc.h,
+        other flags) and temp files left by interrupted builds. Returns the removed paths.
+        """
+        removed = []
+        for file_type in TOOLKIT_TYPES:
+            src_dir = f"data/c_src/{file_type}s"
+            lib_dir = f"data/shared_libs/{file_type}s"
+            try:
+                current = {
+                    lib_dir: os.path.basename(self.tools_object_path(os.path.join(src_dir, "rvc_tools.c"), lib_dir)),
+                    os.path.join(src_dir, "rvc.h.gch"): f"{self._digest(os.path.join(src_dir, 'rvc.h'))}.gch",
+                }
+            except OSError:
+                # Without the sources there is no current digest to compare with
+                continue
+            for directory, keep in current.items():
+                if not os.path.isdir(directory):
+                    continue
+                for fname in os.listdir(directory):
+                    is_artifact = fname.startswith("rvc_tools-") if directory == lib_dir else True
+                    if not is_artifact or fname == keep:
+                        continue
+                    path = os.path.join(directory, fname)
+                    try:
+                        # A temp file may belong to a build still running
+                        if fname.endswith(".tmp") and time.time() - os.path.getmtime(path) < BUILD_TIMEOUT * 2:
+                            continue
+                        os.remove(path)
+                        removed.append(path)
+                    except OSError:
+                        pass
+        return removed
+
+    def compile_command(self, source_file: str, output_file: str, tools_source: str) -> List[str]:
+        """ gcc command building the uploaded source into a shared library """
+        tools_input = tools_source
+        if self.precompiled_tools:
+            tools_input = self.build_tools_object(
+                tools_source, os.path.dirname(output_file)
+            ) or tools_source
+
+        return [
+            "gcc",
+            "-shared",           # generate a shared library
+            *self.cflags(),      # optimization, C99, position-independent code
+            "-o", output_file,   # output file
+            source_file,         # src file
+            tools_input,         # link to reverc tools
+            *WARNING_FLAGS,
+        ]
+
+    def report(self, compile_ms: int) -> dict:
+        """ Per-submission summary: the flags used and what the build cost; the speedup is added once measured """
+        return dict(asdict(self), compile_ms=compile_ms, baseline_compile_ms=None, measured_speedup=None)
+
+
+def measured_speedup(baseline_wall_us: List[int], wall_us: List[int]) -> Optional[float]:
+    """
+    Suite time at -O0 over suite time with the profile, on the positions both runs played
+    (either may have stopped at the time budget). None without a usable measurement.
+    """
+    played = min(len(baseline_wall_us), len(wall_us))
+    optimized = sum(wall_us[:played])
+    if not played or optimized <= 0:
+        return None
+    return round(sum(baseline_wall_us[:played]) / optimized, 2)
+
+
+# Profile used for every upload, read once at import
+UPLOAD_PROFILE = CompileProfile.from_env()
+MEASURE_SPEEDUP = _env_flag("RVC_MEASURE_SPEEDUP", default=True)
@@ -0,0 +1,172 @@
+'''
+Post-compile inspection of the dynamic symbol table of a bot's .so.
+
+Source checks can be dodged; the linked library cannot hide what it imports.
+After gcc succeeds we read .dynsym straight from the ELF file (no extra
+dependency, a few microseconds) to confirm that makeMove is exported as a
+function and that no process, network or loader functions are imported.
+The result is cached next to the artifact as <name>.so.symbols.json.
+'''
+
+import hashlib
+import json
+import os
+import struct
+from typing import Dict, List, Optional
+
+# Imports that a Reversi bot has no business linking against
+FORBIDDEN_IMPORTS = frozenset({
+    # process creation / replacement
+    "fork", "vfork", "clone", "clone3", "execl", "execle", "execlp", "execv",
+    "execve", "execvp", "execvpe", "fexecve", "posix_spawn", "posix_spawnp",
+    "system", "popen",
+    # sockets and name resolution
+    "socket", "socketpair", "connect", "bind", "listen", "accept", "accept4",
+    "send", "sendto", "sendmsg", "recv", "recvfrom", "recvmsg",
+    "getaddrinfo", "gethostbyname",
+    # signals, tracing and raw syscalls
+    "kill", "tgkill", "ptrace", "syscall", "signal", "sigaction",
+    # ending the process: makeMove runs inside the uvicorn worker
+    "exit", "_exit", "_Exit", "quick_exit", "abort",
+    # loading or patching code at runtime
+    "dlopen", "dlsym", "mprotect",
+})
+
+MAKE_MOVE_SYMBOL = "makeMove"
+
+# Cached verdicts are only reused under the same deny-list
+RULES = hashlib.sha1(",".join(sorted(FORBIDDEN_IMPORTS)).encode()).hexdigest()[:12]
+
+# ELF constants used below
+SHT_DYNSYM = 11
+STT_FUNC = 2
+STB_GLOBAL, STB_WEAK = 1, 2
+STV_DEFAULT, STV_PROTECTED = 0, 3
+SHN_UNDEF = 0
+
+
+class ELFError(Exception):
+    """Raised when the file is not a readable ELF shared object"""
+    pass
+
+
+def read_dynamic_symbols(so_path: str) -> Dict[str, List[dict]]:
+    """
+    Parse .dynsym of an ELF file.
+    Returns {"exports": [...], "imports": [...]}, each symbol a dict of name, type and size.
+    """
+    with open(so_path, "rb") as f:
+        data = f.read()
+
+    if data[:4] != b"\x7fELF":
+        raise ELFError("not an ELF file")
+    elf_class, elf_data = data[4], data[5]
+    if elf_class not in (1, 2) or elf_data not in (1, 2):
+        raise ELFError("unsupported ELF class or byte order")
+    is64 = elf_class == 2
+    endian = "<" if elf_data == 1 else ">"
+
+    try:
+        # Section header table location from the ELF header
+        if is64:
+            e_shoff, = struct.unpack_from(endian + "Q", data, 0x28)
+            e_shentsize, e_shnum = struct.unpack_from(endian + "HH", data, 0x3A)
+            sh_fmt, sym_fmt = endian + "IIQQQQIIQQ", endian + "IBBHQQ"
+        else:
+            e_shoff, = struct.unpack_from(endian + "I", data, 0x20)
+            e_shentsize, e_shnum = struct.unpack_from(endian + "HH", data, 0x2E)
+            sh_fmt, sym_fmt = endian + "IIIIIIIIII", endian + "IIIBBH"
+
+        sections = [
+            struct.unpack_from(sh_fmt, data, e_shoff + i * e_shentsize)
+            for i in range(e_shnum)
+        ]
+    except struct.error:
+        raise ELFError("truncated section header table")
+
+    exports, imports = [], []
+    for sh_name, sh_type, _, _, sh_offset, sh_size, sh_link, _, _, sh_entsize in sections:
+        if sh_type != SHT_DYNSYM:
+            continue
+        strtab = sections[sh_link]
+        str_offset, str_size = strtab[4], strtab[5]
+        strings = data[str_offset:str_offset + str_size]
+
+        for offset in range(sh_offset, sh_offset + sh_size, sh_entsize):
+            try:
+                if is64:
+                    st_name, st_info, st_other, st_shndx, _, st_size = struct.unpack_from(sym_fmt, data, offset)
+                else:
+                    st_name, _, st_size, st_info, st_other, st_shndx = struct.unpack_from(sym_fmt, data, offset)
+            except struct.error:
+                raise ELFError("truncated symbol table")
+            if st_name == 0:
+                continue
+            name = strings[st_name:strings.index(b"\0", st_name)].decode("ascii", "replace")
+            symbol = {"name": name, "type": st_info & 0xF, "size": st_size}
+
+            if st_shndx == SHN_UNDEF:
+                imports.append(symbol)
+            elif st_info >> 4 in (STB_GLOBAL, STB_WEAK) and st_other & 0x3 in (STV_DEFAULT, STV_PROTECTED):
+                exports.append(symbol)
+
+    return {"exports": exports, "imports": imports}
+
+
+def _cache_path(so_path: str) -> str:
+    return f"{so_path}.symbols.json"
+
+
+def inspect_library(so_path: str) -> dict:
+    """
+    Inspect the library and return {"ok", "error", "exports", "imports"}.
+    Results are cached beside the .so and reused while its size, its mtime and the rules are unchanged.
+    """
+    st = os.stat(so_path)
+    cache_file = _cache_path(so_path)
+    try:
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+        if (cached.get("so_size"), cached.get("so_mtime_ns"), cached.get("rules")) == \
+                (st.st_size, st.st_mtime_ns, RULES):
+            return cached
+    except Exception:
+        pass
+
+    result = {"ok": True, "error": None, "so_size": st.st_size, "so_mtime_ns": st.st_mtime_ns, "rules": RULES}
+    try:
+        symbols = read_dynamic_symbols(so_path)
+    except (ELFError, OSError) as e:
+        result.update(ok=False, error=f"Unreadable shared library: {e}", exports=[], imports=[])
+    else:
+        result["exports"] = sorted(s["name"] for s in symbols["exports"])
+        result["imports"] = sorted(s["name"] for s in symbols["imports"])
+        result["error"] = _check(symbols)
+        result["ok"] = result["error"] is None
+
+    try:
+        with open(cache_file, "w") as f:
+            json.dump(result, f)
+    except OSError:
+        pass
+    return result
+
+
+def _check(symbols: Dict[str, List[dict]]) -> Optional[str]:
+    make_move = next((s for s in symbols["exports"] if s["name"] == MAKE_MOVE_SYMBOL), None)
+    if make_move is None:
+        return "Function 'makeMove' is not exported by the shared library (is it static?)"
+    if make_move["type"] != STT_FUNC:
+        return "'makeMove' is exported but is not a function"
+
+    forbidden = sorted({s["name"] for s in symbols["imports"]} & FORBIDDEN_IMPORTS)
+    if forbidden:
+        return f"Shared library imports forbidden functions: {', '.join(forbidden)}"
+    return None
+
+
+def cleanup_inspection(so_path: str):
+    """ Remove the cached inspection result of a library """
+    cache_file = _cache_path(so_path)
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
@@ -0,0 +1,463 @@
+'''
+Append-only log of finished games, in compact binary records.
+
+A record holds the board size, both player ids, the outcome and the move
+sequence: one byte per move when the board has fewer than 255 cells (up to
+14x14, so every 8x8 game), two bytes otherwise. Passes are not stored, the
+replay infers them. Per-move elapsed time and the timeout flag follow as one
+varint each (elapsed_us << 1 | timeout), a bot move usually fits in 2-3 bytes.
+
+Layout under data/games/, one generation number per segment:
+
+    games-000001.log    records, append-only, never rewritten
+    games-000001.idx    sealed segment: (game_id, offset) sorted by game_id
+    games-000002.log    active segment
+    games-000002.aidx   active segment: (game_id, offset) in append order
+
+Games are buffered in memory and appended in batches (once FLUSH_GAMES games
+are pending, off the event loop, or by the scheduler); compaction seals the active segment once it passes
+SEGMENT_BYTES, writing the sorted index that lookups binary-search through
+mmap. Several uvicorn workers share the files under an flock, game ids are
+random 64-bit numbers so workers never coordinate on ids.
+
+Record format, little endian:
+    u32 length of what follows
+    u8  version
+    u64 game_id, u32 started_at, u8 size, u8 outcome, u16 move count
+    u8 len + black player id, u8 len + white player id
+    moves (1 or 2 bytes each), timings (varints)
+    u32 crc32 of everything after the length
+'''
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.services import reversi
+
+GAMES_DIR = "data/games"
+LOCK_FILE = os.path.join(GAMES_DIR, ".lock")
+
+FLUSH_GAMES = 64                 # pending games that trigger a flush on append
+SEGMENT_BYTES = 8 * 1024 * 1024  # active segment size that triggers sealing
+RECORD_CACHE = 256               # decoded records kept for replays
+
+VERSION = 1
+OUTCOMES = ("unfinished", "black", "white", "draw")
+
+_LENGTH = struct.Struct("<I")
+_HEAD = struct.Struct("<BQIBBH")
+_INDEX = struct.Struct("<QQ")    # game_id, offset
+_CRC = struct.Struct("<I")
+
+
+class GameLogError(Exception):
+    """Raised when a game cannot be recorded or a record is unreadable"""
+    pass
+
+
+# ==================== Encoding ====================
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def move_width(size: int) -> int:
+    """ Bytes per move: one while every cell index fits below 255 """
+    return 1 if size * size < 255 else 2
+
+
+def encode_record(game: dict) -> bytes:
+    """
+    game: game_id, started_at, size, outcome, black, white,
+          moves [(row, col)], timings [(elapsed_us, timeout)]
+    """
+    size = game["size"]
+    black = game["black"].encode("utf-8")
+    white = game["white"].encode("utf-8")
+    if len(black) > 255 or len(white) > 255:
+        raise GameLogError("player id longer than 255 bytes")
+
+    cells = [row * size + col for row, col in game["moves"]]
+    moves = bytes(cells) if move_width(size) == 1 else struct.pack(f"<{len(cells)}H", *cells)
+    timings = b"".join(_varint(elapsed << 1 | bool(timeout)) for elapsed, timeout in game["timings"])
+
+    body = b"".join([
+        _HEAD.pack(VERSION, game["game_id"], game["started_at"], size,
+                   OUTCOMES.index(game["outcome"]), len(cells)),
+        bytes([len(black)]), black, bytes([len(white)]), white,
+        moves, timings,
+    ])
+    body += _CRC.pack(zlib.crc32(body))
+    return _LENGTH.pack(len(body)) + body
+
+
+def decode_record(data: bytes, offset: int = 0) -> Tuple[dict, int]:
+    """ Decode the record at `offset`; returns (game, offset of the next record) """
+    try:
+        length, = _LENGTH.unpack_from(data, offset)
+        start = offset + _LENGTH.size
+        body = data[start:start + length]
+        if len(body) != length or zlib.crc32(body[:-_CRC.size]) != _CRC.unpack_from(body, length - _CRC.size)[0]:
+            raise GameLogError(f"corrupt record at offset {offset}")
+
+        version, game_id, started_at, size, outcome, count = _HEAD.unpack_from(body, 0)
+        if version != VERSION:
+            raise GameLogError(f"unknown record version {version}")
+        pos = _HEAD.size
+        black = body[pos + 1:pos + 1 + body[pos]].decode("utf-8")
+        pos += 1 + body[pos]
+        white = body[pos + 1:pos + 1 + body[pos]].decode("utf-8")
+        pos += 1 + body[pos]
+
+        if move_width(size) == 1:
+            cells = body[pos:pos + count]
+            pos += count
+        else:
+            cells = struct.unpack_from(f"<{count}H", body, pos)
+            pos += 2 * count
+        timings = []
+        for _ in range(count):
+            value, pos = _read_varint(body, pos)
+            timings.append((value >> 1, bool(value & 1)))
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise GameLogError(f"truncated record at offset {offset}")
+
+    game = {
+        "game_id": game_id,
+        "started_at": started_at,
+        "size": size,
+        "outcome": OUTCOMES[outcome],
+        "black": black,
+        "white": white,
+        "moves": [divmod(cell, size) for cell in cells],
+        "timings": timings,
+    }
+    return game, start + length
+
+
+# ==================== Replay ====================
+
+def replay(size: int, moves: List[Tuple[int, int]], ply: Optional[int] = None, strict: bool = False) -> dict:
+    """
+    Board after `ply` moves (all of them by default), with the side to move.
+    Passes are inferred: a move that is illegal for the expected side was
+    played by the same side again. That shortcut trusts the record; strict
+    replays also check that the side really had to pass, a full legal-move
+    scan at each inferred pass. Raises GameLogError on an illegal move.
+    """
+    board = reversi.initial_board(size)
+    turn = 'B'
+    last = len(moves) if ply is None else max(0, min(ply, len(moves)))
+    for index, (row, col) in enumerate(moves[:last]):
+        if not reversi.is_legal(board, size, turn, row, col):
+            if strict and reversi.legal_moves(board, size, turn):
+                raise GameLogError(f"illegal move {index + 1}: ({row}, {col})")
+            turn = reversi.opponent(turn)
+            if not reversi.is_legal(board, size, turn, row, col):
+                raise GameLogError(f"illegal move {index + 1}: ({row}, {col})")
+        board = reversi.apply_move(board, size, turn, row, col)
+        turn = reversi.opponent(turn)
+
+    if last < len(moves):
+        # The next move tells whether the side to move has to pass
+        if not reversi.is_legal(board, size, turn, *moves[last]):
+            turn = reversi.opponent(turn)
+    elif not reversi.legal_moves(board, size, turn):
+        # Final position: a pending pass, or the end of the game
+        other = reversi.opponent(turn)
+        turn = other if reversi.legal_moves(board, size, other) else None
+    return {"board": board, "turn": turn, "ply": last}
+
+
+def outcome_of(board: reversi.Board, size: int, turn: Optional[str]) -> str:
+    if turn is not None:
+        return "unfinished"
+    black, white = reversi.count(board, size)
+    return "black" if black > white else "white" if white > black else "draw"
+
+
+# ==================== Log ====================
+
+def _segment_path(gen: int, ext: str) -> str:
+    return os.path.join(GAMES_DIR, f"games-{gen:06d}.{ext}")
+
+
+class GameLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[int, bytes]] = []   # (game_id, encoded record)
+        self._pending_ids: Dict[int, bytes] = {}
+        self._active_index: Tuple[Optional[Tuple[int, int]], Dict[int, int]] = (None, {})
+        self._cache: "OrderedDict[int, dict]" = OrderedDict()
+
+    # ---------- writing ----------
+
+    def record(self, size: int, black: str, white: str, moves: List[Tuple[int, int]],
+               timings: List[Tuple[int, bool]], started_at: Optional[int] = None) -> dict:
+        """
+        Validate a finished (or abandoned) game by replaying it, then queue it.
+        Returns the stored game, including its id and outcome. Never writes to
+        disk: flush() fsyncs, callers on the event loop run it in an executor
+        once should_flush() says so.
+        """
+        if not 4 <= size <= 26 or size % 2:
+            raise GameLogError(f"unsupported board size {size}")
+        if len(timings) != len(moves):
+            raise GameLogError("one timing per move is required")
+        final = replay(size, moves, strict=True)
+
+        game = {
+            "game_id": int.from_bytes(os.urandom(8), "little") >> 1,  # fits a signed 64-bit column
+            "started_at": int(started_at or time.time()),
+            "size": size,
+            "outcome": outcome_of(final["board"], size, final["turn"]),
+            "black": black,
+            "white": white,
+            "moves": list(moves),
+            "timings": list(timings),
+        }
+        data = encode_record(game)
+        with self._lock:
+            self._pending.append((game["game_id"], data))
+            self._pending_ids[game["game_id"]] = data
+        game["bytes"] = len(data)
+        return game
+
+    def should_flush(self) -> bool:
+        """ Enough games are pending to append a batch before the scheduled flush """
+        with self._lock:
+            return len(self._pending) >= FLUSH_GAMES
+
+    def flush(self) -> int:
+        """ Append the pending games in one write; returns how many were written """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        os.makedirs(GAMES_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            gen = self._active_generation()
+            log_path = _segment_path(gen, "log")
+            offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+
+            entries = []
+            for game_id, data in pending:
+                entries.append(_INDEX.pack(game_id, offset))
+                offset += len(data)
+            with open(log_path, "ab") as f:
+                f.write(b"".join(data for _, data in pending))
+                f.flush()
+                os.fsync(f.fileno())
+            # The index only ever points at bytes already on disk
+            with open(_segment_path(gen, "aidx"), "ab") as f:
+                f.write(b"".join(entries))
+
+        with self._lock:
+            for game_id, _ in pending:
+                self._pending_ids.pop(game_id, None)
+        return len(pending)
+
+    def compact(self, force: bool = False) -> Optional[int]:
+        """
+        Seal the active segment once it is large enough: write its index sorted
+        by game id for binary search, so the next flush starts a new segment.
+        Returns the sealed generation, if any.
+        """
+        self.flush()
+        if not os.path.isdir(GAMES_DIR):
+            return None
+        with open(LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            gen = self._active_generation()
+            aidx_path = _segment_path(gen, "aidx")
+            log_path = _segment_path(gen, "log")
+            if not os.path.exists(aidx_path):
+                return None
+            if not force and os.path.getsize(log_path) < SEGMENT_BYTES:
+                return None
+
+            with open(aidx_path, "rb") as f:
+                raw = f.read()
+            entries = sorted(_INDEX.iter_unpack(raw))
+            tmp_path = _segment_path(gen, "idx.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(_INDEX.pack(*entry) for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, _segment_path(gen, "idx"))
+            os.remove(aidx_path)
+            return gen
+
+    # ---------- reading ----------
+
+    def _generations(self) -> List[int]:
+        if not os.path.isdir(GAMES_DIR):
+            return []
+        return sorted(
+            int(fname[6:12]) for fname in os.listdir(GAMES_DIR)
+            if fname.startswith("games-") and fname.endswith(".log")
+        )
+
+    def _active_generation(self) -> int:
+        """ Highest generation without a sealed index; a new one after the last seal """
+        gens = self._generations()
+        if not gens:
+            return 1
+        last = gens[-1]
+        return last + 1 if os.path.exists(_segment_path(last, "idx")) else last
+
+    def _lookup_active(self, gen: int, game_id: int) -> Optional[int]:
+        path = _segment_path(gen, "aidx")
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key, index = self._active_index
+        if key != (gen, st.st_size):
+            with open(path, "rb") as f:
+                index = {gid: offset for gid, offset in _INDEX.iter_unpack(f.read())}
+            self._active_index = ((gen, st.st_size), index)
+        return index.get(game_id)
+
+    @staticmethod
+    def _lookup_sealed(gen: int, game_id: int) -> Optional[int]:
+        path = _segment_path(gen, "idx")
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            lo, hi = 0, len(m) // _INDEX.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                gid, offset = _INDEX.unpack_from(m, mid * _INDEX.size)
+                if gid == game_id:
+                    return offset
+                if gid < game_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return None
+
+    @staticmethod
+    def _read_at(gen: int, offset: int) -> dict:
+        with open(_segment_path(gen, "log"), "rb") as f:
+            f.seek(offset)
+            head = f.read(_LENGTH.size)
+            if len(head) < _LENGTH.size:
+                raise GameLogError(f"truncated record at offset {offset}")
+            data = head + f.read(_LENGTH.unpack(head)[0])
+        return decode_record(data)[0]
+
+    def get(self, game_id: int) -> Optional[dict]:
+        """ A stored (or still pending) game by id, None if unknown """
+        with self._lock:
+            if game_id in self._cache:
+                self._cache.move_to_end(game_id)
+                return self._cache[game_id]
+            pending = self._pending_ids.get(game_id)
+        if pending is not None:
+            return decode_record(pending)[0]
+
+        game = None
+        for gen in reversed(self._generations()):
+            if os.path.exists(_segment_path(gen, "idx")):
+                offset = self._lookup_sealed(gen, game_id)
+            else:
+                offset = self._lookup_active(gen, game_id)
+            if offset is not None:
+                game = self._read_at(gen, offset)
+                break
+        if game is None:
+            return None
+
+        with self._lock:
+            self._cache[game_id] = game
+            if len(self._cache) > RECORD_CACHE:
+                self._cache.popitem(last=False)
+        return game
+
+    def scan(self, gen: int = 0, offset: int = 0) -> Iterator[Tuple[Optional[dict], int, int]]:
+        """
+        Every flushed game from position (gen, offset) on, in log order.
+        Yields (game, gen, offset after the record) so callers can checkpoint;
+        only the bytes after the checkpoint are read. A record that cannot be
+        decoded is yielded as (None, gen, offset after it), so the checkpoint
+        moves past it instead of rereading it on every scan.
+        """
+        generations = self._generations()
+        for segment in generations:
+            if segment < gen:
+                continue
+            base = offset if segment == gen else 0
+            with open(_segment_path(segment, "log"), "rb") as f:
+                f.seek(base)
+                data = f.read()
+            pos = 0
+            while pos + _LENGTH.size <= len(data):
+                end = pos + _LENGTH.size + _LENGTH.unpack_from(data, pos)[0]
+                if end > len(data):
+                    if segment == generations[-1]:
+                        # A batch still being appended by another worker
+                        break
+                    # Nothing is appended to an older segment: the length itself is corrupt
+                    print(f"WARNING: skipping the truncated tail of segment {segment} at offset {base + pos}")
+                    yield None, segment, base + len(data)
+                    break
+                try:
+                    game, pos = decode_record(data, pos)
+                except GameLogError as e:
+                    print(f"WARNING: skipping game record in segment {segment}: {e}")
+                    pos = end
+                    yield None, segment, base + pos
+                    continue
+                yield game, segment, base + pos
+
+    def stats(self) -> dict:
+        gens = self._generations()
+        return {
+            "segments": len(gens),
+            "bytes": sum(os.path.getsize(_segment_path(g, "log")) for g in gens),
+            "pending": len(self._pending),
+        }
+
+
+def format_game_id(game_id: int) -> str:
+    return f"{game_id:016x}"
+
+
+def parse_game_id(text: str) -> Optional[int]:
+    try:
+        return int(text, 16) if len(text) == 16 else None
+    except ValueError:
+        return None
+
+
+# Process-wide log, flushed by the scheduler and at shutdown
+game_log = GameLog()
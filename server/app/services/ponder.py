@@ -0,0 +1,269 @@
+'''
+Speculative pondering for human-vs-bot games.
+
+After a bot move is sent, the human's legal replies are enumerated and the
+bot's answer to each is computed ahead of time in a small process pool, at
+nice 19 so it only gets the CPU the real requests leave idle. When the human
+move arrives, the answer is taken from the game's cache: a finished one is
+returned at once, a running one is awaited, a queued one is dropped and the
+move computed normally.
+
+Opt-in per request (POST /api/move/...?ponder=true) and only with a game id,
+which keys the cache. Caps, all per worker process:
+
+    RVC_PONDER=0            disable it on the server
+    RVC_PONDER_WORKERS      pool processes (default 1)
+    RVC_PONDER_TOP_K        replies pondered per bot move (default 8)
+    RVC_PONDER_MAX_PENDING  queued replies over all games; beyond it, skip
+    RVC_PONDER_MAX_GAMES    games cached, least recently moved dropped first
+    RVC_PONDER_TASKS_PER_WORKER  replies a pool process answers before it is replaced (default 64)
+
+The pool runs uploaded code on replies that may never be played, so its
+processes get the sandbox limits of the upload test run: 256MB of address
+space, an 8MB stack, and an RLIMIT_CPU that is raised before each reply to
+allow only MAKE_MOVE_TIME_LIMIT + 1 more seconds. SIGALRM cannot interrupt
+a native busy loop, the CPU limit kills the process instead. The pool is
+replaced after a reply overran the move limit or a process died, and
+every process after RVC_PONDER_TASKS_PER_WORKER replies.
+
+A new move of a game cancels its queued replies, since at most one of them
+can still be used; one already running finishes but is ignored.
+
+Pondering runs bots on behalf of the client, so every reply that runs is
+charged to the quota buckets of the move that queued it (app.services.quota),
+used or not. A bot move only queues as many replies as the emptiest bucket
+could pay for at MAKE_MOVE_TIME_LIMIT each, none while one is in debt.
+'''
+
+import asyncio
+import functools
+import hashlib
+import multiprocessing
+import os
+import resource
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from app.services import reversi
+from app.services.call_c import CMoveCaller, MAKE_MOVE_TIME_LIMIT
+from app.services.quota import quota
+from app.utils import metrics
+
+ENABLED = os.environ.get("RVC_PONDER", "1").lower() not in ("0", "false", "no", "off")
+PONDER_WORKERS = int(os.environ.get("RVC_PONDER_WORKERS", "1"))
+PONDER_TOP_K = int(os.environ.get("RVC_PONDER_TOP_K", "8"))
+MAX_PENDING = int(os.environ.get("RVC_PONDER_MAX_PENDING", "64"))
+MAX_GAMES = int(os.environ.get("RVC_PONDER_MAX_GAMES", "256"))
+
+TASKS_PER_WORKER = int(os.environ.get("RVC_PONDER_TASKS_PER_WORKER", "64"))
+
+# Same address space and stack limits as the upload test sandbox (set_test_runtime_limits)
+MEMORY_LIMIT = 256 * 1024 * 1024
+STACK_LIMIT = 8 * 1024 * 1024
+# CPU seconds one reply may use; the hard limit covers a process's whole life, plus startup
+TASK_CPU_LIMIT = MAKE_MOVE_TIME_LIMIT + 1
+WORKER_CPU_LIMIT = TASKS_PER_WORKER * TASK_CPU_LIMIT + 10
+
+CORNER_BONUS = 100
+
+
+def board_key(data_path: str, board: reversi.Board, size: int, turn: str) -> str:
+    """ Cache key of the position a bot has to answer """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{data_path}|{size}|{turn}|".encode())
+    for row in board[:size]:
+        digest.update("".join(row[:size]).encode())
+    return digest.hexdigest()
+
+
+def likely_replies(board: reversi.Board, size: int, turn: str, top_k: int) -> List[Tuple[int, int]]:
+    """ The human's legal replies, most plausible first: corners, then by discs flipped """
+    corners = {(0, 0), (0, size - 1), (size - 1, 0), (size - 1, size - 1)}
+    scored = [
+        (len(reversi.flips(board, size, turn, r, c)) + (CORNER_BONUS if (r, c) in corners else 0), (r, c))
+        for r, c in reversi.legal_moves(board, size, turn)
+    ]
+    scored.sort(key=lambda item: -item[0])
+    return [move for _, move in scored[:top_k]]
+
+
+def _init_worker():
+    """ Pool initializer: idle priority, pondering only uses spare CPU, inside the test sandbox limits """
+    os.nice(19)
+    for limit, value in ((resource.RLIMIT_AS, MEMORY_LIMIT), (resource.RLIMIT_STACK, STACK_LIMIT),
+                         (resource.RLIMIT_CPU, WORKER_CPU_LIMIT)):
+        try:
+            resource.setrlimit(limit, (value, value))
+        except (ValueError, OSError):
+            pass
+
+
+def _ponder_move(data_path: str, board: reversi.Board, size: int, turn: str) -> dict:
+    """
+    Runs in the pool, on the main thread of the worker process: the SIGALRM limit still applies
+    to a bot that returns, the CPU limit ends one that never does
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (
+            min(int(usage.ru_utime + usage.ru_stime) + TASK_CPU_LIMIT, WORKER_CPU_LIMIT), WORKER_CPU_LIMIT
+        ))
+    except (ValueError, OSError):
+        pass
+    return CMoveCaller.call_make_move_105(board=board, size=size, turn=turn, data_path=data_path)
+
+
+class Ponderer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._recycle = False
+        # game id -> {board key -> future}, least recently moved first
+        self._games: "OrderedDict[str, Dict[str, Future]]" = OrderedDict()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._recycle and self._pool is not None:
+            # A reply overran the move limit or killed its process: start over with fresh processes
+            self._recycle = False
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            metrics.PONDER.inc(result="recycled")
+        if self._pool is None:
+            # spawn: the worker process has threads (scheduler, executors), forking it is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=PONDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                max_tasks_per_child=TASKS_PER_WORKER,
+            )
+        return self._pool
+
+    def _pending(self) -> int:
+        return sum(not f.done() for futures in self._games.values() for f in futures.values())
+
+    @staticmethod
+    def _cancel(futures: Dict[str, Future]):
+        cancelled = sum(f.cancel() for f in futures.values())
+        if cancelled:
+            metrics.PONDER.inc(cancelled, result="cancelled")
+
+    async def take(self, game_id: Optional[str], data_path: str, board: reversi.Board,
+                   size: int, turn: str) -> Optional[dict]:
+        """ The pondered answer to this position, or None; the game's other replies are dropped """
+        if not game_id:
+            return None
+        with self._lock:
+            futures = self._games.pop(game_id, None)
+        if not futures:
+            return None
+
+        future = futures.pop(board_key(data_path, board, size, turn), None)
+        self._cancel(futures)
+        if future is None or future.cancelled():
+            metrics.PONDER.inc(result="miss")
+            return None
+        if not future.done() and not future.running():
+            future.cancel()
+            metrics.PONDER.inc(result="miss")
+            return None
+
+        ready = future.done()
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=MAKE_MOVE_TIME_LIMIT + 1)
+        except Exception as e:
+            print(f"WARNING: pondered move of game {game_id} failed: {e}")
+            metrics.PONDER.inc(result="error")
+            return None
+        metrics.PONDER.inc(result="hit" if ready else "wait")
+        # Already charged when it finished
+        return dict(result, pondered=True)
+
+    def schedule(self, game_id: Optional[str], data_path: str, board: reversi.Board,
+                 size: int, bot_turn: str, move_result: dict, quota_keys: Tuple[str, ...] = ()):
+        """
+        After a bot move: queue the bot's answers to the human's likely replies,
+        charged to `quota_keys` as they finish
+        """
+        if not ENABLED or not game_id or move_result.get("timeout"):
+            return
+        row, col = move_result["row"], move_result["col"]
+        if not reversi.is_legal(board, size, bot_turn, row, col):
+            return
+        after = reversi.apply_move(board, size, bot_turn, row, col)
+        human = reversi.opponent(bot_turn)
+        if reversi.next_turn(after, size, bot_turn) != human:
+            return  # game over, or the human passes and the bot moves again right away
+
+        try:
+            self._schedule(game_id, data_path, after, size, bot_turn, quota_keys)
+        except Exception as e:
+            # Pondering is best effort, the move itself was answered already
+            print(f"WARNING: pondering of game {game_id} failed: {e}")
+            if isinstance(e, BrokenProcessPool):
+                self.shutdown()
+
+    def _settle(self, quota_keys: Tuple[str, ...], future: Future):
+        """
+        Done callback: the CPU time of a reply that ran goes to the buckets of the move that
+        queued it; an overrun or a dead process gets the pool replaced before the next submit
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self._recycle = True
+            return
+        result = future.result()
+        quota.charge(*quota_keys, seconds=result.get("cpu_us", 0) / 1_000_000)
+        if result.get("timeout") or result.get("elapsed", 0) > MAKE_MOVE_TIME_LIMIT * 1_000_000:
+            self._recycle = True
+
+    def _schedule(self, game_id: str, data_path: str, after: reversi.Board, size: int, bot_turn: str,
+                  quota_keys: Tuple[str, ...]):
+        human = reversi.opponent(bot_turn)
+        affordable = quota.headroom(*quota_keys) // MAKE_MOVE_TIME_LIMIT
+        with self._lock:
+            budget = int(min(PONDER_TOP_K, MAX_PENDING - self._pending(), affordable))
+            if budget <= 0:
+                metrics.PONDER.inc(result="skipped")
+                return
+            futures = {}
+            for r, c in likely_replies(after, size, human, budget):
+                reply = reversi.apply_move(after, size, human, r, c)
+                if reversi.next_turn(reply, size, human) != bot_turn:
+                    continue
+                key = board_key(data_path, reply, size, bot_turn)
+                futures[key] = self._executor().submit(_ponder_move, data_path, reply, size, bot_turn)
+                futures[key].add_done_callback(functools.partial(self._settle, quota_keys))
+            metrics.PONDER.inc(len(futures), result="scheduled")
+
+            old = self._games.pop(game_id, None)
+            if old:
+                self._cancel(old)
+            self._games[game_id] = futures
+            while len(self._games) > MAX_GAMES:
+                _, evicted = self._games.popitem(last=False)
+                self._cancel(evicted)
+
+    def after_fork(self):
+        """ A forked child starts without the parent's pool and pending replies """
+        self._lock = threading.Lock()
+        self._pool = None
+        self._recycle = False
+        self._games = OrderedDict()
+
+    def shutdown(self):
+        with self._lock:
+            self._games.clear()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+# Process-wide pondering state, the pool is started on first use
+ponderer = Ponderer()
+os.register_at_fork(after_in_child=ponderer.after_fork)
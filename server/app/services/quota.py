@@ -0,0 +1,265 @@
+'''
+CPU quotas: token buckets per client and per uploaded bot, shared by all
+workers of the host.
+
+A bucket holds CPU seconds. It refills at `rate` seconds per second up to
+`burst`, and what a request actually used is charged after the fact:
+makeMove CPU time (thread_time around the native call) for moves, gcc wall
+time for uploads, plus a fixed UPLOAD_COST per upload so floods of cheap
+uploads are limited too. A request is admitted while every bucket it
+touches is positive; a bucket in debt answers 429 with the number of
+seconds until it is positive again.
+
+    client:<ip>         moves and uploads of one client
+    bot:<code_id>       moves of one uploaded bot, whoever plays it
+
+Pondered replies (app.services.ponder) are charged to the buckets of the
+move that queued them, when they finish, whether they are used or not.
+
+The buckets live in an SQLite file on /dev/shm (RVC_QUOTA_DB), so uvicorn
+workers and the affinity dispatcher's workers see the same numbers, and a
+reboot forgets them. The request path never touches SQLite: charges add up
+in memory and admission is decided from the levels read at the last flush,
+which the scheduler runs every FLUSH_INTERVAL seconds in its executor. A
+worker sees the other workers' charges that much later. Limiter errors fail
+open. RVC_QUOTA=0 disables it.
+'''
+
+import ipaddress
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+ENABLED = os.environ.get("RVC_QUOTA", "1").lower() not in ("0", "false", "no", "off")
+
+_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+QUOTA_DB = os.environ.get("RVC_QUOTA_DB", os.path.join(_SHM_DIR, "reverc-quota.sqlite3"))
+
+# (burst CPU seconds, refill CPU seconds per second) per bucket kind
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "client": (float(os.environ.get("RVC_QUOTA_CLIENT_BURST", "60")),
+               float(os.environ.get("RVC_QUOTA_CLIENT_RATE", "0.5"))),
+    "bot": (float(os.environ.get("RVC_QUOTA_BOT_BURST", "30")),
+            float(os.environ.get("RVC_QUOTA_BOT_RATE", "0.25"))),
+}
+
+# Charged per upload on top of the gcc time
+UPLOAD_COST = float(os.environ.get("RVC_QUOTA_UPLOAD_COST", "2"))
+
+# Seconds between writes of the pending charges (scheduler job)
+FLUSH_INTERVAL = float(os.environ.get("RVC_QUOTA_FLUSH_INTERVAL", "1"))
+
+# Forget buckets idle this long, they are full again anyway
+IDLE_TTL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key     TEXT PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"CPU quota exceeded for {key}, retry in {math.ceil(retry_after)}s")
+        self.key = key
+        self.retry_after = retry_after
+
+    @property
+    def kind(self) -> str:
+        return self.key.split(":", 1)[0]
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+class TokenBuckets:
+    def __init__(self, path: str = QUOTA_DB):
+        self.path = path
+        self._local = threading.local()
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+        self._pending: Dict[str, float] = {}                # charges not yet written, per key
+        self._rows: Dict[str, Tuple[float, float]] = {}     # (tokens, updated) as of the last flush
+        self._seen: Dict[str, float] = {}                   # keys to read back on flush, last use
+
+    def _conn(self) -> sqlite3.Connection:
+        """ One connection per thread: flushes run in the scheduler's executor """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def after_fork(self):
+        """ SQLite connections must not cross a fork: the child opens its own, and owns no charges """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._rows = {}
+        self._seen = {}
+
+    @staticmethod
+    def _refill(key: str, row: Optional[tuple], now: float) -> float:
+        burst, rate = LIMITS[key.split(":", 1)[0]]
+        if row is None:
+            return burst
+        tokens, updated = row
+        return min(burst, tokens + (now - updated) * rate)
+
+    def flush(self) -> int:
+        """
+        Write this worker's pending charges in one transaction and read back the
+        buckets it uses, charged by the other workers too. Runs from the scheduler;
+        returns the number of buckets charged.
+        """
+        if not ENABLED:
+            return 0
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for key, last_used in list(self._seen.items()):
+                if now - last_used > IDLE_TTL:
+                    del self._seen[key]
+                    self._rows.pop(key, None)
+            keys = set(self._seen) | set(pending)
+        if not keys:
+            return 0
+
+        rows = {}
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                    tokens = self._refill(key, row, now) - pending.get(key, 0.0)
+                    if key in pending:
+                        conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                                     (key, tokens, now))
+                    rows[key] = (tokens, now)
+                if now - self._last_prune > IDLE_TTL:
+                    self._last_prune = now
+                    conn.execute("DELETE FROM buckets WHERE updated < ?", (now - IDLE_TTL,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            print(f"WARNING: quota store unavailable, charges kept for the next flush: {e}")
+            with self._lock:
+                for key, seconds in pending.items():
+                    self._pending[key] = self._pending.get(key, 0.0) + seconds
+            return 0
+
+        with self._lock:
+            self._rows.update(rows)
+        return len(pending)
+
+    def level(self, key: str) -> float:
+        """ Tokens left in a bucket now, as of the last flush minus this worker's pending charges """
+        now = time.time()
+        with self._lock:
+            self._seen[key] = now
+            return self._refill(key, self._rows.get(key), now) - self._pending.get(key, 0.0)
+
+    def admit(self, *keys: str, cost: float = 0.0):
+        """
+        Raise QuotaExceeded when one of the buckets is in debt, else charge the upfront `cost`.
+        Answered from memory, no SQLite access: cheap enough for the event loop.
+        """
+        if not ENABLED:
+            return
+        keys = [k for k in keys if k]
+        if not keys:
+            return
+
+        for key in keys:
+            tokens = self.level(key)
+            if tokens <= 0:
+                raise QuotaExceeded(key, -tokens / LIMITS[key.split(":", 1)[0]][1])
+        if cost:
+            self.charge(*keys, seconds=cost)
+
+    def charge(self, *keys: str, seconds: float):
+        """ Take the CPU seconds a request used from its buckets; they may go into debt. Written on flush """
+        if not ENABLED or seconds <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                if key:
+                    self._pending[key] = self._pending.get(key, 0.0) + seconds
+                    self._seen[key] = now
+
+    def headroom(self, *keys: str) -> float:
+        """ Fewest tokens left over the buckets; inf when quotas are off """
+        keys = [k for k in keys if k]
+        if not ENABLED or not keys:
+            return math.inf
+        return min(self.level(key) for key in keys)
+
+
+def _trusted_network(entry: str):
+    try:
+        return ipaddress.ip_network(entry, strict=False)
+    except ValueError:
+        print(f"WARNING: ignoring invalid RVC_TRUSTED_PROXIES entry {entry!r}")
+        return None
+
+
+# Proxies whose X-Forwarded-For is believed: addresses or CIDR ranges, comma separated, or "*".
+# Defaults to uvicorn's --forwarded-allow-ips (FORWARDED_ALLOW_IPS). On Cloud Run the peer is
+# the platform's front end, e.g. RVC_TRUSTED_PROXIES=169.254.0.0/16
+TRUSTED_PROXIES = os.environ.get("RVC_TRUSTED_PROXIES", os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1,::1"))
+_TRUST_ALL = TRUSTED_PROXIES.strip() == "*"
+_TRUSTED_NETWORKS = [net for net in (
+    _trusted_network(entry.strip()) for entry in TRUSTED_PROXIES.split(",") if entry.strip() and entry.strip() != "*"
+) if net is not None]
+
+
+def is_trusted_proxy(host: Optional[str]) -> bool:
+    if _TRUST_ALL:
+        return True
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in net for net in _TRUSTED_NETWORKS)
+
+
+def client_key(request) -> str:
+    """
+    client:<ip>. X-Forwarded-For is only believed from the affinity dispatcher (unix
+    socket, no peer address) or a trusted proxy. Its hops are walked from the right
+    and the first one that is not a trusted proxy is the client; with "*" every hop
+    is trusted and the left-most one is used, as uvicorn does.
+    """
+    peer = request.client.host if request.client else None
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded and (not peer or is_trusted_proxy(peer)):
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not is_trusted_proxy(hop):
+                return f"client:{hop}"
+        if hops:
+            return f"client:{hops[0]}"
+    return f"client:{peer or 'unknown'}"
+
+
+def bot_key(code_id: str) -> str:
+    return f"bot:{code_id}"
+
+
+# Process-wide handle, the buckets themselves are shared through QUOTA_DB
+quota = TokenBuckets()
+os.register_at_fork(after_in_child=quota.after_fork)
@@ -0,0 +1,101 @@
+'''
+Reversi rules in plain Python, on the same layout the C bots receive:
+board is list[list[str]] of 'B', 'W' and 'U' (empty), size n is even, 4..26.
+'''
+
+import random
+from typing import List, Optional, Tuple
+
+Board = List[List[str]]
+
+DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+
+def opponent(turn: str) -> str:
+    return 'W' if turn == 'B' else 'B'
+
+
+def initial_board(size: int) -> Board:
+    """ Standard opening: W on the main diagonal of the centre square, B on the other """
+    board = [['U'] * size for _ in range(size)]
+    mid = size // 2
+    board[mid - 1][mid - 1] = 'W'
+    board[mid - 1][mid] = 'B'
+    board[mid][mid - 1] = 'B'
+    board[mid][mid] = 'W'
+    return board
+
+
+def flips(board: Board, size: int, turn: str, row: int, col: int) -> List[Tuple[int, int]]:
+    """ Discs flipped by `turn` playing (row, col); empty if the move is illegal """
+    if not (0 <= row < size and 0 <= col < size) or board[row][col] != 'U':
+        return []
+    other = opponent(turn)
+    flipped = []
+    for dr, dc in DIRECTIONS:
+        r, c = row + dr, col + dc
+        line = []
+        while 0 <= r < size and 0 <= c < size and board[r][c] == other:
+            line.append((r, c))
+            r += dr
+            c += dc
+        if line and 0 <= r < size and 0 <= c < size and board[r][c] == turn:
+            flipped.extend(line)
+    return flipped
+
+
+def is_legal(board: Board, size: int, turn: str, row: int, col: int) -> bool:
+    return bool(flips(board, size, turn, row, col))
+
+
+def legal_moves(board: Board, size: int, turn: str) -> List[Tuple[int, int]]:
+    """ All legal moves in row-major order, the order the APS105 lab lists them """
+    return [
+        (r, c)
+        for r in range(size)
+        for c in range(size)
+        if board[r][c] == 'U' and flips(board, size, turn, r, c)
+    ]
+
+
+def apply_move(board: Board, size: int, turn: str, row: int, col: int) -> Board:
+    """ Return a new board with the move played; raises ValueError if it is illegal """
+    flipped = flips(board, size, turn, row, col)
+    if not flipped:
+        raise ValueError(f"Illegal move ({row}, {col}) for {turn}")
+    new_board = [line[:] for line in board]
+    new_board[row][col] = turn
+    for r, c in flipped:
+        new_board[r][c] = turn
+    return new_board
+
+
+def count(board: Board, size: int) -> Tuple[int, int]:
+    """ (black discs, white discs) """
+    black = sum(row[:size].count('B') for row in board[:size])
+    white = sum(row[:size].count('W') for row in board[:size])
+    return black, white
+
+
+def next_turn(board: Board, size: int, turn: str) -> Optional[str]:
+    """ Who moves after `turn` has played: the opponent, `turn` again if the opponent must pass, or None when the game is over """
+    other = opponent(turn)
+    if legal_moves(board, size, other):
+        return other
+    if legal_moves(board, size, turn):
+        return turn
+    return None
+
+
+def random_playout(size: int, plies: int, rng: random.Random) -> Tuple[Board, Optional[str]]:
+    """ Play up to `plies` random legal moves from the opening; returns (board, side to move) """
+    board = initial_board(size)
+    turn: Optional[str] = 'B'
+    for _ in range(plies):
+        moves = legal_moves(board, size, turn)
+        row, col = rng.choice(moves)
+        board = apply_move(board, size, turn, row, col)
+        turn = next_turn(board, size, turn)
+        if turn is None:
+            break
+    return board, turn
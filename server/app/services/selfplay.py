@@ -0,0 +1,362 @@
+'''
+Self-play datasets: many games between archive bots, random and engine
+players, written as chunked NumPy arrays for offline benchmarks and tuning.
+From the server directory:
+
+    python -m app.services.selfplay --players archive/2025/greedy,engine,random \
+        --games 100000 --size 8 --processes 8 --output data/selfplay/run1
+
+Players are archive/<group>/<name> (the archived .so, loaded in process as
+CMoveCaller does for /api/move), random, or engine (app.ai.engine's one-ply
+evaluation). Every ordered pair of players meets in turn, so each pairing
+plays both colours; a single player plays itself. A game opens with
+--opening-plies random moves so that deterministic bots do not replay the
+same game, then the players alternate, passes included. A bot that times
+out or answers an illegal move loses the game.
+
+Games are grouped in chunks of --chunk-games, each played by one process.
+Every game is seeded from --seed and its number only, so the dataset is the
+same whatever --processes is (elapsed times aside). A finished chunk is
+written atomically and rerunning the same command skips the chunks already
+on disk: an interrupted run resumes where it stopped. manifest.json holds
+the settings, a rerun with different ones is refused.
+
+One row per labelled position (the opening plies are not labelled), in
+chunk-000000.npz, or with --format npy in a chunk-000000/ directory of .npy
+files that np.load(..., mmap_mode="r") maps without reading them:
+
+    board           int8  [N, size, size]   1 black, -1 white, 0 empty
+    turn            int8  [N]               side to move, 1 black, -1 white
+    move            int16 [N, 2]            row, col played
+    player          int16 [N]               mover, index into the manifest's players
+    elapsed_us      int64 [N]               time the mover took
+    timeout         bool  [N]
+    result          int8  [N]               final outcome for the side to move: 1 win, -1 loss, 0 draw
+    game            int64 [N]               game number
+    ply             int16 [N]               plies played before the position
+
+and one row per game: game_number, game_black, game_white, game_outcome
+(1 black won, -1 white won, 0 draw), game_disc_diff (black - white),
+game_end (0 normal, 1 illegal move, 2 timeout) and game_plies.
+
+numpy is needed here only, not by the server: install it where datasets
+are generated.
+'''
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.ai.engine import rank_moves
+from app.routers.schemas import Move
+from app.services import reversi
+from app.services.call_c import CMoveCaller, MAKE_MOVE_TIME_LIMIT
+
+MANIFEST = "manifest.json"
+FORMATS = ("npz", "npy")
+
+END_NORMAL, END_ILLEGAL, END_TIMEOUT = 0, 1, 2
+
+
+class SelfPlayError(Exception):
+    """Raised when a self-play run cannot start or resume"""
+    pass
+
+
+def require_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SelfPlayError("numpy is required to write self-play datasets, "
+                            "install it with `pip install numpy` (the server itself does not need it)")
+    return numpy
+
+
+# ==================== Players ====================
+
+class ArchivePlayer:
+    def __init__(self, group: str, name: str, time_limit: int):
+        self.data_path = f"archives/{group}/{name}"
+        self.time_limit = time_limit
+        so_path = f"data/shared_libs/{self.data_path}.so"
+        if not os.path.exists(so_path):
+            raise SelfPlayError(f"archive bot not found: {so_path} (run from the server directory)")
+
+    def move(self, board: reversi.Board, size: int, turn: str, rng: random.Random) -> Tuple[int, int, int, bool]:
+        result = CMoveCaller.call_make_move_105(board=board, size=size, turn=turn,
+                                                data_path=self.data_path, time_limit=self.time_limit)
+        return result["row"], result["col"], result["elapsed"], result["timeout"]
+
+
+class RandomPlayer:
+    def move(self, board: reversi.Board, size: int, turn: str, rng: random.Random) -> Tuple[int, int, int, bool]:
+        start = time.perf_counter_ns()
+        row, col = rng.choice(reversi.legal_moves(board, size, turn))
+        return row, col, (time.perf_counter_ns() - start) // 1000, False
+
+
+class EnginePlayer:
+    def move(self, board: reversi.Board, size: int, turn: str, rng: random.Random) -> Tuple[int, int, int, bool]:
+        start = time.perf_counter_ns()
+        moves = [Move(row=r, col=c) for r, c in reversi.legal_moves(board, size, turn)]
+        best = rank_moves(board, size, turn, moves)[0]
+        return best["row"], best["col"], (time.perf_counter_ns() - start) // 1000, False
+
+
+def make_player(spec: str, time_limit: int = MAKE_MOVE_TIME_LIMIT):
+    """ archive/<group>/<name>, random or engine """
+    kind, _, rest = spec.partition("/")
+    if kind == "archive":
+        group, _, name = rest.partition("/")
+        if not group or not name or "/" in name or ".." in (group, name):
+            raise SelfPlayError(f"bad archive player {spec!r}, expected archive/<group>/<name>")
+        return ArchivePlayer(group, name, time_limit)
+    if spec == "random":
+        return RandomPlayer()
+    if spec == "engine":
+        return EnginePlayer()
+    raise SelfPlayError(f"unknown player {spec!r}, expected archive/<group>/<name>, random or engine")
+
+
+def pairings(count: int) -> List[Tuple[int, int]]:
+    """ (black, white) player indexes, every ordered pair once """
+    pairs = [(a, b) for a in range(count) for b in range(count) if a != b]
+    return pairs or [(0, 0)]
+
+
+# ==================== Games ====================
+
+def game_rng(seed: int, game_number: int) -> random.Random:
+    return random.Random(f"{seed}:{game_number}")
+
+
+def play_game(players: list, black: int, white: int, size: int, opening_plies: int,
+              rng: random.Random) -> dict:
+    """ One game; positions are (board, turn, row, col, player, elapsed_us, timeout, ply) """
+    board = reversi.initial_board(size)
+    turn: Optional[str] = 'B'
+    ply = 0
+    for _ in range(opening_plies):
+        row, col = rng.choice(reversi.legal_moves(board, size, turn))
+        board = reversi.apply_move(board, size, turn, row, col)
+        turn = reversi.next_turn(board, size, turn)
+        ply += 1
+        if turn is None:
+            break
+
+    positions = []
+    end, loser = END_NORMAL, None
+    while turn is not None:
+        mover = black if turn == 'B' else white
+        row, col, elapsed, timeout = players[mover].move(board, size, turn, rng)
+        positions.append((board, turn, row, col, mover, elapsed, timeout, ply))
+        if timeout or not reversi.is_legal(board, size, turn, row, col):
+            end, loser = (END_TIMEOUT if timeout else END_ILLEGAL), turn
+            break
+        board = reversi.apply_move(board, size, turn, row, col)
+        turn = reversi.next_turn(board, size, turn)
+        ply += 1
+
+    discs_black, discs_white = reversi.count(board, size)
+    if loser is not None:
+        outcome = -1 if loser == 'B' else 1
+    else:
+        outcome = (discs_black > discs_white) - (discs_black < discs_white)
+    return {
+        "black": black,
+        "white": white,
+        "outcome": outcome,
+        "disc_diff": discs_black - discs_white,
+        "end": end,
+        "plies": ply,
+        "positions": positions,
+    }
+
+
+def chunk_arrays(np, games: List[Tuple[int, dict]], size: int) -> Dict[str, "np.ndarray"]:
+    """ Column arrays of a chunk from [(game number, game)] """
+    rows = [(number, game, p) for number, game in games for p in game["positions"]]
+    cells = np.zeros(256, dtype=np.int8)
+    cells[ord('B')], cells[ord('W')] = 1, -1
+    raw = b"".join("".join(line[:size]).encode() for _, _, p in rows for line in p[0][:size])
+    turn = np.array([1 if p[1] == 'B' else -1 for _, _, p in rows], dtype=np.int8)
+    outcome = np.array([game["outcome"] for _, game, _ in rows], dtype=np.int8)
+    return {
+        "board": cells[np.frombuffer(raw, dtype=np.uint8)].reshape(len(rows), size, size),
+        "turn": turn,
+        "move": np.array([(p[2], p[3]) for _, _, p in rows], dtype=np.int16).reshape(len(rows), 2),
+        "player": np.array([p[4] for _, _, p in rows], dtype=np.int16),
+        "elapsed_us": np.array([p[5] for _, _, p in rows], dtype=np.int64),
+        "timeout": np.array([p[6] for _, _, p in rows], dtype=bool),
+        "result": outcome * turn,
+        "game": np.array([number for number, _, _ in rows], dtype=np.int64),
+        "ply": np.array([p[7] for _, _, p in rows], dtype=np.int16),
+        "game_number": np.array([number for number, _ in games], dtype=np.int64),
+        "game_black": np.array([game["black"] for _, game in games], dtype=np.int16),
+        "game_white": np.array([game["white"] for _, game in games], dtype=np.int16),
+        "game_outcome": np.array([game["outcome"] for _, game in games], dtype=np.int8),
+        "game_disc_diff": np.array([game["disc_diff"] for _, game in games], dtype=np.int16),
+        "game_end": np.array([game["end"] for _, game in games], dtype=np.int8),
+        "game_plies": np.array([game["plies"] for _, game in games], dtype=np.int16),
+    }
+
+
+# ==================== Chunks on disk ====================
+
+def chunk_path(output: str, index: int, fmt: str) -> str:
+    return os.path.join(output, f"chunk-{index:06d}" + (".npz" if fmt == "npz" else ""))
+
+
+def write_chunk(np, path: str, arrays: dict, fmt: str, compress: bool = True):
+    """ Write to a temporary name, then rename: a chunk on disk is always complete """
+    tmp = f"{path}.tmp-{os.getpid()}"
+    if fmt == "npz":
+        with open(tmp, "wb") as f:
+            (np.savez_compressed if compress else np.savez)(f, **arrays)
+    else:
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+    os.replace(tmp, path)
+
+
+def prepare_output(output: str, config: dict):
+    """ Create the run directory, or check that it holds the same run """
+    os.makedirs(output, exist_ok=True)
+    manifest = os.path.join(output, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            existing = json.load(f)
+        changed = sorted(k for k in set(config) | set(existing) if config.get(k) != existing.get(k))
+        if changed:
+            raise SelfPlayError(f"{output} holds a run with other settings ({', '.join(changed)}), "
+                                f"use a new --output directory")
+        return
+    with open(manifest + ".tmp", "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(manifest + ".tmp", manifest)
+
+
+def iter_chunks(output: str) -> Iterator[Dict[str, "np.ndarray"]]:
+    """ The chunks of a run in order; npy chunks are memory-mapped """
+    np = require_numpy()
+    with open(os.path.join(output, MANIFEST)) as f:
+        config = json.load(f)
+    for index in range(config["chunks"]):
+        path = chunk_path(output, index, config["format"])
+        if not os.path.exists(path):
+            continue
+        if config["format"] == "npz":
+            with np.load(path) as data:
+                yield {name: data[name] for name in data.files}
+        else:
+            yield {fname[:-4]: np.load(os.path.join(path, fname), mmap_mode="r")
+                   for fname in sorted(os.listdir(path)) if fname.endswith(".npy")}
+
+
+def play_chunk(config: dict, index: int) -> dict:
+    """ Play and write one chunk; runs in a pool process, on its main thread (SIGALRM limit) """
+    np = require_numpy()
+    start = time.perf_counter()
+    players = [make_player(spec, config["time_limit"]) for spec in config["players"]]
+    pairs = pairings(len(players))
+    first = index * config["chunk_games"]
+    last = min(first + config["chunk_games"], config["games"])
+
+    games = []
+    for number in range(first, last):
+        black, white = pairs[number % len(pairs)]
+        games.append((number, play_game(players, black, white, config["size"], config["opening_plies"],
+                                        game_rng(config["seed"], number))))
+    arrays = chunk_arrays(np, games, config["size"])
+    write_chunk(np, chunk_path(config["output"], index, config["format"]), arrays,
+                config["format"], config["compress"])
+    return {
+        "chunk": index,
+        "games": len(games),
+        "positions": int(arrays["board"].shape[0]),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate self-play games as chunked NumPy arrays")
+    parser.add_argument("--players", required=True, help="comma separated: archive/<group>/<name>, random, engine")
+    parser.add_argument("--output", required=True, help="run directory, rerun to resume")
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=8)
+    parser.add_argument("--chunk-games", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=105)
+    parser.add_argument("--opening-plies", type=int, default=4)
+    parser.add_argument("--time-limit", type=int, default=MAKE_MOVE_TIME_LIMIT, help="seconds per bot move")
+    parser.add_argument("--format", choices=FORMATS, default="npz")
+    parser.add_argument("--no-compress", action="store_true", help="plain .npz, larger but faster to write")
+    args = parser.parse_args()
+
+    config = {
+        "players": [spec.strip() for spec in args.players.split(",") if spec.strip()],
+        "games": args.games,
+        "size": args.size,
+        "chunk_games": args.chunk_games,
+        "chunks": math.ceil(args.games / args.chunk_games),
+        "seed": args.seed,
+        "opening_plies": args.opening_plies,
+        "time_limit": args.time_limit,
+        "format": args.format,
+        "compress": not args.no_compress,
+    }
+    try:
+        require_numpy()
+        if not 4 <= args.size <= 26 or args.size % 2:
+            raise SelfPlayError(f"unsupported board size {args.size}")
+        if args.games < 1 or args.chunk_games < 1:
+            raise SelfPlayError("--games and --chunk-games must be positive")
+        for spec in config["players"]:
+            make_player(spec, args.time_limit)
+        if not config["players"]:
+            raise SelfPlayError("no players")
+        prepare_output(args.output, config)
+    except SelfPlayError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    config["output"] = args.output
+    todo = [i for i in range(config["chunks"]) if not os.path.exists(chunk_path(args.output, i, args.format))]
+    print(f"Selfplay: {len(todo)} of {config['chunks']} chunks to play, "
+          f"{config['chunks'] - len(todo)} already in {args.output}", flush=True)
+
+    start = time.perf_counter()
+    failed = positions = 0
+    # spawn: a clean interpreter per process, the bots run on its main thread
+    with ProcessPoolExecutor(max_workers=max(1, min(args.processes, len(todo) or 1)),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(play_chunk, config, index): index for index in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                summary = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"WARNING: chunk {futures[future]} failed: {e}", flush=True)
+                continue
+            positions += summary["positions"]
+            print(f"Selfplay: [{done}/{len(todo)}] chunk {summary['chunk']}: {summary['games']} games, "
+                  f"{summary['positions']} positions in {summary['seconds']:.1f}s", flush=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"Selfplay: {positions} positions in {elapsed:.1f}s "
+          f"({positions / elapsed if elapsed else 0:.0f}/s), {failed} chunks failed", flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
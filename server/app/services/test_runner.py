@@ -1,34 +1,225 @@
 # server/app/services/test_runner.py
+'''
+Validation suite for uploaded bots, run in a sandboxed subprocess by the upload
+pipeline: python -m app.services.test_runner <code_id> <file_type> [--baseline]
+
+The bot plays a fixed corpus of positions (several board sizes up to 26, both
+colours, pass-like positions) within one total time budget. The JSON report on
+stdout carries the legality rate, per-move latency and the first failure, plus
+a performance profile: wall and CPU time distribution, per board size, peak RSS
+and how close the slowest move came to MAKE_MOVE_TIME_LIMIT.
+
+A move fails when it is out of bounds, illegal or over the time limit. The
+upload is rejected when the 8x8 opening fails (what the single-move test used
+to check) or when the legality rate of the whole corpus is below
+MIN_LEGALITY_RATE (RVC_MIN_LEGALITY_RATE, default 0.9: one failed position in
+17 passes, two do not). Accepted bots keep their first failure in the report.
+
+--baseline runs the -O0 build of the same upload (<name>.O0.so) and only
+reports its timings: the upload pipeline compares its per-move wall times with
+the real build's to measure what the compile profile buys (compile_profile).
+'''
+
 import sys
 import os
 import json
 import ctypes
-from typing import List, Tuple
+import random
+import resource
+import time
+from typing import Dict, List, Optional, Tuple
 
-def build_board() -> Tuple[ctypes.Array, List[Tuple[int, int]]]:
+from app.services import reversi
+from app.services.call_c import MAKE_MOVE_TIME_LIMIT
+
+# Wall-clock budget for the whole corpus, in seconds; the caller adds slack for startup
+TEST_TIME_BUDGET = 10
+CORPUS_SEED = 105
+CORPUS_SIZES = (6, 8, 12, 16, 26)
+# Share of the corpus a bot has to answer correctly
+MIN_LEGALITY_RATE = float(os.environ.get("RVC_MIN_LEGALITY_RATE", "0.9"))
+
+def build_board(board: reversi.Board, size: int) -> ctypes.Array:
+    """ Copy a board into the fixed 26x26 char array makeMove() takes """
     ArrayType = ctypes.c_char * 26
     board_array = (ArrayType * 26)()
     for i in range(26):
         for j in range(26):
-            board_array[i][j] = b'U'
-    board_array[3][3] = b'W'
-    board_array[3][4] = b'B'
-    board_array[4][3] = b'B'
-    board_array[4][4] = b'W'
-    valid_moves = [(2, 3), (3, 2), (4, 5), (5, 4)]
-    return board_array, valid_moves
+            board_array[i][j] = board[i][j].encode() if i < size and j < size else b'U'
+    return board_array
+
+def _find_pass_position(rng: random.Random, size: int) -> Optional[Tuple[reversi.Board, str]]:
+    """ A position where the side to move just moved too, because its opponent had to pass """
+    for _ in range(200):
+        board = reversi.initial_board(size)
+        turn = 'B'
+        while turn is not None:
+            row, col = rng.choice(reversi.legal_moves(board, size, turn))
+            board = reversi.apply_move(board, size, turn, row, col)
+            following = reversi.next_turn(board, size, turn)
+            if following == turn:
+                return board, turn
+            turn = following
+    return None
+
+def build_corpus() -> List[dict]:
+    """
+    Deterministic test positions. The 8x8 opening comes first, it is the
+    position the single-move test used and still provides `return_value`.
+    """
+    rng = random.Random(CORPUS_SEED)
+    corpus = [{"label": "opening", "size": 8, "turn": 'B', "board": reversi.initial_board(8)}]
+
+    for size in CORPUS_SIZES:
+        if size != 8:
+            corpus.append({"label": "opening", "size": size, "turn": 'B', "board": reversi.initial_board(size)})
+        # Two consecutive midgame positions, so both colours are covered
+        plies = min(2 * size, 40)
+        for extra in (0, 1):
+            board, turn = reversi.random_playout(size, plies + extra, random.Random(rng.random()))
+            if turn is not None:
+                corpus.append({"label": f"ply {plies + extra}", "size": size, "turn": turn, "board": board})
+
+    for size in (6, 8):
+        found = _find_pass_position(rng, size)
+        if found:
+            board, turn = found
+            corpus.append({"label": "after pass", "size": size, "turn": turn, "board": board})
+    return corpus
+
+def _distribution(samples: List[int]) -> Dict[str, int]:
+    """ Nearest-rank percentiles of a list of microsecond timings """
+    ordered = sorted(samples)
+    def rank(p: int) -> int:
+        return ordered[min(len(ordered) - 1, max(0, -(-len(ordered) * p // 100) - 1))]
+    return {
+        "mean": sum(ordered) // len(ordered),
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": ordered[-1],
+    }
+
+def build_profile(timings: List[Tuple[int, int, int]], baseline_rss_kb: int) -> Optional[dict]:
+    """ Performance profile from (board size, wall us, cpu us) per move """
+    if not timings:
+        return None
+    limit_us = MAKE_MOVE_TIME_LIMIT * 1_000_000
+    wall = [t[1] for t in timings]
+    by_size = []
+    for size in sorted({t[0] for t in timings}):
+        sized = [t for t in timings if t[0] == size]
+        by_size.append({
+            "size": size,
+            "moves": len(sized),
+            "wall_p50_us": _distribution([t[1] for t in sized])["p50"],
+            "wall_max_us": max(t[1] for t in sized),
+            "cpu_max_us": max(t[2] for t in sized),
+        })
+    # ru_maxrss is in KB on Linux
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "moves": len(timings),
+        "wall_us": _distribution(wall),
+        "cpu_us": _distribution([t[2] for t in timings]),
+        "by_size": by_size,
+        "peak_rss_kb": peak_rss_kb,
+        "bot_rss_kb": max(0, peak_rss_kb - baseline_rss_kb),
+        "time_limit_us": limit_us,
+        "limit_ratio": round(max(wall) / limit_us, 4),
+    }
+
+def _describe(position: dict) -> str:
+    return f"{position['size']}x{position['size']} {position['label']}, {position['turn']} to move"
+
+def run_suite(make_move, budget: float = TEST_TIME_BUDGET, baseline_rss_kb: int = 0) -> dict:
+    """
+    Run the bot over the corpus until done or out of budget.
+    baseline_rss_kb is the peak RSS before the library was loaded.
+    """
+    corpus = build_corpus()
+    latencies = []
+    timings = []
+    legal = 0
+    first_failure = None
+    return_value = None
+    started = time.perf_counter()
+
+    for index, position in enumerate(corpus):
+        if time.perf_counter() - started > budget:
+            break
+        size, turn, board = position["size"], position["turn"], position["board"]
+        row = ctypes.c_int(-1)
+        col = ctypes.c_int(-1)
+
+        board_array = build_board(board, size)
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        result = make_move(board_array, size, turn.encode(), ctypes.byref(row), ctypes.byref(col))
+        cpu_us = int((time.thread_time() - cpu_start) * 1_000_000)
+        elapsed_us = int((time.perf_counter() - start) * 1_000_000)
+        latencies.append(elapsed_us)
+        timings.append((size, elapsed_us, cpu_us))
+        if index == 0:
+            return_value = int(result)
+
+        move = (row.value, col.value)
+        failure = None
+        if not (0 <= move[0] < size and 0 <= move[1] < size):
+            failure = f"Move out of bounds: {move}"
+        elif not reversi.is_legal(board, size, turn, *move):
+            failure = f"Illegal move: {move}. Legal moves are: {reversi.legal_moves(board, size, turn)}"
+        elif elapsed_us > MAKE_MOVE_TIME_LIMIT * 1_000_000:
+            failure = f"Move took {elapsed_us / 1_000_000:.2f}s, over the {MAKE_MOVE_TIME_LIMIT}s limit"
+
+        if failure is None:
+            legal += 1
+        elif first_failure is None:
+            first_failure = {"position": index, "description": _describe(position), "move": list(move), "reason": failure}
+
+    played = len(latencies)
+    return {
+        "return_value": return_value,
+        "validation": {
+            "positions": len(corpus),
+            "played": played,
+            "legal": legal,
+            "legality_rate": round(legal / played, 4) if played else 0.0,
+            "avg_move_us": sum(latencies) // played if played else None,
+            "max_move_us": max(latencies) if latencies else None,
+            "budget_exhausted": played < len(corpus),
+            "first_failure": first_failure,
+            "min_legality_rate": MIN_LEGALITY_RATE,
+        },
+        "profile": build_profile(timings, baseline_rss_kb),
+        "move_wall_us": latencies,
+    }
+
+def rejection(validation: dict) -> Optional[str]:
+    """ Why the report fails the upload, None when the bot passes """
+    failure = validation["first_failure"]
+    where = f"(position {failure['position']}: {failure['description']})" if failure else ""
+    if failure and failure["position"] == 0:
+        return f"{failure['reason']} {where}"
+    if validation["legality_rate"] < MIN_LEGALITY_RATE:
+        message = (f"Only {validation['legal']} of {validation['played']} test moves were valid "
+                   f"({validation['legality_rate']:.0%}), at least {MIN_LEGALITY_RATE:.0%} are required.")
+        return f"{message} First failure: {failure['reason']} {where}" if failure else message
+    return None
 
 def main():
     if len(sys.argv) < 3:
-        print(json.dumps({"error": "Missing args: code_id file_type"}))
+        print(json.dumps({"error": "Missing args: code_id file_type [--baseline]"}))
         sys.exit(1)
     code_id, file_type = sys.argv[1], sys.argv[2]
-    so_path = f"data/shared_libs/{file_type}s/{file_type}_{code_id}.so"
+    baseline = "--baseline" in sys.argv[3:]
+    so_path = f"data/shared_libs/{file_type}s/{file_type}_{code_id}{'.O0' if baseline else ''}.so"
 
     if not os.path.exists(so_path):
         print(json.dumps({"error": f"Shared library not found: {so_path}"}))
         sys.exit(1)
 
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
     try:
         lib = ctypes.CDLL(so_path)
     except OSError as e:
@@ -48,21 +239,23 @@ def main():
     ]
     make_move.restype = ctypes.c_int
 
-    board, _ = build_board()
-    row = ctypes.c_int()
-    col = ctypes.c_int()
-
     try:
-        result = make_move(board, 8, b'B', ctypes.byref(row), ctypes.byref(col))
-        move = (row.value, col.value)
-        if not (0 <= move[0] < 8 and 0 <= move[1] < 8):
-            print(json.dumps({"error": f"Move out of bounds: {move}", "return_value": int(result)}))
-            sys.exit(1)
-        print(json.dumps({"return_value": int(result)}))
-        sys.exit(0)
+        report = run_suite(make_move, baseline_rss_kb=baseline_rss_kb)
     except Exception as e:
         print(json.dumps({"error": f"Runtime error during makeMove execution: {str(e)}"}))
         sys.exit(1)
 
+    if baseline:
+        # Timings only, the real build was validated already
+        print(json.dumps({"move_wall_us": report["move_wall_us"]}))
+        sys.exit(0)
+    error = rejection(report["validation"])
+    if error:
+        report["error"] = error
+        print(json.dumps(report))
+        sys.exit(1)
+    print(json.dumps(report))
+    sys.exit(0)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,6 +1,8 @@
 import os
 import time
 
+from app.services.compile_profile import UPLOAD_PROFILE
+
 def cleanup_ttl():
     print(">>> running cleanup_ttl at", time.ctime())
     """
@@ -10,7 +12,8 @@ def cleanup_ttl():
       - data/c_src/candidates       → 1 hour
       - data/shared_libs/candidates → 1 hour
 
-    Skip .gitkeep so that empty dirs remain.
+    Skip .gitkeep so that empty dirs remain. The prebuilt toolkit is kept while its
+    digest is current; objects built from an older rvc_tools.c or other flags are pruned.
     """
     base = os.getcwd()
     now  = time.time()
@@ -30,8 +33,8 @@ def cleanup_ttl():
             if not os.path.isdir(path):
                 continue
             for fname in os.listdir(path):
-                # always skip these files
-                if fname in ignore_files:
+                # always skip these files, and the prebuilt toolkit (pruned below)
+                if fname in ignore_files or fname.startswith(("rvc_tools", "rvc.h")):
                     continue
                 fpath = os.path.join(path, fname)
                 if not os.path.isfile(fpath):
@@ -42,3 +45,6 @@ def cleanup_ttl():
                         os.remove(fpath)
                     except OSError:
                         pass
+
+    for path in UPLOAD_PROFILE.prune_toolkit():
+        print(f"cleanup_ttl: removed stale toolkit artifact {path}")
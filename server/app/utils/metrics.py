@@ -0,0 +1,300 @@
+'''
+In-process metrics with Prometheus text exposition on /metrics.
+
+Counters and histograms are plain dicts behind a lock; nothing is sent
+anywhere, a scraper pulls the text. Set RVC_METRICS=0 to disable: every
+inc/observe/timer then returns after a single flag check.
+
+Label values must come from small fixed sets (stage names, route templates,
+aiId). Per-bot numbers go through TopN, which only exposes the busiest bots
+and folds the rest into bot="other".
+'''
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+ENABLED = os.environ.get("RVC_METRICS", "1").lower() not in ("0", "false", "no", "off")
+
+# Seconds; from sub-millisecond native calls to the 30s compile timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    """ Context manager observing the elapsed seconds into a histogram """
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """ with HISTOGRAM.time(stage="compile"): ... """
+        if not ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class TopN(_Metric):
+    """
+    Per-bot call count, total seconds and timeouts. Only the `limit` busiest
+    bots are exposed with their own label, everything else is summed into
+    bot="other". Tracked keys are pruned to a bounded working set.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, limit: int = 20, max_tracked: int = 1000):
+        super().__init__(name, help, ("bot",))
+        self.limit = limit
+        self.max_tracked = max_tracked
+        self._values: Dict[str, List[float]] = {}   # bot -> [calls, seconds, timeouts]
+        self._other = [0, 0.0, 0]                   # pruned bots
+
+    def observe(self, bot: str, seconds: float, timeout: bool = False):
+        if not ENABLED:
+            return
+        with self._lock:
+            entry = self._values.get(bot)
+            if entry is None:
+                if len(self._values) >= self.max_tracked:
+                    self._prune()
+                entry = self._values[bot] = [0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += timeout
+
+    def _prune(self):
+        """ Fold the least used half into "other", keeping totals exact """
+        ranked = sorted(self._values.items(), key=lambda kv: kv[1][0])
+        for bot, entry in ranked[:len(ranked) // 2]:
+            for i in range(3):
+                self._other[i] += entry[i]
+            del self._values[bot]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            ranked = sorted(self._values.items(), key=lambda kv: kv[1][0], reverse=True)
+            other = list(self._other)
+        shown = ranked[:self.limit]
+        for _, entry in ranked[self.limit:]:
+            for i in range(3):
+                other[i] += entry[i]
+        if other[0]:
+            shown.append(("other", other))
+
+        lines = []
+        for suffix, index, help in (("calls_total", 0, "calls"),
+                                    ("seconds_total", 1, "seconds spent"),
+                                    ("timeouts_total", 2, "timeouts")):
+            name = f"{self.name}_{suffix}"
+            lines.append(f"# HELP {name} {self.help}: {help}")
+            lines.append(f"# TYPE {name} counter")
+            for bot, entry in shown:
+                value = entry[index]
+                lines.append(f'{name}{{bot="{_escape(bot)}"}} {_format_value(value)}')
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """ All metrics in the Prometheus text format """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==================== HTTP ====================
+
+HTTP_REQUESTS = Counter("reverc_http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("reverc_http_request_seconds", "HTTP request latency", ("method", "route"))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request. The route label is the matched
+    path template (/api/status/candidate/{code_id}), never the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.observe(time.perf_counter() - start, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status))
+
+
+# ==================== Hot paths ====================
+
+# stage: read | validate | write | compile | test
+UPLOAD_STAGE = Histogram("reverc_upload_stage_seconds", "Time spent per upload pipeline stage", ("stage",))
+UPLOAD_RESULTS = Counter("reverc_upload_results_total", "Processed uploads", ("file_type", "status", "stage"))
+
+# step: marshal | dlopen | native | response
+MOVE_STEP = Histogram("reverc_move_step_seconds", "Time spent per step of a native move call", ("step",))
+MOVE_CALLS = Counter("reverc_move_calls_total", "Native move calls", ("source", "outcome"))
+SO_CACHE = Counter("reverc_so_cache_total", "Loaded library cache lookups", ("result",))
+BOT_MOVES = TopN("reverc_bot_moves", "Native move calls per bot, busiest bots only")
+
+# result: scheduled | skipped | cancelled | hit | wait | miss | error
+PONDER = Counter("reverc_ponder_total", "Pondered bot replies", ("result",))
+
+# route: move | upload, bucket: client | bot
+QUOTA_REJECTS = Counter("reverc_quota_rejections_total", "Requests refused by the CPU quota", ("route", "bucket"))
+
+# step: prompt | provider | parse | repair, encoding: json | grid (prompt board encoding)
+AI_STEP = Histogram("reverc_ai_step_seconds", "Time spent per step of an AI move", ("ai", "step", "encoding"),
+                    buckets=(0.001, 0.01, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0))
+# state: the circuit breaker state entered (closed | open | half_open)
+AI_BREAKER = Counter("reverc_ai_breaker_transitions_total", "AI provider circuit breaker transitions", ("ai", "state"))
+# result: ok | repaired | failed (unparsable even after the repair) | provider_error
+AI_PARSE = Counter("reverc_ai_parse_total", "Parsing of AI move answers", ("ai", "result"))
+AI_PROMPT_TOKENS = Histogram("reverc_ai_prompt_tokens", "Estimated prompt tokens of an AI move", ("ai", "encoding"),
+                             buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000))
+AI_CALLS = Counter("reverc_ai_calls_total", "AI move requests", ("ai", "outcome"))
+
+# op: read | write
+STATS_IO = Histogram("reverc_stats_io_seconds", "Game statistics storage latency", ("op",))
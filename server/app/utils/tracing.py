@@ -0,0 +1,201 @@
+'''
+Request-scoped tracing: nested spans kept in contextvars, no dependency.
+
+Every HTTP request gets a trace id, taken from the X-Trace-Id request header
+when the client sends one (the client can reuse one id for a whole game, from
+upload to the last move) and returned in the X-Trace-Id response header.
+Finished spans are kept for the most recent traces in memory, served by
+GET /api/trace/{trace_id}, and appended as JSON lines to RVC_TRACE_FILE when
+it is set. RVC_TRACING=0 disables all of it.
+
+Spans opened in a thread pool only join the request trace when the callable
+is wrapped with bind(): run_in_executor does not copy contextvars by itself.
+'''
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+ENABLED = os.environ.get("RVC_TRACING", "1").lower() not in ("0", "false", "no", "off")
+TRACE_FILE = os.environ.get("RVC_TRACE_FILE")
+MAX_TRACES = 1000           # traces kept in memory
+MAX_SPANS_PER_TRACE = 2000  # a long game stays bounded too
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_ID_RE = re.compile(r"^[0-9a-f]{16,32}$")
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("rvc_span", default=None)
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rvc_trace_id", default=None)
+
+
+class _Store:
+    """ Finished spans of the latest traces, plus the optional JSONL exporter """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._traces: "OrderedDict[str, List[dict]]" = OrderedDict()
+        self._file = None
+
+    def add(self, record: dict):
+        with self._lock:
+            spans = self._traces.get(record["trace_id"])
+            if spans is None:
+                spans = self._traces[record["trace_id"]] = []
+                if len(self._traces) > MAX_TRACES:
+                    self._traces.popitem(last=False)
+            else:
+                self._traces.move_to_end(record["trace_id"])
+            if len(spans) < MAX_SPANS_PER_TRACE:
+                spans.append(record)
+
+            if TRACE_FILE:
+                try:
+                    if self._file is None:
+                        self._file = open(TRACE_FILE, "a", buffering=1)
+                    self._file.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    print(f"WARNING: cannot write trace file {TRACE_FILE}: {e}")
+
+    def get(self, trace_id: str) -> Optional[List[dict]]:
+        with self._lock:
+            spans = self._traces.get(trace_id)
+            return sorted(spans, key=lambda s: s["start"]) if spans is not None else None
+
+
+store = _Store()
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attrs", "start", "_perf", "_tokens")
+
+    def __init__(self, name: str, attrs: dict):
+        parent = _current.get()
+        self.name = name
+        self.trace_id = _trace_id.get() or new_trace_id()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None and parent.trace_id == self.trace_id else None
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time()
+        self._perf = time.perf_counter()
+        self._tokens = (_current.set(self), _trace_id.set(self.trace_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_us = int((time.perf_counter() - self._perf) * 1_000_000)
+        _current.reset(self._tokens[0])
+        _trace_id.reset(self._tokens[1])
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        store.add({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_us": duration_us,
+            "attrs": self.attrs,
+        })
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def span(name: str, **attrs):
+    """ with tracing.span("gcc", file_type=file_type): ... """
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+def bind(func: Callable) -> Callable:
+    """ Carry the current trace into a thread pool: run_in_executor(executor, bind(f), *args) """
+    if not ENABLED:
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the root span of every HTTP request. It also
+    records how long the request waited for one turn of the event loop
+    (loop_lag_us), which shows a loop kept busy by other requests.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        for key, value in scope.get("headers", ()):
+            if key == b"x-trace-id":
+                candidate = value.decode("latin-1").strip().lower().replace("-", "")
+                if TRACE_ID_RE.match(candidate):
+                    trace_id = candidate
+                break
+        trace_id = trace_id or new_trace_id()
+        token = _trace_id.set(trace_id)
+
+        # One trip through the event loop: how long the ready callbacks ahead of us took
+        scheduled = time.perf_counter()
+        await asyncio.sleep(0)
+        root = Span("http", {
+            "method": scope["method"],
+            "loop_lag_us": int((time.perf_counter() - scheduled) * 1_000_000),
+        })
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                root.set(status=message["status"])
+                message["headers"] = list(message.get("headers", [])) + [
+                    (TRACE_HEADER.lower().encode(), trace_id.encode())
+                ]
+            await send(message)
+
+        try:
+            with root:
+                try:
+                    await self.app(scope, receive, send_wrapper)
+                finally:
+                    route = scope.get("route")
+                    root.set(route=getattr(route, "path", None) or "unmatched")
+        finally:
+            _trace_id.reset(token)
@@ -0,0 +1,109 @@
+'''
+Import-time budget of the server, from the server directory:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --budget-ms 800 --cold-start
+
+`import app.main` runs in a fresh interpreter under `python -X importtime`
+a few times; the best cumulative time is compared with the budget and the
+slowest modules are listed. The heavy SDKs (openai, google.generativeai,
+google.cloud.storage) must not be imported at all: they are loaded on the
+first AI move or stats call. Either failure exits with status 1.
+
+--cold-start also starts uvicorn and times the first 200 from /ping, which
+is what a new Cloud Run instance makes its first request wait for.
+'''
+
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Tuple
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ("openai", "google.generativeai", "google.cloud.storage")
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_times(module: str = "app.main") -> Dict[str, Tuple[int, int]]:
+    """ {module: (self us, cumulative us)} of one fresh `import module` """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=SERVER_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            times[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return times
+
+
+def deferred_imports(times: Dict[str, Tuple[int, int]]) -> List[str]:
+    return sorted(name for name in times if any(name == d or name.startswith(d + ".") for d in DEFERRED))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cold_start(timeout: float = 30.0) -> float:
+    """ Seconds from spawning uvicorn to the first 200 from /ping """
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+                            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ping", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"uvicorn did not answer /ping within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget of app.main")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="allowed cumulative import time of app.main")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters, the best one counts")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--cold-start", action="store_true", help="also time uvicorn start to the first /ping")
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.runs)]
+    best = min(runs, key=lambda t: t["app.main"][1])
+    total_ms = best["app.main"][1] / 1000
+
+    print(f"{'module':<48}{'self ms':>10}{'cumul ms':>10}")
+    for name, (own, cumulative) in sorted(best.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"{name:<48}{own / 1000:>10.1f}{cumulative / 1000:>10.1f}")
+    print(f"\nimport app.main: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"import app.main took {total_ms:.1f} ms, budget {args.budget_ms:.0f} ms")
+    deferred = deferred_imports(best)
+    if deferred:
+        failures.append(f"imported at startup instead of first use: {', '.join(deferred[:10])}")
+
+    if args.cold_start:
+        print(f"cold start to first /ping: {cold_start() * 1000:.0f} ms")
+
+    for line in failures:
+        print(f"FAIL: {line}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+'''
+End-to-end load test of the server, from the server directory:
+
+    python -m benchmarks.load_test                      # app in-process (httpx ASGI transport)
+    python -m benchmarks.load_test --uvicorn            # spawn uvicorn in the workspace
+    python -m benchmarks.load_test --baseline old.json  # compare with an earlier run
+
+Synthetic bots (see benchmarks/workspace.py) are uploaded to a throwaway
+workspace, then each scenario drives the HTTP API concurrently:
+
+    upload_burst    concurrent candidate uploads, until each one is tested
+    status_polling  GET /api/status/... on the uploaded ids
+    game_<bot>      full games of an uploaded bot against a random player
+    timeout         moves that overrun MAKE_MOVE_TIME_LIMIT
+
+Every scenario reports throughput, latency percentiles, server CPU seconds
+and RSS. Results are saved as JSON under benchmarks/results/ so runs on two
+commits can be diffed with --baseline.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.services import reversi
+from benchmarks.workspace import SERVER_DIR, TIMEOUT_BOARD_SIZE, make_workspace, remove_workspace, bot_source
+
+RESULTS_DIR = os.path.join(SERVER_DIR, "benchmarks", "results")
+GAME_BOTS = ("instant", "scan", "search")
+TERMINAL_STATUSES = ("success", "failed")
+
+
+# ==================== Measurement ====================
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    """ Nearest-rank percentile """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(-(-len(ordered) * p // 100)) - 1))
+    return ordered[index]
+
+
+class ProcessSampler:
+    """ CPU seconds and RSS of a process tree, read from /proc (Linux only) """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def _tree(self) -> List[int]:
+        pids = [self.pid]
+        try:
+            with open(f"/proc/{self.pid}/task/{self.pid}/children") as f:
+                pids += [int(p) for p in f.read().split()]
+        except OSError:
+            pass
+        return pids
+
+    def cpu_seconds(self) -> float:
+        ticks = os.sysconf("SC_CLK_TCK")
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                # utime, stime, cutime, cstime: children's time counts once they are reaped
+                total += sum(int(x) for x in fields[11:15])
+            except OSError:
+                pass
+        return total / ticks
+
+    def rss_kb(self) -> int:
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                pass
+        return total
+
+
+class Scenario:
+    """ Latency samples and error count of one scenario """
+
+    def __init__(self, name: str, sampler: ProcessSampler):
+        self.name = name
+        self.sampler = sampler
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.extra: Dict[str, object] = {}
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.cpu_start = self.sampler.cpu_seconds()
+        self.peak_rss_kb = self.sampler.rss_kb()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.started
+        self.cpu = self.sampler.cpu_seconds() - self.cpu_start
+        self.peak_rss_kb = max(self.peak_rss_kb, self.sampler.rss_kb())
+        return False
+
+    async def timed(self, request):
+        """ Await a request, recording its latency; HTTP errors count as errors """
+        start = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors += 1
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors += 1
+        if len(self.latencies) % 50 == 0:
+            self.peak_rss_kb = max(self.peak_rss_kb, self.sampler.rss_kb())
+        return response
+
+    def result(self) -> dict:
+        ms = [x * 1000 for x in self.latencies]
+        return {
+            "requests": len(ms),
+            "errors": self.errors,
+            "wall_s": round(self.wall, 3),
+            "throughput_rps": round(len(ms) / self.wall, 2) if self.wall else None,
+            "latency_ms": {
+                "p50": _round(percentile(ms, 50)),
+                "p95": _round(percentile(ms, 95)),
+                "p99": _round(percentile(ms, 99)),
+                "max": _round(max(ms) if ms else None),
+            },
+            "cpu_s": round(self.cpu, 3),
+            "peak_rss_kb": self.peak_rss_kb,
+            **self.extra,
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+async def bounded(concurrency: int, jobs: List[Callable]):
+    """ Run coroutine factories with at most `concurrency` in flight """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(job):
+        async with semaphore:
+            return await job()
+    return await asyncio.gather(*(run(job) for job in jobs))
+
+
+# ==================== Scenarios ====================
+
+async def upload(client: httpx.AsyncClient, file_type: str, name: str, scenario: Optional[Scenario] = None) -> Optional[str]:
+    request = client.post(f"/api/upload/{file_type}", files={"file": (f"{name}.c", bot_source(name))})
+    response = await (scenario.timed(request) if scenario else request)
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()["code_id"]
+
+
+async def wait_tested(client: httpx.AsyncClient, file_type: str, code_id: str, timeout: float = 60) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        status = (await client.get(f"/api/status/{file_type}/{code_id}")).json()
+        if status["status"] in TERMINAL_STATUSES:
+            return status
+        await asyncio.sleep(0.05)
+    return {"status": "timeout"}
+
+
+async def scenario_upload_burst(client, sampler, uploads: int, concurrency: int) -> Tuple[dict, List[str]]:
+    """ POST latency of the uploads, plus the time until each one is compiled and tested """
+    names = [GAME_BOTS[i % len(GAME_BOTS)] for i in range(uploads)]
+    ready_s: List[float] = []
+    failed = 0
+
+    with Scenario("upload_burst", sampler) as scenario:
+        async def job(name):
+            nonlocal failed
+            start = time.perf_counter()
+            code_id = await upload(client, "candidate", name, scenario)
+            if code_id is None:
+                return None
+            status = await wait_tested(client, "candidate", code_id)
+            if status["status"] == "success":
+                ready_s.append(time.perf_counter() - start)
+            else:
+                failed += 1
+            return code_id
+
+        code_ids = await bounded(concurrency, [lambda n=name: job(n) for name in names])
+
+    scenario.extra["ready_ms"] = {
+        "p50": _round(percentile([x * 1000 for x in ready_s], 50)),
+        "p95": _round(percentile([x * 1000 for x in ready_s], 95)),
+        "max": _round(max(ready_s) * 1000 if ready_s else None),
+    }
+    scenario.extra["pipeline_failures"] = failed
+    return scenario.result(), [c for c in code_ids if c]
+
+
+async def scenario_status_polling(client, sampler, code_ids: List[str], requests: int, concurrency: int) -> dict:
+    with Scenario("status_polling", sampler) as scenario:
+        jobs = [
+            lambda i=i: scenario.timed(client.get(f"/api/status/candidate/{code_ids[i % len(code_ids)]}"))
+            for i in range(requests)
+        ]
+        await bounded(concurrency, jobs)
+    return scenario.result()
+
+
+def _move_body(board, size, turn) -> dict:
+    return {"board": board, "size": size, "turn": turn}
+
+
+async def play_game(client, scenario: Scenario, path: str, size: int, rng: random.Random,
+                    max_moves: Optional[int] = None) -> int:
+    """ The bot plays black against a random white player; returns the bot moves played """
+    board = reversi.initial_board(size)
+    turn = 'B'
+    bot_moves = 0
+    while turn is not None and (max_moves is None or bot_moves < max_moves):
+        if turn == 'B':
+            response = await scenario.timed(client.post(path, json=_move_body(board, size, turn)))
+            if response is None or response.status_code != 200:
+                return bot_moves
+            move = response.json()
+            bot_moves += 1
+            if move["timeout"]:
+                scenario.extra["timeouts"] = scenario.extra.get("timeouts", 0) + 1
+            if move["timeout"] or not reversi.is_legal(board, size, turn, move["row"], move["col"]):
+                # Keep the game going with a legal move in place of the bot
+                row, col = reversi.legal_moves(board, size, turn)[0]
+                if not move["timeout"]:
+                    scenario.errors += 1
+            else:
+                row, col = move["row"], move["col"]
+        else:
+            row, col = rng.choice(reversi.legal_moves(board, size, turn))
+        board = reversi.apply_move(board, size, turn, row, col)
+        turn = reversi.next_turn(board, size, turn)
+    return bot_moves
+
+
+async def scenario_games(client, sampler, name: str, code_id: str, games: int, size: int,
+                         concurrency: int, seed: int) -> dict:
+    path = f"/api/move/custom/cache/{code_id}"
+    with Scenario(f"game_{name}", sampler) as scenario:
+        jobs = [
+            lambda g=g: play_game(client, scenario, path, size, random.Random(seed + g))
+            for g in range(games)
+        ]
+        moves = await bounded(concurrency, jobs)
+    scenario.extra["games"] = games
+    scenario.extra["board_size"] = size
+    scenario.extra["bot_moves"] = sum(moves)
+    return scenario.result()
+
+
+async def scenario_timeout(client, sampler, code_id: str, moves: int) -> dict:
+    path = f"/api/move/custom/cache/{code_id}"
+    with Scenario("timeout", sampler) as scenario:
+        await play_game(client, scenario, path, TIMEOUT_BOARD_SIZE, random.Random(0), max_moves=moves)
+    return scenario.result()
+
+
+async def run_scenarios(client: httpx.AsyncClient, sampler: ProcessSampler, args) -> Dict[str, dict]:
+    results = {}
+
+    # Game bots are uploaded as caches once, outside any measurement
+    bots = {}
+    for name in list(GAME_BOTS) + ([] if args.skip_timeout else ["timeout"]):
+        code_id = await upload(client, "cache", name)
+        status = await wait_tested(client, "cache", code_id) if code_id else {"status": "upload failed"}
+        if status["status"] != "success":
+            raise RuntimeError(f"Setup upload of bot '{name}' failed: {status}")
+        bots[name] = code_id
+
+    results["upload_burst"], code_ids = await scenario_upload_burst(client, sampler, args.uploads, args.concurrency)
+    if code_ids:
+        results["status_polling"] = await scenario_status_polling(
+            client, sampler, code_ids, args.polls, args.concurrency * 4
+        )
+    for name in GAME_BOTS:
+        results[f"game_{name}"] = await scenario_games(
+            client, sampler, name, bots[name], args.games, args.size, args.concurrency, args.seed
+        )
+    if not args.skip_timeout:
+        results["timeout"] = await scenario_timeout(client, sampler, bots["timeout"], args.timeout_moves)
+    return results
+
+
+# ==================== Targets ====================
+
+async def run_in_process(args) -> Dict[str, dict]:
+    """ Drive the ASGI app directly; CPU and RSS are this process's """
+    from app.main import app
+    from app.services.compile_profile import UPLOAD_PROFILE
+
+    UPLOAD_PROFILE.prepare_toolkit()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await run_scenarios(client, ProcessSampler(os.getpid()), args)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_uvicorn(args) -> Dict[str, dict]:
+    """ Spawn uvicorn in the workspace; CPU and RSS are the server's (all workers) """
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            for _ in range(200):
+                try:
+                    if (await client.get("/ping")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.05)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            return await run_scenarios(client, ProcessSampler(server.pid), args)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+# ==================== Report ====================
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVER_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_table(results: Dict[str, dict]):
+    print(f"{'scenario':<16}{'reqs':>7}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'cpu s':>8}{'rss MB':>8}")
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        print(f"{name:<16}{r['requests']:>7}{r['errors']:>5}{r['throughput_rps'] or 0:>9.1f}"
+              f"{lat['p50'] or 0:>10.2f}{lat['p95'] or 0:>10.2f}{lat['p99'] or 0:>10.2f}"
+              f"{r['cpu_s']:>8.2f}{r['peak_rss_kb'] / 1024:>8.1f}")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """ Scenarios whose p95 latency or throughput got worse than the baseline by more than `tolerance` """
+    regressions = []
+    for name, r in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        old_p95, new_p95 = old["latency_ms"]["p95"], r["latency_ms"]["p95"]
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old_p95:.2f} -> {new_p95:.2f} ms")
+        old_rps, new_rps = old["throughput_rps"], r["throughput_rps"]
+        if old_rps and new_rps and new_rps < old_rps * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old_rps:.1f} -> {new_rps:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the ReverC server")
+    parser.add_argument("--uvicorn", action="store_true", help="spawn uvicorn instead of running the app in-process")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers (with --uvicorn)")
+    parser.add_argument("--uploads", type=int, default=12, help="uploads in the burst")
+    parser.add_argument("--polls", type=int, default=500, help="status requests")
+    parser.add_argument("--games", type=int, default=8, help="games per bot")
+    parser.add_argument("--size", type=int, default=8, help="board size of the games")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--timeout-moves", type=int, default=2, help="moves of the timeout bot, ~3s each")
+    parser.add_argument("--skip-timeout", action="store_true")
+    parser.add_argument("--seed", type=int, default=105)
+    parser.add_argument("--rvc-dir", help="directory holding the real rvc.h and rvc_tools.c")
+    parser.add_argument("--output", help="result file (default benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression ratio against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the workspace")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    workspace = make_workspace(args.rvc_dir)
+    # The server and its test subprocesses resolve data/ from the cwd and import app from SERVER_DIR
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [SERVER_DIR, os.environ.get("PYTHONPATH")]))
+    # One client drives every scenario: measure the server, not the CPU quota (app.services.quota)
+    os.environ.setdefault("RVC_QUOTA", "0")
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        runner = run_uvicorn if args.uvicorn else run_in_process
+        results = asyncio.run(runner(args))
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Workspace kept at {workspace}")
+        else:
+            remove_workspace(workspace)
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now().isoformat(),
+            "mode": f"uvicorn x{args.workers}" if args.uvicorn else "in-process",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "client_cpu_s": round(resource.getrusage(resource.RUSAGE_SELF).ru_utime
+                                  + resource.getrusage(resource.RUSAGE_SELF).ru_stime, 3),
+            "args": vars(args),
+        },
+        "scenarios": results,
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{commit or 'unknown'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_table(results)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("mode") != report["meta"]["mode"]:
+            print(f"NOTE: baseline ran {baseline['meta'].get('mode')}, this run {report['meta']['mode']}")
+        regressions = compare(results, baseline["scenarios"], args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
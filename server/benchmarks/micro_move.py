@@ -0,0 +1,168 @@
+'''
+Microbenchmarks of the move hot path, from the server directory:
+
+    python -m benchmarks.micro_move
+    python -m benchmarks.micro_move --output micro.json
+    python -m benchmarks.micro_move --baseline micro.json
+
+Each step of CMoveCaller.call_make_move_105 is timed on its own (path check,
+CDLL, argtypes setup, board conversion, native call, result dict), then the
+whole call, request validation of FetchCodeMoveParams and the AI prompt
+builder in both board encodings, on an 8x8 opening and a 26x26 midgame
+board. The estimated prompt tokens of each encoding are printed last.
+
+Numbers are per call in microseconds: best and median of several timeit
+repeats. CDLL is timed on an already loaded library, which is what every
+move after the first one pays: dlopen only bumps a reference count.
+'''
+
+import argparse
+import ctypes
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+from app.ai.prompt import Prompt, estimate_tokens
+from app.routers.schemas import FetchAIMoveParams, FetchCodeMoveParams
+from app.services import reversi
+from app.services.call_c import CMoveCaller, Board26x26
+from benchmarks.workspace import BOTS, make_workspace, remove_workspace
+
+BOT = "scan"
+REPEATS = 7
+
+
+def bench(func: Callable, repeats: int = REPEATS, min_time: float = 0.2) -> Dict[str, float]:
+    """ Per-call time in microseconds, best and median over `repeats` timeit runs """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number * 1_000_000 for t in timer.repeat(repeat=repeats, number=number)]
+    return {"best_us": round(min(runs), 3), "median_us": round(statistics.median(runs), 3), "loops": number}
+
+
+def build_bot(workspace: str) -> str:
+    """ Compile the benchmark bot into the workspace; returns its data_path for call_make_move_105 """
+    source = os.path.join(workspace, "data/c_src/archives/bench", f"{BOT}.c")
+    output = os.path.join(workspace, "data/shared_libs/archives/bench", f"{BOT}.so")
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(source, "w") as f:
+        f.write(BOTS[BOT])
+    subprocess.run(["gcc", "-O2", "-std=c99", "-fPIC", "-shared", "-o", output, source], check=True)
+    return f"archives/bench/{BOT}"
+
+
+def boards() -> List[Tuple[str, reversi.Board, int, str]]:
+    """ (label, board, size, turn): the 8x8 opening and a 26x26 midgame """
+    big, turn = reversi.random_playout(26, 60, random.Random(105))
+    return [
+        ("8x8", reversi.initial_board(8), 8, 'B'),
+        ("26x26", big, 26, turn),
+    ]
+
+
+def run(data_path: str) -> Dict[str, dict]:
+    so_path = f"data/shared_libs/{data_path}.so"
+    lib = ctypes.CDLL(so_path)
+    _, make_move = CMoveCaller.load_make_move(so_path)
+    results = {}
+
+    # ----- Steps of call_make_move_105 -----
+    results["path_check"] = bench(lambda: os.path.exists(so_path))
+    results["cdll"] = bench(lambda: ctypes.CDLL(so_path))
+
+    def setup_argtypes():
+        func = lib.makeMove
+        func.argtypes = [Board26x26, ctypes.c_int, ctypes.c_char,
+                         ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+        func.restype = ctypes.c_int
+    results["argtypes"] = bench(setup_argtypes)
+
+    row, col = ctypes.c_int(), ctypes.c_int()
+    results["result_dict"] = bench(lambda: {
+        "row": row.value, "col": col.value, "elapsed": 0, "returnValue": 0, "timeout": False
+    })
+
+    for label, board, size, turn in boards():
+        board_array = CMoveCaller.marshal_board(board)
+        turn_byte = turn.encode()
+        body = {"board": board, "size": size, "turn": turn}
+        body_json = json.dumps(body)
+        moves = [{"row": r, "col": c} for r, c in reversi.legal_moves(board, size, turn)]
+        ai_params = FetchAIMoveParams(board=board, size=size, turn=turn, availableMoves=moves, lastMove=None)
+
+        results[f"marshal_{label}"] = bench(lambda: CMoveCaller.marshal_board(board))
+        results[f"native_{label}"] = bench(
+            lambda: make_move(board_array, size, turn_byte, ctypes.byref(row), ctypes.byref(col))
+        )
+        results[f"call_make_move_105_{label}"] = bench(
+            lambda: CMoveCaller.call_make_move_105(board=board, size=size, turn=turn, data_path=data_path)
+        )
+        results[f"validate_params_{label}"] = bench(lambda: FetchCodeMoveParams.model_validate(body))
+        results[f"validate_params_json_{label}"] = bench(lambda: FetchCodeMoveParams.model_validate_json(body_json))
+        results[f"prompt_{label}"] = bench(lambda: Prompt.get_put_prompt_normal(ai_params))
+        results[f"prompt_grid_{label}"] = bench(lambda: Prompt.get_put_prompt_grid(ai_params))
+
+    return results
+
+
+def prompt_tokens() -> Dict[str, Dict[str, int]]:
+    """ Estimated prompt tokens per board and encoding """
+    tokens = {}
+    for label, board, size, turn in boards():
+        moves = [{"row": r, "col": c} for r, c in reversi.legal_moves(board, size, turn)]
+        params = FetchAIMoveParams(board=board, size=size, turn=turn, availableMoves=moves, lastMove=None)
+        tokens[label] = {encoding: estimate_tokens(Prompt.get_put_prompt(params, encoding))
+                         for encoding in ("json", "grid")}
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the move hot path")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="earlier JSON result to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown ratio of the median")
+    args = parser.parse_args()
+
+    workspace = make_workspace()
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        results = run(build_bot(workspace))
+    finally:
+        os.chdir(cwd)
+        remove_workspace(workspace)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print(f"{'benchmark':<32}{'best us':>12}{'median us':>12}{'baseline':>12}")
+    regressions = []
+    for name, r in results.items():
+        old = baseline.get(name, {}).get("median_us")
+        print(f"{name:<32}{r['best_us']:>12.3f}{r['median_us']:>12.3f}{old if old is not None else '':>12}")
+        if old and r["median_us"] > old * (1 + args.tolerance):
+            regressions.append(f"{name}: {old:.3f} -> {r['median_us']:.3f} us")
+
+    print(f"\n{'prompt tokens (estimate)':<32}{'json':>12}{'grid':>12}")
+    for label, counts in prompt_tokens().items():
+        print(f"{label:<32}{counts['json']:>12}{counts['grid']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    for line in regressions:
+        print(f"REGRESSION: {line}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
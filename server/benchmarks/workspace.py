@@ -0,0 +1,159 @@
+'''
+Throwaway data/ tree and synthetic C bots for the benchmarks.
+
+The server resolves every path relative to its working directory, so a
+benchmark builds a fresh workspace in a temp dir and chdirs (or starts
+uvicorn) there. The real rvc.h / rvc_tools.c are not in the repository;
+pass their directory with --rvc-dir to benchmark against them, otherwise
+a minimal stand-in is written.
+'''
+
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATA_DIRS = [
+    "data/c_src/archives", "data/c_src/candidates", "data/c_src/caches",
+    "data/shared_libs/archives", "data/shared_libs/candidates", "data/shared_libs/caches",
+    "data/status/candidates", "data/status/caches", "data/stats",
+]
+
+STUB_RVC_H = '''#ifndef RVC_H
+#define RVC_H
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+bool rvc_inBounds(int n, int row, int col);
+int makeMove(const char board[][26], int n, char turn, int *row, int *col);
+#endif
+'''
+
+STUB_RVC_TOOLS = '''#include "rvc.h"
+bool rvc_inBounds(int n, int row, int col) { return row >= 0 && row < n && col >= 0 && col < n; }
+'''
+
+# Shared by the bots: number of discs `turn` flips by playing (r, c)
+_FLIPS = '''
+static int bench_flips(const char board[][26], int n, char turn, int r, int c) {
+    char opp = turn == 'B' ? 'W' : 'B';
+    int total = 0;
+    if (board[r][c] != 'U') return 0;
+    for (int dr = -1; dr <= 1; dr++) for (int dc = -1; dc <= 1; dc++) {
+        if (!dr && !dc) continue;
+        int k = 1, cnt = 0;
+        while (r + dr * k >= 0 && r + dr * k < n && c + dc * k >= 0 && c + dc * k < n
+               && board[r + dr * k][c + dc * k] == opp) { k++; cnt++; }
+        if (cnt && r + dr * k >= 0 && r + dr * k < n && c + dc * k >= 0 && c + dc * k < n
+            && board[r + dr * k][c + dc * k] == turn) total += cnt;
+    }
+    return total;
+}
+'''
+
+# Synthetic bots of increasing cost. All of them play legal moves, so they
+# pass the upload validation suite.
+BOTS = {
+    # First legal move in row-major order
+    "instant": _FLIPS + '''
+int makeMove(const char board[][26], int n, char turn, int *row, int *col) {
+    for (int r = 0; r < n; r++) for (int c = 0; c < n; c++)
+        if (bench_flips(board, n, turn, r, c)) { *row = r; *col = c; return 0; }
+    return 0;
+}
+''',
+    # Greedy: scores every square, O(n^2) scans of up to n in 8 directions
+    "scan": _FLIPS + '''
+int makeMove(const char board[][26], int n, char turn, int *row, int *col) {
+    int best = 0;
+    for (int r = 0; r < n; r++) for (int c = 0; c < n; c++) {
+        int f = bench_flips(board, n, turn, r, c);
+        if (f > best) { best = f; *row = r; *col = c; }
+    }
+    return 0;
+}
+''',
+    # Two-ply search: maximise own flips minus the opponent's best reply
+    "search": "#include <string.h>\n" + _FLIPS + '''
+static void bench_play(char b[][26], int n, char turn, int r, int c) {
+    char opp = turn == 'B' ? 'W' : 'B';
+    b[r][c] = turn;
+    for (int dr = -1; dr <= 1; dr++) for (int dc = -1; dc <= 1; dc++) {
+        if (!dr && !dc) continue;
+        int k = 1;
+        while (r + dr * k >= 0 && r + dr * k < n && c + dc * k >= 0 && c + dc * k < n
+               && b[r + dr * k][c + dc * k] == opp) k++;
+        if (k > 1 && r + dr * k >= 0 && r + dr * k < n && c + dc * k >= 0 && c + dc * k < n
+            && b[r + dr * k][c + dc * k] == turn)
+            for (int j = 1; j < k; j++) b[r + dr * j][c + dc * j] = turn;
+    }
+}
+
+int makeMove(const char board[][26], int n, char turn, int *row, int *col) {
+    static char b[26][26];
+    char opp = turn == 'B' ? 'W' : 'B';
+    int best = -1000000;
+    for (int r = 0; r < n; r++) for (int c = 0; c < n; c++) {
+        int f = bench_flips(board, n, turn, r, c);
+        if (!f) continue;
+        memcpy(b, board, sizeof(b));
+        bench_play(b, n, turn, r, c);
+        int reply = 0;
+        for (int rr = 0; rr < n; rr++) for (int cc = 0; cc < n; cc++) {
+            int g = bench_flips((const char (*)[26]) b, n, opp, rr, cc);
+            if (g > reply) reply = g;
+        }
+        if (f - reply > best) { best = f - reply; *row = r; *col = c; }
+    }
+    return 0;
+}
+''',
+    # Legal everywhere, but spins past MAKE_MOVE_TIME_LIMIT on 10x10 boards,
+    # a size the validation suite does not use
+    "timeout": _FLIPS + '''
+#include <time.h>
+int makeMove(const char board[][26], int n, char turn, int *row, int *col) {
+    if (n == 10) {
+        clock_t start = clock();
+        volatile unsigned long spin = 0;
+        while ((double)(clock() - start) / CLOCKS_PER_SEC < 3.2) spin++;
+    }
+    for (int r = 0; r < n; r++) for (int c = 0; c < n; c++)
+        if (bench_flips(board, n, turn, r, c)) { *row = r; *col = c; return 0; }
+    return 0;
+}
+''',
+}
+
+# Board size the timeout bot misbehaves on
+TIMEOUT_BOARD_SIZE = 10
+
+
+def make_workspace(rvc_dir: Optional[str] = None) -> str:
+    """ Create a temp dir with the data/ layout the server expects; returns its path """
+    root = tempfile.mkdtemp(prefix="reverc-bench-")
+    for d in DATA_DIRS:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    for file_type in ("candidates", "caches"):
+        target = os.path.join(root, "data/c_src", file_type)
+        for fname, stub in (("rvc.h", STUB_RVC_H), ("rvc_tools.c", STUB_RVC_TOOLS)):
+            source = os.path.join(rvc_dir, fname) if rvc_dir else None
+            if source and os.path.exists(source):
+                shutil.copy(source, os.path.join(target, fname))
+            else:
+                with open(os.path.join(target, fname), "w") as f:
+                    f.write(stub)
+    return root
+
+
+def remove_workspace(root: str):
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def bot_source(name: str) -> bytes:
+    """ Upload body of a bot, without the rvc.h include the server prepends """
+    return BOTS[name].encode()